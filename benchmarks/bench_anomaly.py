@@ -0,0 +1,111 @@
+import os
+import sys
+import math
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gps_anomaly import detect_anomalies, find_bad_points, find_runs, MAX_DIST_PER_POINT
+
+# 配列版の異常検知と、従来の1地点ずつのループ版を比較する。
+#
+#   python benchmarks/bench_anomaly.py --points 100000 1000000
+
+
+def calculate_distance(p1, p2):
+    R = 6371000 # 地球半径(m)
+    lat1, lon1, lat2, lon2 = map(math.radians, [p1[0], p1[1], p2[0], p2[1]])
+    dlat, dlon = lat2 - lat1, lon2 - lon1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+
+def detect_anomalies_loop(pts, duration_sec):
+    """ 従来の run_diagnosis のループ (比較用) """
+    invalid_segments = []
+    current_invalid_seg = []
+    valid_pts = []
+    invalid_ranges = []
+    is_collecting_invalid = False
+    start_invalid_idx = 0
+
+    for i in range(len(pts)):
+        p_curr = pts[i]
+        is_bad = False
+        if p_curr == [0,0]:
+            is_bad = True
+        elif i > 0:
+            if calculate_distance(pts[i-1], p_curr) > MAX_DIST_PER_POINT:
+                is_bad = True
+
+        if is_bad:
+            if not is_collecting_invalid:
+                is_collecting_invalid = True
+                start_invalid_idx = i
+                current_invalid_seg = []
+                if i > 0:
+                    current_invalid_seg.append(pts[i-1])
+                current_invalid_seg.append(p_curr)
+            else:
+                current_invalid_seg.append(p_curr)
+        else:
+            if is_collecting_invalid:
+                start_sec = round((start_invalid_idx / len(pts)) * duration_sec, 2)
+                end_sec = round((i / len(pts)) * duration_sec, 2)
+                invalid_ranges.append((start_sec, end_sec))
+                invalid_segments.append(current_invalid_seg)
+                is_collecting_invalid = False
+            valid_pts.append(p_curr)
+
+    if is_collecting_invalid:
+        start_sec = round((start_invalid_idx / len(pts)) * duration_sec, 2)
+        invalid_ranges.append((start_sec, round(duration_sec, 2)))
+        invalid_segments.append(current_invalid_seg)
+
+    return invalid_ranges, invalid_segments, valid_pts
+
+
+def synthetic_track(n, seed=0):
+    """ 約18Hzで走行するトラックに未捕捉(0,0)と跳びを混ぜる """
+    rng = np.random.default_rng(seed)
+    lat = 35.68 + np.cumsum(rng.normal(0, 2e-6, n))
+    lon = 139.76 + np.cumsum(rng.normal(5e-6, 2e-6, n))
+    for start in rng.integers(0, n, max(n // 5000, 1)):
+        lat[start:start + 20] = 0
+        lon[start:start + 20] = 0
+    jumps = rng.integers(1, n, max(n // 2000, 1))
+    lat[jumps] += 0.01
+    return lat, lon, n / 18.0
+
+
+def timeit(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t0, result
+
+
+def same_result(loop, arrays):
+    """ ループ版 (リスト) と配列版 (区間・点は配列) の結果が同じか """
+    ranges, segments, valid = arrays
+    return loop == (ranges, [seg.tolist() for seg in segments], valid.tolist())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GPS異常検知のベンチマーク")
+    parser.add_argument("--points", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args(argv)
+
+    # numpy(s) は地図表示用の区間・点の配列の作成まで含めた時間、判定(s) は判定と区間抽出のみ
+    print(f"{'points':>10} {'loop(s)':>10} {'numpy(s)':>10} {'判定(s)':>9} {'speedup':>8}  same")
+    for n in args.points:
+        lat, lon, duration = synthetic_track(n)
+        pts = np.column_stack((lat, lon)).tolist()
+        t_loop, r_loop = timeit(detect_anomalies_loop, pts, duration)
+        t_np, r_np = timeit(detect_anomalies, lat, lon, duration)
+        t_mask, _ = timeit(lambda: find_runs(find_bad_points(lat, lon)))
+        print(f"{n:>10} {t_loop:>10.3f} {t_np:>10.3f} {t_mask:>9.3f} {t_loop / t_np:>7.1f}x  {same_result(r_loop, r_np)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mp4_index import read_metadata
+from gpmf_reader import read_gps, write_gpx
+
+# ベンチマーク・動作確認用の exiftool の代役 (-stay_open True -@ - の常駐モードだけ対応)。
+# 本物の exiftool が無い環境でも、プール・パイプライン全体を通して計測できるようにする。
+#   -j ...           : mp4_index で読んだメタデータを JSON で返す
+#   -p gpx.fmt ...   : GPMFを読んで gpx.fmt と同じ形式のGPXを返す
+#   -TAG=値 ...       : 何もせず "1 image files updated" を返す
+
+
+def run_command(args, out):
+    path = args[-1] if args else ""
+    if "-j" in args:
+        meta = read_metadata(path)
+        meta.setdefault("CreationDate", "2024:05:01 11:20:00+09:00")
+        meta["SourceFile"] = path
+        out.write(json.dumps([meta]).encode() + b"\n")
+    elif "-p" in args:
+        text = io.StringIO()
+        write_gpx(read_gps(path), text, os.path.basename(path))
+        out.write(text.getvalue().encode("utf-8"))
+    else:
+        out.write(b"    1 image files updated\n")
+
+
+def main():
+    out = sys.stdout.buffer
+    args = []
+    for line in sys.stdin:
+        line = line.rstrip("\r\n")
+        if line.startswith("-execute"):
+            marker = args[args.index("-echo4") + 1] if "-echo4" in args else ""
+            cmd = [a for a in args if a not in ("-echo4", marker)]
+            try:
+                run_command(cmd, out)
+            except Exception as e:
+                sys.stderr.write(f"Error: {e}\n")
+            out.write(f"{{ready{line[8:]}}}\n".encode())
+            out.flush()
+            sys.stderr.write(marker + "\n")
+            sys.stderr.flush()
+            args = []
+        elif line == "-stay_open":
+            if sys.stdin.readline().strip() == "False":
+                break
+        else:
+            args.append(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import sys
+import time
+import zlib
+import struct
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 地図タイルサーバーの代役 (ベンチマーク・動作確認用)。
+# /{z}/{x}/{y}.png に座標ごとに色を変えた 256x256 の PNG を返す。
+# --delay で細い回線を、サーバーを止めることでオフラインを再現できる。
+#
+#   python benchmarks/fake_tile_server.py --port 8765 --delay 0.2
+#   GOPRO_TILE_URL=http://127.0.0.1:8765/{z}/{x}/{y}.png python gopro_gps_analizer.py
+
+
+def make_png(r, g, b, size=256):
+    """ 単色の PNG """
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    row = b'\0' + bytes((r, g, b)) * size
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(row * size)) +
+            chunk(b'IEND', b''))
+
+
+def tile_png(z, x, y):
+    return make_png((x * 37) % 256, (y * 59) % 256, (z * 13) % 256)
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or not parts[2].endswith(".png"):
+            self.send_error(404)
+            return
+        try:
+            z, x, y = int(parts[0]), int(parts[1]), int(parts[2][:-4])
+        except ValueError:
+            self.send_error(404)
+            return
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            self.send_error(404)
+            return
+        with TileHandler.lock:
+            TileHandler.requests += 1
+        time.sleep(self.delay)
+        data = tile_png(z, x, y)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=0, delay=0.0):
+    """ 別スレッドでサーバーを起動し (server, URLテンプレート) を返す。port=0 なら空きポート """
+    handler = type("Handler", (TileHandler,), {"delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/{{z}}/{{x}}/{{y}}.png"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="地図タイルサーバーの代役")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="1枚あたりの応答の遅れ (秒)")
+    args = parser.parse_args(argv)
+    server, url = serve(args.port, args.delay)
+    print(f"GOPRO_TILE_URL={url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
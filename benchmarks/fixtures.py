@@ -0,0 +1,141 @@
+import os
+import sys
+import struct
+from datetime import datetime, timezone
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gpmf_reader import GPSData, write_gpx
+
+# ベンチマーク用の合成データ (GPX と、GPMFトラックを持つ .360 相当のMP4)。
+# 約18Hzで走行するトラックに、未捕捉(0,0)・跳び・GPSペイロードの欠落を混ぜる。
+# 生成したファイルは benchmarks/.fixtures に置き、同じ点数なら使い回す。
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".fixtures")
+RATE = 18.0 # GPS サンプル/秒
+PAYLOAD_SEC = 1.001 # GPMF 1ペイロードの長さ
+START_TIME = 1714530000.0 # 2024-05-01 02:20:00 UTC
+FPS = 29.97
+
+
+def synthetic_track(n, seed=0):
+    """ (lat, lon, alt, time) の配列と、ペイロード単位の欠落位置を返す """
+    rng = np.random.default_rng(seed)
+    lat = 35.68 + np.cumsum(rng.normal(0, 2e-6, n))
+    lon = 139.76 + np.cumsum(rng.normal(5e-6, 2e-6, n))
+    alt = 40 + np.cumsum(rng.normal(0, 0.05, n))
+    time = START_TIME + np.arange(n) / RATE
+    # 未捕捉 (約5000点に1回、20点)
+    for start in rng.integers(0, n, max(n // 5000, 1)):
+        lat[start:start + 20] = 0
+        lon[start:start + 20] = 0
+    # 跳び (約2000点に1回)
+    jumps = rng.integers(1, n, max(n // 2000, 1))
+    lat[jumps] += 0.01
+    # GPSペイロードの欠落 (約500ペイロードに1回)
+    payloads = int(np.ceil(n / RATE))
+    dropped = set(rng.integers(1, payloads, max(payloads // 500, 1)).tolist()) if payloads > 1 else set()
+    return lat, lon, alt, time, dropped
+
+
+def make_gps(n, seed=0):
+    lat, lon, alt, time, _ = synthetic_track(n, seed)
+    return GPSData.from_arrays(lat, lon, alt, time)
+
+
+def write_gpx_fixture(path, n, seed=0):
+    with open(path, "w", encoding="utf-8") as f:
+        write_gpx(make_gps(n, seed), f, os.path.basename(path))
+
+
+def _atom(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def _full(kind, body, version=0):
+    return _atom(kind, struct.pack('>I', version << 24) + body)
+
+
+def _klv(key, type_char, size, data, repeat):
+    return key + struct.pack('>cBH', type_char, size, repeat) + data + b'\0' * (-len(data) % 4)
+
+
+def _payload(t0, gps5):
+    gpsu = datetime.fromtimestamp(t0, timezone.utc).strftime('%y%m%d%H%M%S.%f')[:16].encode()
+    strm = (_klv(b'STNM', b'c', 1, b'GPS', 3) +
+            _klv(b'GPSU', b'U', 16, gpsu, 1) +
+            _klv(b'SCAL', b'l', 4, struct.pack('>5i', 10000000, 10000000, 1000, 1000, 100), 5))
+    if len(gps5):
+        strm += _klv(b'GPS5', b'l', 20, gps5.tobytes(), len(gps5))
+    devc = _klv(b'DVID', b'L', 4, struct.pack('>I', 1), 1) + _klv(b'STRM', b'\0', 1, strm, len(strm))
+    return _klv(b'DEVC', b'\0', 1, devc, len(devc))
+
+
+def _sample_table(sizes, offsets, delta):
+    stsd = _full(b'stsd', struct.pack('>I', 1) + _atom(b'gpmd', b'\0' * 8))
+    stts = _full(b'stts', struct.pack('>III', 1, len(sizes), delta))
+    stsz = _full(b'stsz', struct.pack('>II', 0, len(sizes)) + np.asarray(sizes, dtype='>u4').tobytes())
+    stsc = _full(b'stsc', struct.pack('>IIII', 1, 1, 1, 1))
+    co64 = _full(b'co64', struct.pack('>I', len(offsets)) + np.asarray(offsets, dtype='>u8').tobytes())
+    return _atom(b'stbl', stsd + stts + stsz + stsc + co64)
+
+
+def _trak(track_id, handler, duration, timescale, stbl):
+    tkhd = _full(b'tkhd', struct.pack('>IIII', 0, 0, track_id, 0) + struct.pack('>I', duration) + b'\0' * 60)
+    mdhd = _full(b'mdhd', struct.pack('>IIII', 0, 0, timescale, duration) + b'\0' * 4)
+    hdlr = _full(b'hdlr', struct.pack('>I4s', 0, handler) + b'\0' * 12 + b'\0')
+    return _atom(b'trak', tkhd + _atom(b'mdia', mdhd + hdlr + _atom(b'minf', stbl)))
+
+
+def write_gpmf_fixture(path, n, seed=0, timescale=1000):
+    """ GPMFトラック (gpmd) と空の映像トラックを持つMP4を書き出す """
+    lat, lon, alt, _, dropped = synthetic_track(n, seed)
+    gps5 = np.zeros((n, 5), dtype='>i4')
+    gps5[:, 0] = np.round(lat * 1e7)
+    gps5[:, 1] = np.round(lon * 1e7)
+    gps5[:, 2] = np.round(alt * 1000)
+
+    per = int(RATE)
+    delta = int(PAYLOAD_SEC * timescale)
+    ftyp = _atom(b'ftyp', b'mp41' + b'\0' * 4)
+    sizes, offsets = [], []
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        mdat_pos = f.tell()
+        f.write(struct.pack('>I4sQ', 1, b'mdat', 0)) # 64bit サイズは最後に書き込む
+        for k, i in enumerate(range(0, n, per)):
+            chunk = gps5[i:i + per] if k not in dropped else gps5[:0]
+            data = _payload(START_TIME + k * PAYLOAD_SEC, chunk)
+            offsets.append(f.tell())
+            sizes.append(len(data))
+            f.write(data)
+        mdat_end = f.tell()
+        f.seek(mdat_pos + 8)
+        f.write(struct.pack('>Q', mdat_end - mdat_pos))
+        f.seek(mdat_end)
+
+        duration = delta * len(sizes)
+        frames = int(duration / timescale * FPS)
+        video_stbl = _atom(b'stbl', _full(b'stsd', struct.pack('>I', 1) + _atom(b'avc1', b'\0' * 8)) +
+                           _full(b'stts', struct.pack('>III', 1, frames, int(timescale / FPS))) +
+                           _full(b'stsz', struct.pack('>II', 1, frames)) +
+                           _full(b'stsc', struct.pack('>IIII', 1, 1, frames, 1)) +
+                           _full(b'stco', struct.pack('>II', 1, 0)))
+        created = int((datetime.fromtimestamp(START_TIME, timezone.utc) -
+                       datetime(1904, 1, 1, tzinfo=timezone.utc)).total_seconds())
+        mvhd = _full(b'mvhd', struct.pack('>IIII', created, created, timescale, duration) + b'\0' * 80)
+        f.write(_atom(b'moov', mvhd +
+                      _trak(1, b'vide', duration, timescale, video_stbl) +
+                      _trak(2, b'meta', duration, timescale, _sample_table(sizes, offsets, delta))))
+
+
+def fixture(kind, n, seed=0):
+    """ 'gpx' / 'gpmf' の合成ファイルのパス (無ければ作る) """
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    ext = {"gpx": ".gpx", "gpmf": ".360"}[kind]
+    path = os.path.join(FIXTURE_DIR, f"{kind}_{n}_{seed}{ext}")
+    if not os.path.exists(path):
+        tmp = path + ".tmp"
+        (write_gpx_fixture if kind == "gpx" else write_gpmf_fixture)(tmp, n, seed)
+        os.replace(tmp, path)
+    return path
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+from datetime import datetime, timezone
+
+# 起動時の import にかかる時間を python -X importtime で測り、予算と比べる。
+# GUIの2本はウィンドウを出すまでに読み込むモジュール (Qt の画面部品と軽いモジュール) だけで
+# 起動するようにしてあり (処理本体・numpy・QtWebEngineWidgets は表示後に読み込む)、
+# 誰かが先頭に重い import を足すとここで予算超過になる。
+#
+#   python benchmarks/import_budget.py            # 予算超過があれば終了コード 1
+#   python benchmarks/import_budget.py --top 15   # 時間のかかっているモジュールも表示
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+from telemetry_cache import default_cache_dir
+
+# 計測の履歴はマシンごとのものなので、作業ツリーではなくキャッシュ置き場に残す
+RESULTS = os.path.join(default_cache_dir("benchmarks"), "import_results.jsonl")
+
+# モジュール -> 予算 (ミリ秒, 累積)。PySide6 の読み込み (QtWidgets + QtWebEngineCore) に 250ms 程度を見込む
+BUDGET_MS = {
+    "gopro_gps_analizer": 350,
+    "gopro_streetview_helper": 350,
+    "exiftool_pool": 60,
+    "pipeline_trace": 50,
+    "gopro_batch": 300,
+}
+# GUIの起動時に読み込まれてはいけないモジュール
+FORBIDDEN_AT_STARTUP = ("numpy", "PySide6.QtWebEngineWidgets", "gopro_pipeline", "urllib.request")
+GUI_MODULES = ("gopro_gps_analizer", "gopro_streetview_helper")
+
+
+def import_times(module, repeat=3):
+    """ {モジュール名: 累積マイクロ秒} (repeat 回のうち最短)。読み込めなければ (None, エラー) """
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=ROOT, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return None, proc.stderr.strip().splitlines()[-1]
+        times = {}
+        for line in proc.stderr.splitlines():
+            # import time:  self [us] | cumulative | imported package
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            try:
+                _, cumulative, name = line[len("import time:"):].split("|")
+                times[name.strip()] = int(cumulative)
+            except ValueError:
+                continue
+        if best is None or times.get(module, 0) < best.get(module, 0):
+            best = times
+    return best, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="起動時の import 時間の予算チェック")
+    parser.add_argument("--top", type=int, default=0, help="時間のかかっているモジュールを表示する数")
+    parser.add_argument("--results", default=RESULTS, help="結果を追記する JSONL")
+    parser.add_argument("--no-save", action="store_true", help="結果を保存しない")
+    args = parser.parse_args(argv)
+
+    over = 0
+    results = {}
+    for module, budget in BUDGET_MS.items():
+        times, error = import_times(module)
+        if times is None:
+            print(f"{module:<26} skip ({error})")
+            continue
+        ms = times[module] / 1000
+        results[module] = round(ms, 1)
+        status = "OK" if ms <= budget else "OVER"
+        over += status == "OVER"
+        print(f"{module:<26} {ms:8.1f} ms / {budget} ms  {status}")
+        if module in GUI_MODULES:
+            loaded = [m for m in FORBIDDEN_AT_STARTUP if m in times]
+            if loaded:
+                over += 1
+                print(f"  起動時に読み込まれています: {', '.join(loaded)}")
+        if args.top:
+            for name, us in sorted(times.items(), key=lambda kv: -kv[1])[1:args.top + 1]:
+                print(f"    {name:<40} {us / 1000:8.1f} ms")
+
+    if not args.no_save and results:
+        record = {"date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                  "python": sys.version.split()[0], "results": results}
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+from fixtures import fixture, FPS
+from exiftool_pool import get_pool
+from gpmf_reader import read_gps
+from gps_anomaly import detect_anomalies, video_timeline, sample_rate, find_gaps
+from track_simplify import build_pyramid, pack_coords
+from track_index import TrackIndex
+from gopro_pipeline import parse_gpx, run_diagnosis, process_files
+from telemetry_cache import default_cache_dir
+
+# 抽出・診断・地図用の変換・パイプライン全体を合成データで計測し、結果を履歴に追記する。
+# 前回の結果 (同じマシン・同じ点数) より遅くなったケースは REGRESSION と表示する。
+# 履歴はマシンごとのものなので、作業ツリーではなくキャッシュ置き場に残す (--results で変更できる)。
+#
+#   python benchmarks/run_benchmarks.py                       # 1k / 10k / 100k / 1M 点
+#   python benchmarks/run_benchmarks.py --sizes 1000 5000000  # 5M 点も計測 (数分かかる)
+#   python benchmarks/run_benchmarks.py --cases parse_gpx detect
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+RESULTS = os.path.join(default_cache_dir("benchmarks"), "results.jsonl")
+FAKE_EXIFTOOL = os.path.join(BENCH_DIR, "fake_exiftool.py")
+REGRESSION_RATIO = 1.2 # 前回より 20% 以上遅ければ回帰とみなす
+
+
+def case_parse_gpx(n, workdir):
+    path = fixture("gpx", n)
+    return lambda: parse_gpx(path)
+
+
+def case_read_gps(n, workdir):
+    path = fixture("gpmf", n)
+    return lambda: read_gps(path)
+
+
+def case_detect(n, workdir):
+    """ run_diagnosis の異常検知部分 (時刻の対応付け・判定・欠落検出) """
+    gps = read_gps(fixture("gpmf", n))
+    lat, lon = np.frombuffer(gps.lat), np.frombuffer(gps.lon)
+
+    def run():
+        timeline = video_timeline(gps.time, gps.sync_utc, gps.sync_video)
+        detect_anomalies(lat, lon, float(timeline[-1]), timeline=timeline, fps=FPS)
+        find_gaps(timeline, sample_rate(timeline))
+    return run
+
+
+def case_map_json(n, workdir):
+    """ 以前の地図への受け渡し (全座標を JSON 文字列にする) """
+    gps = read_gps(fixture("gpmf", n))
+    lat, lon = np.frombuffer(gps.lat), np.frombuffer(gps.lon)
+    return lambda: json.dumps(np.column_stack((lat, lon)).tolist())
+
+
+def case_map_pyramid(n, workdir):
+    """ 現在の地図への受け渡し (間引きピラミッド + Float64 バッファ) """
+    gps = read_gps(fixture("gpmf", n))
+    lat, lon = np.frombuffer(gps.lat), np.frombuffer(gps.lon)
+    return lambda: [pack_coords(c[:, 0], c[:, 1]) for _, c in build_pyramid(lat, lon)]
+
+
+def case_index_build(n, workdir):
+    """ クリック位置を引く索引の作成 (トラック1本につき1回) """
+    gps = read_gps(fixture("gpmf", n))
+    lat, lon = np.frombuffer(gps.lat), np.frombuffer(gps.lon)
+    timeline = video_timeline(gps.time, gps.sync_utc, gps.sync_video)
+    return lambda: TrackIndex(lat, lon, timeline, gps.time)
+
+
+def case_index_query(n, workdir):
+    """ 索引の検索 1000 回 (トラックの近くの位置、30m 以内)。1回あたりはこの 1/1000 """
+    gps = read_gps(fixture("gpmf", n))
+    lat, lon = np.frombuffer(gps.lat), np.frombuffer(gps.lon)
+    index = TrackIndex(lat, lon, video_timeline(gps.time, gps.sync_utc, gps.sync_video), gps.time)
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, len(lat), 1000)
+    points = np.column_stack((lat[picks], lon[picks])) + rng.normal(0, 1e-4, (1000, 2))
+
+    def run():
+        for la, lo in points:
+            index.lookup(la, lo, 30)
+    return run
+
+
+def case_diagnosis(n, workdir):
+    """ run_diagnosis 全体 (メタデータ → GPS抽出 → 異常検知)。キャッシュは使わない """
+    path = fixture("gpmf", n)
+    exiftool = get_pool(FAKE_EXIFTOOL)
+    return lambda: run_diagnosis(exiftool, path)
+
+
+def case_process(n, workdir):
+    """ process_files 全体 (時刻修正した _fixed.mp4 の作成 + GPX作成) """
+    path = fixture("gpmf", n)
+    mp4 = os.path.join(workdir, f"export_{n}.mp4")
+    shutil.copyfile(path, mp4)
+    exiftool = get_pool(FAKE_EXIFTOOL)
+    return lambda: process_files(exiftool, path, mp4, overwrite=False)
+
+
+CASES = {
+    "parse_gpx": case_parse_gpx,
+    "read_gps": case_read_gps,
+    "detect": case_detect,
+    "map_json": case_map_json,
+    "map_pyramid": case_map_pyramid,
+    "index_build": case_index_build,
+    "index_query": case_index_query,
+    "diagnosis": case_diagnosis,
+    "process": case_process,
+}
+
+
+def measure(fn, repeat):
+    """ repeat 回実行して最短時間(秒)を返す """
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def machine():
+    return f"{platform.node()} {platform.machine()} {platform.python_version()}"
+
+
+def load_previous(path):
+    """ 同じマシンでの直前の結果 {case: {size: 秒}} """
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("machine") == machine():
+                last = rec
+    return last
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GPS抽出・診断のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="点数")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3, help="繰り返し回数 (最短時間を記録)")
+    parser.add_argument("--results", default=RESULTS, help="結果を追記する JSONL")
+    parser.add_argument("--no-save", action="store_true", help="結果を保存しない")
+    args = parser.parse_args(argv)
+
+    previous = load_previous(args.results)
+    prev_results = previous["results"] if previous else {}
+    if previous:
+        print(f"比較対象: {previous['revision']} ({previous['date']})")
+
+    results = {}
+    regressions = 0
+    print(f"{'case':>12} {'points':>9} {'sec':>10} {'prev':>10}  ratio")
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.cases:
+            results[name] = {}
+            for n in args.sizes:
+                fn = CASES[name](n, workdir)
+                # 100万点以上は1回だけ (それでも数秒〜数十秒かかる)
+                sec = measure(fn, 1 if n >= 1000000 else args.repeat)
+                results[name][str(n)] = sec
+                prev = prev_results.get(name, {}).get(str(n))
+                line = f"{name:>12} {n:>9} {sec:>10.4f}"
+                if prev:
+                    ratio = sec / prev
+                    flag = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+                    regressions += bool(flag)
+                    line += f" {prev:>10.4f}  {ratio:.2f}x{flag}"
+                print(line, flush=True)
+
+    if not args.no_save:
+        record = {
+            "revision": git_revision(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "machine": machine(),
+            "numpy": np.__version__,
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"\n結果を保存しました: {args.results}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+import io
+import os
+import sys
+import json
+import atexit
+import threading
+import subprocess
+from queue import Queue, Empty
+from contextlib import contextmanager
+from concurrent.futures import Future
+from pipeline_trace import span, process_usage, add_child_usage
+
+# exiftool を -stay_open True -@ - で常駐させ、引数を標準入力から流し込む。
+# Perlの起動とモジュール読み込みが1回で済むため、1ファイルあたりの
+# オーバーヘッドが数秒から数ミリ秒になる。
+
+# 1ファイル分のメタデータを1回のクエリで取得するタグ
+META_TAGS = ["CreateDate", "CreationDate", "Duration", "VideoFrameRate"]
+
+
+class ExifToolError(Exception):
+    pass
+
+
+class CancelledError(Exception):
+    pass
+
+
+class ChunkReader(io.RawIOBase):
+    """ バイト列のチャンクを返すイテレータを読み込み専用ストリームに見せる """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buf:
+            try:
+                self.buf = next(self.chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self.buf))
+        b[:n] = self.buf[:n]
+        self.buf = self.buf[n:]
+        return n
+
+    def close(self):
+        # 読み切らずに閉じた場合もジェネレータを終わらせ、プールにワーカーを返す
+        self.chunks.close()
+        super().close()
+
+
+class ExifToolProcess:
+    """ 常駐exiftoolプロセス1つ分 """
+    def __init__(self, exiftool_cmd):
+        self.proc = subprocess.Popen(
+            [exiftool_cmd, "-stay_open", "True", "-@", "-",
+             "-common_args", "-charset", "filename=utf8"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.seq = 0
+        self.broken = False
+        # stderr は別スレッドで読み続ける。stdout を読み切るまで stderr を読まないと、
+        # 警告が多いファイルで stderr のパイプ (64KiB) が溢れて exiftool と互いに待ち合ってしまう
+        # (Windows のパイプは selectors で待てないのでスレッドにする)
+        self.err = b""
+        self.err_closed = False
+        self.err_cond = threading.Condition()
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+
+    def _drain_stderr(self):
+        fd = self.proc.stderr.fileno()
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except OSError:
+                chunk = b""
+            with self.err_cond:
+                if chunk:
+                    self.err += chunk
+                else:
+                    self.err_closed = True
+                self.err_cond.notify_all()
+            if not chunk:
+                return
+
+    def _read_stderr(self, marker):
+        """ マーカー行までに stderr に出た内容を返す """
+        with self.err_cond:
+            while True:
+                pos = self.err.find(marker)
+                end = self.err.find(b"\n", pos + len(marker)) if pos >= 0 else -1
+                if end >= 0:
+                    err, self.err = self.err[:pos], self.err[end + 1:]
+                    return err
+                if self.err_closed:
+                    raise EOFError("出力が途切れました")
+                self.err_cond.wait()
+
+    def _read_until(self, fd, marker):
+        # マーカー行の改行まで読み切らないと、次のコマンドの出力に残ってしまう
+        buf = b""
+        while not (buf.endswith(b"\n") and buf.rstrip(b"\r\n").endswith(marker)):
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise EOFError("出力が途切れました")
+            buf += chunk
+        return buf.rstrip(b"\r\n")[:-len(marker)]
+
+    def execute(self, *args):
+        """ 1コマンドを実行し stdout をバイト列で返す """
+        self.seq += 1
+        marker = f"{{ready{self.seq}}}".encode()
+        lines = [str(a) for a in args] + ["-echo4", marker.decode(), f"-execute{self.seq}"]
+        try:
+            self.proc.stdin.write(("\n".join(lines) + "\n").encode("utf-8"))
+            self.proc.stdin.flush()
+            out = self._read_until(self.proc.stdout.fileno(), marker)
+            err = self._read_stderr(marker)
+        except (OSError, EOFError) as e:
+            # 途中で終了・強制終了されたプロセスは再利用しない
+            self.broken = True
+            raise ExifToolError(f"exiftoolが終了しました: {e}")
+        if b"Error" in err:
+            raise ExifToolError(err.decode("utf-8", "replace").strip())
+        return out
+
+    def execute_iter(self, *args):
+        """ 1コマンドを実行し stdout をチャンクごとに返す (全体をメモリに溜めない) """
+        self.seq += 1
+        marker = f"{{ready{self.seq}}}".encode()
+        lines = [str(a) for a in args] + ["-echo4", marker.decode(), f"-execute{self.seq}"]
+        # マーカーが2つのチャンクにまたがっても見逃さないよう、末尾は次回まで持ち越す
+        keep = len(marker) + 2
+        tail = b""
+        done = False
+        try:
+            self.proc.stdin.write(("\n".join(lines) + "\n").encode("utf-8"))
+            self.proc.stdin.flush()
+            while True:
+                chunk = os.read(self.proc.stdout.fileno(), 65536)
+                if not chunk:
+                    raise EOFError("出力が途切れました")
+                buf = tail + chunk
+                if buf.endswith(b"\n") and buf.rstrip(b"\r\n").endswith(marker):
+                    body = buf.rstrip(b"\r\n")[:-len(marker)]
+                    if body:
+                        yield body
+                    break
+                if len(buf) > keep:
+                    yield buf[:-keep]
+                    buf = buf[-keep:]
+                tail = buf
+            err = self._read_stderr(marker)
+            done = True
+        except (OSError, EOFError) as e:
+            raise ExifToolError(f"exiftoolが終了しました: {e}")
+        finally:
+            # 途中で読むのをやめた場合は出力が残っているので再利用しない
+            if not done:
+                self.broken = True
+                self.proc.kill()
+        if b"Error" in err:
+            raise ExifToolError(err.decode("utf-8", "replace").strip())
+
+    def alive(self):
+        return not self.broken and self.proc.poll() is None
+
+    def close(self):
+        if not self.alive():
+            return
+        try:
+            self.proc.stdin.write(b"-stay_open\nFalse\n")
+            self.proc.stdin.flush()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+
+
+class ExifToolPool:
+    """ 常駐exiftoolのプール。必要になった時点で size 個まで起動する """
+    def __init__(self, exiftool_cmd, size=2):
+        self.exiftool_cmd = exiftool_cmd
+        self.size = size
+        self.idle = Queue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.all = []
+
+    def _acquire(self):
+        while True:
+            try:
+                proc = self.idle.get_nowait()
+            except Empty:
+                with self.lock:
+                    if self.created < self.size:
+                        # 起動に失敗した (exiftool が無い) 場合は数に入れない
+                        proc = ExifToolProcess(self.exiftool_cmd)
+                        self.created += 1
+                        self.all.append(proc)
+                        return proc
+                proc = self.idle.get()
+            # None は終了したプロセスの枠が空いた知らせ。待っていたスレッドが起動し直す
+            if proc is not None:
+                return proc
+
+    @contextmanager
+    def worker(self):
+        proc = self._acquire()
+        try:
+            yield proc
+        finally:
+            if proc.alive():
+                self.idle.put(proc)
+            else:
+                with self.lock:
+                    self.created -= 1
+                    self.all.remove(proc)
+                self.idle.put(None)
+
+    def execute(self, *args):
+        with self.worker() as proc:
+            return proc.execute(*args)
+
+    def stream(self, *args):
+        with self.worker() as proc:
+            yield from proc.execute_iter(*args)
+
+    def open_stream(self, *args):
+        """ stdout を読み込み用のファイルオブジェクトとして返す (iterparse にそのまま渡せる) """
+        return io.BufferedReader(ChunkReader(self.stream(*args)))
+
+    def warm(self):
+        """ exiftool を1つ起動して待機させておく (最初のファイルで Perl の起動を待たないように) """
+        with self.worker() as proc:
+            proc.execute("-ver")
+
+    def get_metadata(self, path):
+        """ CreateDate / CreationDate / Duration(秒) を1回のクエリで取得する """
+        out = self.execute("-j", "-n", *[f"-{t}" for t in META_TAGS], path)
+        return json.loads(out.decode("utf-8"))[0]
+
+    def close(self):
+        with self.lock:
+            for proc in self.all:
+                proc.close()
+            self.all = []
+            self.created = 0
+            self.idle = Queue()
+
+
+def command_name(args):
+    """ 計測の記録用に exiftool のコマンドを短く表す """
+    if "-j" in args:
+        return "metadata"
+    if "-p" in args:
+        return "gpx" + (" -ee" if "-ee" in args else "")
+    return "write"
+
+
+class CancellableExifTool:
+    """ プールを借りて実行し、cancel() で実行中の exiftool を強制終了できるラッパー
+        trace (pipeline_trace.Trace) を渡すと、コマンドごとの時間・出力量・exiftool の CPU/メモリを記録する """
+    def __init__(self, pool, trace=None):
+        self.pool = pool
+        self.trace = trace
+        self.current = set() # 実行中の exiftool (チャプターの並列読み込みでは複数)
+        self.cancelled = False
+
+    def check(self):
+        if self.cancelled:
+            raise CancelledError("キャンセルされました")
+
+    def execute(self, *args):
+        self.check()
+        with self.pool.worker() as proc, span(self.trace, "exiftool", command=command_name(args)) as s:
+            # 起動直後の1回目は Perl の起動・モジュール読み込みの時間を含む
+            s["started"] = proc.seq == 0
+            before = process_usage(proc.proc.pid) if self.trace else None
+            self.current.add(proc)
+            try:
+                out = proc.execute(*args)
+                s["bytes_out"] = len(out)
+                return out
+            except ExifToolError:
+                # kill() による終了はキャンセルとして扱う
+                self.check()
+                raise
+            finally:
+                self.current.discard(proc)
+                if self.trace:
+                    add_child_usage(s, before, process_usage(proc.proc.pid))
+
+    def stream(self, *args):
+        self.check()
+        with self.pool.worker() as proc, span(self.trace, "exiftool", command=command_name(args)) as s:
+            s["started"] = proc.seq == 0
+            s["bytes_out"] = 0
+            before = process_usage(proc.proc.pid) if self.trace else None
+            self.current.add(proc)
+            try:
+                for chunk in proc.execute_iter(*args):
+                    s["bytes_out"] += len(chunk)
+                    yield chunk
+            except ExifToolError:
+                self.check()
+                raise
+            finally:
+                self.current.discard(proc)
+                if self.trace:
+                    add_child_usage(s, before, process_usage(proc.proc.pid))
+
+    get_metadata = ExifToolPool.get_metadata
+    open_stream = ExifToolPool.open_stream
+
+    def cancel(self):
+        self.cancelled = True
+        for proc in list(self.current):
+            proc.proc.kill()
+
+
+def format_duration(sec):
+    """ exiftool の Duration 表示 (ConvertDuration) と同じ書式 """
+    if sec < 30:
+        return f"{sec:.2f} s"
+    sec = int(sec + 0.5)
+    h, rem = divmod(sec, 3600)
+    m, s = divmod(rem, 60)
+    if h > 24:
+        d, h = divmod(h, 24)
+        return f"{d} days {h}:{m:02d}:{s:02d}"
+    return f"{h}:{m:02d}:{s:02d}"
+
+
+def resource_path(relative_path):
+    """ PyInstallerの一時フォルダ、または現在のディレクトリから絶対パスを取得 """
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.join(sys._MEIPASS, relative_path)
+    return os.path.join(os.path.abspath("."), relative_path)
+
+
+def get_exiftool_cmd():
+    if sys.platform == "win32":
+        return resource_path("exiftool.exe")
+
+    # macOS環境
+    exiftool_bin = resource_path("exiftool")
+    exiftool_lib = resource_path("lib")
+
+    # ExifToolが内部のlibフォルダを見つけられるように環境変数を設定
+    os.environ["PERL5LIB"] = exiftool_lib
+
+    # システムインストール版があれば優先、なければ同梱版
+    if os.path.exists("/usr/local/bin/exiftool"):
+        return "/usr/local/bin/exiftool"
+
+    # 同梱版を使う場合は実行権限を確認（ビルド後の属性剥がれ対策）
+    if os.path.exists(exiftool_bin):
+        os.chmod(exiftool_bin, 0o755)
+        return exiftool_bin
+
+    return "exiftool" # 最終手段としてPATHに期待
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(exiftool_cmd, size=2):
+    """ 両ツール・バッチ処理で共有するプールを返す """
+    with _pools_lock:
+        if exiftool_cmd not in _pools:
+            _pools[exiftool_cmd] = ExifToolPool(exiftool_cmd, size)
+        return _pools[exiftool_cmd]
+
+
+def start_pool_async(size=2, preload=()):
+    """ exiftool のパス解決・起動をバックグラウンドで行う (GUIの起動を待たせない)
+        preload のモジュール (処理本体・numpy など) もついでに読み込んでおく
+        戻り値の Future.result() でプールを受け取る (未完了なら待つ) """
+    future = Future()
+
+    def run():
+        try:
+            pool = get_pool(get_exiftool_cmd(), size)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        future.set_result(pool)
+        for name in preload:
+            __import__(name)
+        try:
+            pool.warm()
+        except (OSError, ExifToolError) as e:
+            # exiftool が無くても GPMF を直接読めるファイルは処理できるので、ここでは警告だけ
+            print(f"ExifTool Warm-up Error: {e}")
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+@atexit.register
+def close_all():
+    for pool in _pools.values():
+        pool.close()
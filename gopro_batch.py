@@ -0,0 +1,143 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from exiftool_pool import get_pool, CancellableExifTool
+from gopro_pipeline import get_exiftool_cmd, process_files, run_diagnosis
+from telemetry_cache import get_cache
+from gopro_session import is_first_chapter
+from pipeline_trace import Trace, summarize, write_jsonl, write_chrome_trace
+
+# SDカードのダンプなどフォルダ単位で .360 / .mp4 をまとめて処理するヘッドレス版。
+# PySide6 を読み込まないので、ディスプレイの無いレンダーノードでも動く。
+#
+#   python gopro_batch.py /path/to/dump --workers 4 --diagnose
+#   python gopro_batch.py /path/to/dump --profile --chrome-trace trace.json   # 遅い段階を調べる
+
+
+def find_pairs(root):
+    """ フォルダ内の .360 と、GoPro Playerで書き出した .mp4 を対応付ける """
+    pairs = []
+    for dirpath, _, files in os.walk(root):
+        mp4s = [f for f in files if f.lower().endswith(".mp4")
+                and not os.path.splitext(f)[0].endswith("_fixed")]
+        for f in sorted(files):
+            if not f.lower().endswith(".360"):
+                continue
+            stem = os.path.splitext(f)[0]
+            # 同名を優先し、なければ同名で始まるもの (例: GS010123_1.mp4) の中で最短の名前
+            candidates = sorted((m for m in mp4s if os.path.splitext(m)[0].startswith(stem)),
+                                key=lambda m: (os.path.splitext(m)[0] != stem, len(m)))
+            path_mp4 = os.path.join(dirpath, candidates[0]) if candidates else None
+            pairs.append((os.path.join(dirpath, f), path_mp4))
+    return pairs
+
+
+def process_one(path_360, path_mp4, overwrite, diagnose, exiftool_cmd, use_cache=True, session=False,
+                repair=False, profile=False):
+    """ 1ペア分の処理 (ワーカープロセス内で実行)
+        profile=True なら各段階の記録を result["trace"] に入れて返す """
+    trace = Trace(os.path.basename(path_360)) if profile else None
+    exiftool = get_pool(exiftool_cmd, size=1)
+    if trace:
+        exiftool = CancellableExifTool(exiftool, trace)
+    cache = get_cache() if use_cache else None
+    result = {"file": path_360, "mp4": None, "gpx": None, "invalid_ranges": None, "gaps": None,
+              "boundary_gaps": None, "error": None, "trace": None}
+    try:
+        if path_mp4:
+            result["mp4"], result["gpx"] = process_files(exiftool, path_360, path_mp4, overwrite, cache=cache,
+                                                          session=session, repair=repair, trace=trace)
+        if diagnose:
+            diag = run_diagnosis(exiftool, path_360, cache=cache, session=session, trace=trace)
+            result["invalid_ranges"], result["gaps"] = diag["invalid_ranges"], diag["gaps"]
+            result["boundary_gaps"] = diag["boundary_gaps"]
+    except Exception as e:
+        result["error"] = str(e)
+    if trace:
+        result["trace"] = trace.records()
+    return result
+
+
+def print_profile(records):
+    """ 段階ごとの合計時間を多い順に表示する (入れ子の段階は親の時間にも含まれる) """
+    print("\n処理時間の内訳 (段階 / 回数 / 合計 / 最大):")
+    for name, count, total, worst in summarize(records):
+        print(f"  {name:<16} {count:>6} {total:>10.3f}s {worst:>9.3f}s")
+
+
+def format_result(r):
+    name = os.path.basename(r["file"])
+    if r["error"]:
+        return f"[NG] {name}: {r['error']}"
+    parts = []
+    if r["mp4"]:
+        parts.append(f"動画: {os.path.basename(r['mp4'])}  GPX: {os.path.basename(r['gpx'])}")
+    else:
+        parts.append("対応する .mp4 なし")
+    if r["invalid_ranges"] is not None:
+        if r["invalid_ranges"]:
+            ranges = ", ".join(f"{s}s～{e}s" for s, e in r["invalid_ranges"])
+            parts.append(f"異常区間: {ranges}")
+        else:
+            parts.append("GPS正常")
+    if r["gaps"]:
+        parts.append("記録の欠落: " + ", ".join(f"{s}s～{e}s" for s, e in r["gaps"]))
+    if r["boundary_gaps"]:
+        parts.append("チャプター境界の欠落: " + ", ".join(f"{s}s (GPS {m}秒)" for s, m in r["boundary_gaps"]))
+    return f"[OK] {name}: " + " / ".join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GoPro .360/.mp4 一括処理（時刻修正 ＆ GPX作成）")
+    parser.add_argument("directory", help="処理するフォルダ (サブフォルダも含む)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="並列プロセス数")
+    parser.add_argument("--copy", action="store_true", help="MP4を上書きせず _fixed を作成")
+    parser.add_argument("--diagnose", action="store_true", help="GPSの跳び・未捕捉の診断も行う")
+    parser.add_argument("--exiftool", default=None, help="exiftoolのパス")
+    parser.add_argument("--session", action="store_true", help="分割されたチャプターを結合して処理")
+    parser.add_argument("--repair", action="store_true", help="GPSの (0,0)・跳びを補間したGPXを作成")
+    parser.add_argument("--no-cache", action="store_true", help="抽出済みGPSのキャッシュを使わない")
+    parser.add_argument("--profile", action="store_true", help="段階ごとの処理時間の内訳を表示")
+    parser.add_argument("--trace", metavar="PATH", help="段階ごとの記録を JSON Lines で保存")
+    parser.add_argument("--chrome-trace", metavar="PATH", help="段階ごとの記録を Chrome のトレース形式で保存")
+    args = parser.parse_args(argv)
+    profile = bool(args.profile or args.trace or args.chrome_trace)
+
+    exiftool_cmd = args.exiftool or get_exiftool_cmd()
+    pairs = find_pairs(args.directory)
+    if args.session:
+        # 2番目以降のチャプターは先頭チャプターのセッションに含まれる
+        pairs = [p for p in pairs if is_first_chapter(p[0])]
+    if not args.diagnose:
+        pairs = [p for p in pairs if p[1]]
+    if not pairs:
+        print("処理対象のファイルがありません。")
+        return 1
+
+    failed = 0
+    records = []
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        futures = [ex.submit(process_one, p360, pmp4, not args.copy, args.diagnose, exiftool_cmd,
+                             not args.no_cache, args.session, args.repair, profile)
+                   for p360, pmp4 in pairs]
+        for fut in as_completed(futures):
+            r = fut.result()
+            failed += bool(r["error"])
+            records += r["trace"] or []
+            print(format_result(r), flush=True)
+
+    print(f"\n完了: {len(pairs) - failed} / {len(pairs)} 件")
+    if args.profile:
+        print_profile(records)
+    if args.trace:
+        with open(args.trace, "w", encoding="utf-8") as f:
+            write_jsonl(records, f)
+    if args.chrome_trace:
+        with open(args.chrome_trace, "w", encoding="utf-8") as f:
+            write_chrome_trace(records, f)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
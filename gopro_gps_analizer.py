@@ -1,29 +1,60 @@
 import sys
 import os
-import subprocess
 import json
-import platform
-import math
-import xml.etree.ElementTree as ET
-import tempfile
-from datetime import datetime, timedelta
-from PySide6.QtWidgets import *
-from PySide6.QtWebEngineWidgets import QWebEngineView
-from PySide6.QtWebEngineCore import QWebEngineSettings
-from PySide6.QtCore import Qt, QUrl
-
-def resource_path(relative_path):
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, relative_path)
-    return os.path.join(os.path.abspath("."), relative_path)
+from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+                               QPushButton, QFileDialog, QLabel, QMessageBox, QGroupBox,
+                               QScrollArea, QFrame, QProgressBar, QCheckBox)
+from PySide6.QtCore import Qt, QUrl, QTimer, QCoreApplication
+from exiftool_pool import start_pool_async, resource_path
+from map_bridge import register_scheme, TrackBridge, TRACK_LOADER_JS, TRACK_QUERY_JS, TILE_URL
+from qt_jobs import JobQueue, PipelineJob
+from pipeline_trace import span
+from trace_panel import TraceDialog
+
+# 起動を速くするため、ウィンドウを出すまでは Qt の画面部品と軽いモジュールだけを読み込む。
+# 処理本体 (numpy を使う gopro_pipeline など) は起動後にバックグラウンドで読み込み
+# (PIPELINE_MODULES)、地図 (QWebEngineView) はウィンドウを表示した後に作る。
+# 処理本体を使う関数では、その場で import する (読み込み済みならすぐ返る)。
+# 読み込み時間の目安は benchmarks/import_budget.py で確認する。
+
+PIPELINE_MODULES = ("gopro_pipeline", "track_simplify", "gopro_session", "telemetry_cache", "tile_cache",
+                    "track_index")
+MAP_INIT_DELAY_MS = 50 # ウィンドウが描画されてから地図を作る
+
+def diagnose_for_map(exiftool, path_360, progress=None, session=False, trace=None):
+    """ 診断に加えて、地図用に正常区間(青)の間引きピラミッドを作る (赤の異常区間は間引かない)
+        地図のクリック・マウス位置から最寄りのサンプルを引く索引もここで作っておく """
+    from gopro_pipeline import run_diagnosis as run_diagnosis_job
+    from track_simplify import build_pyramid, pack_coords, pack_segments, bounds
+    from telemetry_cache import get_cache
+    from track_index import TrackIndex
+    result = run_diagnosis_job(exiftool, path_360, progress, cache=get_cache(), session=session, trace=trace)
+    lat, lon = result["lat"], result["lon"]
+    with span(trace, "map.prepare") as s:
+        good = ~result["bad"]
+        levels = build_pyramid(lat[good], lon[good])
+        # 地図へはバイナリで渡すので、ここ (ワーカースレッド) で詰めておく
+        result["valid_levels"] = [(zoom, pack_coords(c[:, 0], c[:, 1])) for zoom, c in levels]
+        result["valid_bounds"] = bounds(lat[good], lon[good])
+        result["invalid_packed"] = pack_segments(result["invalid_segments"])
+        result["index"] = TrackIndex(lat, lon, result["timeline"], result["gps"].time, result["quality"])
+        s["levels"] = len(levels)
+        s["indexed"] = len(result["index"])
+        s["bytes"] = sum(len(data) for _, data in result["valid_levels"]) + len(result["invalid_packed"])
+    return result
 
 class GoProGPSApp(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.exiftool_cmd = self.get_exiftool_cmd()
+        # exiftool のパス解決・起動と処理本体の読み込みは裏で行う (ジョブの投入時に完了を待つ)
+        self.exiftool_ready = start_pool_async(preload=PIPELINE_MODULES)
         self.setWindowTitle("GoPro MAX GPS Analyzer & Diagnostic Tool (v1.0.2)")
         self.setMinimumSize(1100, 850)
         self.path_360 = ""
+        self.last_result = None # GPX保存用 (最後に診断したファイル)
+        self.diagnosis_gen = 0 # 最後に選んだファイルの診断の番号 (古い診断の結果は表示しない)
+        self.jobs = JobQueue(self)
+        self.jobs.changed.connect(self.on_jobs_changed)
         
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
@@ -37,6 +68,24 @@ class GoProGPSApp(QMainWindow):
         self.btn_select_360.setFixedHeight(50)
         self.btn_select_360.clicked.connect(self.select_360)
         self.control_panel.addWidget(self.btn_select_360)
+
+        # 分割されたチャプター (GS01xxxx, GS02xxxx, ...) を1本につないで診断する
+        self.check_session = QCheckBox("チャプターを結合して診断 (GS01/GS02...)")
+        self.check_session.setChecked(False)
+        self.control_panel.addWidget(self.check_session)
+
+        # 進捗表示・キャンセル (診断はバックグラウンドで実行)
+        self.progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("待機中")
+        self.btn_cancel = QPushButton("キャンセル")
+        self.btn_cancel.setEnabled(False)
+        self.btn_cancel.clicked.connect(self.jobs.cancel_all)
+        self.progress_layout.addWidget(self.progress_bar)
+        self.progress_layout.addWidget(self.btn_cancel)
+        self.control_panel.addLayout(self.progress_layout)
         
         # 撮影情報表示用
         self.info_group = QGroupBox("撮影情報")
@@ -75,40 +124,55 @@ class GoProGPSApp(QMainWindow):
         self.diag_group.setMaximumHeight(350) 
         
         self.control_panel.addWidget(self.diag_group)
+
+        # GPXは保存を指示されたときだけ書き出す (診断では一時ファイルも作らない)
+        self.btn_export_gpx = QPushButton("GPXを保存")
+        self.btn_export_gpx.setEnabled(False)
+        self.btn_export_gpx.clicked.connect(self.export_gpx)
+        self.control_panel.addWidget(self.btn_export_gpx)
+        self.btn_export_segments = QPushButton("異常区間で分割してGPXを保存")
+        self.btn_export_segments.setEnabled(False)
+        self.btn_export_segments.clicked.connect(self.export_segments)
+        self.control_panel.addWidget(self.btn_export_segments)
+        self.btn_export_repaired = QPushButton("異常を修復してGPXを保存")
+        self.btn_export_repaired.setEnabled(False)
+        self.btn_export_repaired.clicked.connect(self.export_repaired)
+        self.control_panel.addWidget(self.btn_export_repaired)
         
         self.control_panel.addStretch()
+
+        # どの段階に時間がかかったかを確認する (JSON Lines / Chrome トレース形式で保存できる)
+        self.btn_trace = QPushButton("処理時間の内訳")
+        self.btn_trace.clicked.connect(lambda: TraceDialog(self.jobs.traces, self).exec())
+        self.control_panel.addWidget(self.btn_trace)
         
-        # 右側地図パネル
+        # 右側地図パネル (QWebEngineView は Chromium の起動を伴うので、ウィンドウの表示後に作る)
+        self.tiles = None
+        self.bridge = None
+        self.web_view = None
+        self.map_placeholder = QLabel("地図を読み込み中...")
+        self.map_placeholder.setAlignment(Qt.AlignCenter)
+        self.main_layout.addWidget(self.map_placeholder, 3)
+        QTimer.singleShot(MAP_INIT_DELAY_MS, self.init_web_view)
+
+    def init_web_view(self):
+        if self.web_view is not None:
+            return
+        from PySide6.QtWebEngineWidgets import QWebEngineView
+        from PySide6.QtWebEngineCore import QWebEngineSettings
+        from tile_cache import get_tile_source
+        # 地図タイルはキャッシュ (tile_cache) を通して読むので、オフラインでも一度見た範囲は表示できる
+        self.tiles = get_tile_source()
+        self.bridge = TrackBridge(self, self.tiles)
         self.web_view = QWebEngineView()
         settings = self.web_view.settings()
         settings.setAttribute(QWebEngineSettings.WebAttribute.LocalContentCanAccessFileUrls, True)
         settings.setAttribute(QWebEngineSettings.WebAttribute.LocalContentCanAccessRemoteUrls, True)
 
-        self.main_layout.addWidget(self.web_view, 3)
+        self.main_layout.replaceWidget(self.map_placeholder, self.web_view)
+        self.map_placeholder.deleteLater()
         self.init_map()
 
-    def get_exiftool_cmd(self):
-        if platform.system() == "Windows":
-            return resource_path("exiftool.exe")
-        
-        # macOS環境
-        exiftool_bin = resource_path("exiftool")
-        exiftool_lib = resource_path("lib")
-        
-        # ExifToolが内部のlibフォルダを見つけられるように環境変数を設定
-        os.environ["PERL5LIB"] = exiftool_lib
-        
-        # システムインストール版があれば優先、なければ同梱版
-        if os.path.exists("/usr/local/bin/exiftool"):
-            return "/usr/local/bin/exiftool"
-        
-        # 同梱版を使う場合は実行権限を確認（ビルド後の属性剥がれ対策）
-        if os.path.exists(exiftool_bin):
-            os.chmod(exiftool_bin, 0o755)
-            return exiftool_bin
-            
-        return "exiftool" # 最終手段としてPATHに期待
-
     def init_map(self):
         js_path = QUrl.fromLocalFile(resource_path("leaflet.js")).toString()
         css_path = QUrl.fromLocalFile(resource_path("leaflet.css")).toString()
@@ -124,36 +188,111 @@ class GoProGPSApp(QMainWindow):
             <div id="map"></div>
             <script>
                 var map = L.map('map').setView([35, 135], 5);
-                L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png').addTo(map);
+                L.tileLayer('{TILE_URL}').addTo(map);
                 var layers = [];
+                var validLine = null;
+                var validLevels = []; // [[最小ズーム, {{key, chunks}}], ...] 最小ズームの昇順
+                var levelCache = {{}};
+                var currentKey = null;
+                var generation = 0;
+                var trackShown = false;
+{TRACK_LOADER_JS}
+{TRACK_QUERY_JS}
+                // ズームに合った段階の青線を取得して差し替える (未取得ならチャンクごとに描画)
+                async function showLevel() {{
+                    if (!validLine || validLevels.length == 0) return;
+                    var src = pickLevel(validLevels, map.getZoom());
+                    if (src.key === currentKey) return;
+                    currentKey = src.key;
+                    if (levelCache[src.key]) {{
+                        validLine.setLatLngs(levelCache[src.key]);
+                        return;
+                    }}
+                    var gen = generation;
+                    var coords = await fetchCoords(src, (all, draw) => {{
+                        if (gen !== generation || currentKey !== src.key) return false;
+                        if (draw) validLine.setLatLngs(all);
+                    }});
+                    if (coords && gen === generation) levelCache[src.key] = coords;
+                }}
 
-                function updateMap(invalidCoords, validCoords) {{
-                    layers.forEach(l => map.removeLayer(l));
-                    if (invalidCoords.length > 0) {{
-                        invalidCoords.forEach(segment => {{
-                            var l1 = L.polyline(segment, {{color: 'red', weight: 8, opacity: 0.7}}).addTo(map);
-                            layers.push(l1);
-                        }});
+                map.on('zoomend', showLevel);
+
+                // クリックした位置の最寄りのサンプル (動画の時刻・速度・異常かどうか) を表示する
+                map.on('click', async e => {{
+                    if (!trackShown) return;
+                    var info = await queryNearest(e.latlng, 30);
+                    if (!info) return;
+                    L.popup().setLatLng([info.lat, info.lon]).setContent(describeSample(info)).openOn(map);
+                }});
+
+                // マウス位置の近くのサンプルを表示する (問い合わせ中に動いた分は最後の位置だけ問い合わせる)
+                var hoverMarker = null;
+                var hoverBusy = false;
+                var hoverNext = null;
+                async function hover(latlng) {{
+                    hoverBusy = true;
+                    var gen = generation;
+                    var info = await queryNearest(latlng, 12);
+                    hoverBusy = false;
+                    if (gen === generation) {{
+                        if (info) {{
+                            if (!hoverMarker) {{
+                                hoverMarker = L.circleMarker([info.lat, info.lon], {{radius: 6, color: 'black', weight: 2}})
+                                    .bindTooltip('', {{direction: 'top', offset: [0, -8]}}).addTo(map);
+                            }}
+                            hoverMarker.setLatLng([info.lat, info.lon]).setTooltipContent(describeSample(info)).openTooltip();
+                        }} else if (hoverMarker) {{
+                            map.removeLayer(hoverMarker);
+                            hoverMarker = null;
+                        }}
                     }}
-                    if (validCoords.length > 0) {{
-                        var l2 = L.polyline(validCoords, {{color: 'blue', weight: 4}}).addTo(map);
-                        layers.push(l2);
-                        map.fitBounds(l2.getBounds());
+                    if (hoverNext) {{
+                        var next = hoverNext;
+                        hoverNext = null;
+                        hover(next);
                     }}
                 }}
+                map.on('mousemove', e => {{
+                    if (!trackShown) return;
+                    if (hoverBusy) hoverNext = e.latlng;
+                    else hover(e.latlng);
+                }});
+
+                async function updateMap(info) {{
+                    generation++;
+                    var gen = generation;
+                    layers.forEach(l => map.removeLayer(l));
+                    layers = [];
+                    validLine = null;
+                    if (hoverMarker) map.removeLayer(hoverMarker);
+                    hoverMarker = null;
+                    map.closePopup();
+                    trackShown = info.indexed > 0;
+                    validLevels = info.levels;
+                    levelCache = {{}};
+                    currentKey = null;
+                    if (validLevels.length > 0) {{
+                        validLine = L.polyline([], {{color: 'blue', weight: 4}}).addTo(map);
+                        layers.push(validLine);
+                        map.fitBounds(info.bounds);
+                        showLevel();
+                    }}
+                    // 赤の異常区間は間引かずに全点を描く
+                    var invalid = await fetchCoords(info.invalid);
+                    if (gen !== generation) return;
+                    splitSegments(invalid).forEach(segment => {{
+                        var l1 = L.polyline(segment, {{color: 'red', weight: 8, opacity: 0.7}}).addTo(map);
+                        layers.push(l1);
+                    }});
+                    if (validLine) validLine.bringToFront();
+                }}
             </script>
         </body>
         </html>
         """
         self.web_view.setHtml(html_content, QUrl.fromLocalFile(os.path.abspath(__file__)))
 
-    def calculate_distance(self, p1, p2):
-        R = 6371000 # 地球半径(m)
-        lat1, lon1, lat2, lon2 = map(math.radians, [p1[0], p1[1], p2[0], p2[1]])
-        dlat, dlon = lat2 - lat1, lon2 - lon1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
     def select_360(self):
         file, _ = QFileDialog.getOpenFileName(self, "Select .360", "", "GoPro Files (*.360)")
         if file:
@@ -161,150 +300,154 @@ class GoProGPSApp(QMainWindow):
             self.run_diagnosis()
 
     def run_diagnosis(self):
-        # macOS/.app環境でも書き込み可能な一時パスを生成
-        temp_dir = tempfile.gettempdir()
-        temp_gpx = os.path.join(temp_dir, "temp_diag.gpx")
-        gpx_fmt = resource_path("gpx.fmt")
-        
-        try:
-            # 1. 撮影日時・時間の取得
-            #res_meta = subprocess.run([self.exiftool_cmd, "-CreationDate", "-CreateDate", "-Duration", "-s3", self.path_360], 
-            #                          capture_output=True, text=True, check=True)
-            #meta_lines = res_meta.stdout.strip().split('\n')
-            
-            # 各値の抽出 (ExifTool出力順に依存するためタグ名指定が安全だが簡易的に)
-            # 2026年時点のGoPro MAX出力仕様に準拠
-            meta_dict = {}
-            #for line in meta_lines:
-            #    if "CreationDate" in line: meta_dict['jst'] = line.split(': ', 1)[1]
-            #    if "CreateDate" in line: meta_dict['utc'] = line.split(': ', 1)[1]
-            #    if "Duration" in line: meta_dict['dur'] = line.split(': ', 1)[1]
-
-            # 1. 撮影日時抽出
-            res = subprocess.run([self.exiftool_cmd, "-CreateDate", "-s3", "-S", self.path_360], 
-                                 capture_output=True, text=True, check=True)
-            meta_dict['utc'] = res.stdout.strip()
-            res = subprocess.run([self.exiftool_cmd, "-CreationDate", "-s3", "-S", self.path_360], 
-                                 capture_output=True, text=True, check=True)
-            meta_dict['jst'] = res.stdout.strip()
-            res = subprocess.run([self.exiftool_cmd, "-Duration", "-s3", "-S", self.path_360], 
-                                 capture_output=True, text=True, check=True)
-            meta_dict['dur'] = res.stdout.strip()
-            res = subprocess.run([self.exiftool_cmd, "-Duration", "-n", "-S", self.path_360], 
-                                 capture_output=True, text=True, check=True)
-            duration_sec = float(res.stdout.strip().split(': ', 1)[1])
-
-            #duration_sec = float(meta_dict.get('dur', 0))
-            self.label_info.setText(f"【ファイル名】 {os.path.basename(self.path_360)}\n"
-                                    f"【日本時間】 {meta_dict.get('jst', '取得失敗')}\n"
-                                    f"【UTC】 {meta_dict.get('utc', '取得失敗')}\n"
-                                    f"【撮影時間】 {meta_dict.get('dur', '取得失敗')} ({round(duration_sec, 2)} 秒)")
-
-            # 2. GPX抽出 (一時フォルダへ出力)
-            # コマンドの stdout にファイルのパスを指定
-            with open(temp_gpx, "w", encoding="utf-8") as f:
-                subprocess.run([self.exiftool_cmd, "-p", gpx_fmt, "-ee", "-c", "%.8f", self.path_360], 
-                               stdout=f, check=True)
-
-            tree = ET.parse(temp_gpx)
-            pts = []
-            for trkpt in tree.getroot().iter():
-                if trkpt.tag.endswith('trkpt'):
-                    pts.append([float(trkpt.get('lat')), float(trkpt.get('lon'))])
-
-            if not pts:
-                QMessageBox.warning(self, "Warning", "GPSデータが含まれていません。")
-                return
-
-            # 3. 異常検知 (揺れ・跳び・未捕捉)
-            invalid_segments = [] # 赤色表示用 (リストのリスト)
-            current_invalid_seg = []
-            
-            valid_pts = [] # 青色表示用
-            
-            # 判定用閾値
-            # StreetView Studioは急激な座標移動を「跳び」とみなす
-            # 1地点あたりの許容移動距離を算出 (秒速45m × サンプリング間隔)
-            # GoPro MAXのGPSは約18Hz(0.055秒毎)だが、ここでは1地点ごとの距離で判定
-            MAX_DIST_PER_POINT = 15.0 # 15m以上のジャンプは異常（時速160km超相当）
-            
-            invalid_ranges = [] # 警告テキスト用 [(start_sec, end_sec), ...]
-            
-            is_collecting_invalid = False
-            start_invalid_idx = 0
-
-            for i in range(len(pts)):
-                p_curr = pts[i]
-                is_bad = False
-                
-                # A. 未捕捉判定 (0,0 または 最初から動かない)
-                #if p_curr == [0,0] or p_curr == pts[0]:
-                if p_curr == [0,0]:
-                    is_bad = True
-                
-                # B. 跳び判定 (1つ前からの距離が異常)
-                elif i > 0:
-                    dist = self.calculate_distance(pts[i-1], p_curr)
-                    # GPMFのサンプリング周期(約0.05~0.1s)で10m以上移動は異常
-                    if dist > MAX_DIST_PER_POINT: 
-                        is_bad = True
-
-                if is_bad:
-                    # 異常区間の開始または継続
-                    if not is_collecting_invalid:
-                        is_collecting_invalid = True
-                        start_invalid_idx = i
-                        # 視覚的な繋がりのため、直前の正常な地点を起点に含める
-                        current_invalid_seg = []
-                        if i > 0:
-                            current_invalid_seg.append(pts[i-1])
-                        current_invalid_seg.append(p_curr)
-                    else:
-                        current_invalid_seg.append(p_curr)
-                else:
-                    # 正常な地点
-                    if is_collecting_invalid:
-                        # 異常区間が終了したので確定
-                        end_invalid_idx = i
-                        # 秒数換算 (インデックス比率 × 総秒数)
-                        start_sec = round((start_invalid_idx / len(pts)) * duration_sec, 2)
-                        end_sec = round((end_invalid_idx / len(pts)) * duration_sec, 2)
-                        
-                        invalid_ranges.append((start_sec, end_sec))
-                        invalid_segments.append(current_invalid_seg)
-                        is_collecting_invalid = False
-                    
-                    valid_pts.append(p_curr)
-
-            # 最後の地点が異常のまま終わった場合のクローズ処理
-            if is_collecting_invalid:
-                end_invalid_idx = len(pts) - 1
-                start_sec = round((start_invalid_idx / len(pts)) * duration_sec, 2)
-                end_sec = round(duration_sec, 2)
-                invalid_ranges.append((start_sec, end_sec))
-                invalid_segments.append(current_invalid_seg)
-
-            # 4. 結果の表示
-            if invalid_ranges:
-                diag_text = "【異常検出】\n"
-                for r in invalid_ranges:
-                    diag_text += f"・{r[0]}s ～ {r[1]}s 付近 (GPS未捕捉または跳び)\n"
-                diag_text += "\n上記区間をGoPro Playerでカットして書き出すことを推奨します。"
-                self.label_diag.setText(diag_text)
-                self.label_diag.setStyleSheet("color: red; font-weight: bold;")
-            else:
-                self.label_diag.setText("【正常】\n全区間で安定したGPSデータが確認されました。")
-                self.label_diag.setStyleSheet("color: green; font-weight: bold;")
-
-            # 5. 地図更新
-            self.web_view.page().runJavaScript(f"updateMap({json.dumps(invalid_segments)}, {json.dumps(valid_pts)})")
-            
-            if os.path.exists(temp_gpx): os.remove(temp_gpx)
-
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"診断失敗: {str(e)}")
+        # 診断はワーカースレッドで実行し、結果はシグナルで受け取る
+        path_360 = self.path_360
+        # 2つのスレッドで並行して診断するので、前に選んだファイルの方が後に終わることがある
+        self.diagnosis_gen += 1
+        gen = self.diagnosis_gen
+        job = PipelineJob(self.exiftool_ready.result(), diagnose_for_map, path_360, session=self.check_session.isChecked(),
+                          label=os.path.basename(path_360))
+        job.signals.progress.connect(lambda msg, pct, name=os.path.basename(path_360): self.on_progress(name, msg, pct))
+        job.signals.finished.connect(lambda result: self.on_diagnosis(gen, path_360, result, job.trace))
+        job.signals.failed.connect(lambda msg: QMessageBox.critical(self, "Error", f"診断失敗: {msg}"))
+        self.jobs.submit(job)
+
+    def on_diagnosis(self, gen, path_360, result, trace):
+        if gen != self.diagnosis_gen:
+            # 後から選んだファイルの結果を、前のファイルの結果で上書きしない
+            return
+        self.show_diagnosis(path_360, result, trace)
+
+    def on_progress(self, name, message, percent):
+        self.progress_bar.setValue(percent)
+        self.progress_bar.setFormat(f"{name}: {message}")
+
+    def on_jobs_changed(self, count):
+        self.btn_cancel.setEnabled(count > 0)
+        suffix = f" (残り{count}件)" if count > 1 else ""
+        self.btn_select_360.setText("1. .360ファイルを選択して診断" + suffix)
+        if count == 0:
+            self.progress_bar.setValue(0)
+            self.progress_bar.setFormat("待機中")
+
+    def show_diagnosis(self, path_360, result, trace=None):
+        # 1. 撮影日時・時間
+        meta_dict, duration_sec = result["meta"], result["duration_sec"]
+        self.label_info.setText(f"【ファイル名】 {os.path.basename(path_360)}\n"
+                                f"【日本時間】 {meta_dict.get('jst', '取得失敗')}\n"
+                                f"【UTC】 {meta_dict.get('utc', '取得失敗')}\n"
+                                f"【撮影時間】 {meta_dict.get('dur', '取得失敗')} ({round(duration_sec, 2)} 秒)")
+        chapters = result["chapters"]
+        if len(chapters) > 1:
+            self.label_info.setText(self.label_info.text() + f"\n【チャプター】 {len(chapters)} ファイルを結合\n" +
+                                    "\n".join(f"・{os.path.basename(p)} ({round(start, 2)}s～)" for p, start, _, _ in chapters))
+
+        # 2. GPS抽出結果
+        if not len(result["lat"]):
+            self.last_result = None
+            self.btn_export_gpx.setEnabled(False)
+            self.btn_export_segments.setEnabled(False)
+            self.btn_export_repaired.setEnabled(False)
+            QMessageBox.warning(self, "Warning", "GPSデータが含まれていません。")
+            return
+        self.last_result = (path_360, result["gps"], result["bad"])
+        self.btn_export_gpx.setEnabled(True)
+        self.btn_export_segments.setEnabled(True)
+        self.btn_export_repaired.setEnabled(True)
+
+        # 3. 異常検知 (揺れ・跳び・未捕捉) の結果
+        invalid_ranges = result["invalid_ranges"]
+
+        # 4. 結果の表示
+        rate_text = f"【GPS記録】 {result['sample_rate']:.1f} Hz\n" if result["sample_rate"] else ""
+        gap_text = ""
+        if result["gaps"]:
+            gap_text = "【記録の欠落】\n" + "".join(f"・{s}s ～ {e}s\n" for s, e in result["gaps"]) + "\n"
+        if result["boundary_gaps"]:
+            gap_text += "【チャプター境界の欠落】\n" + "".join(
+                f"・{s}s 付近 (GPS {missing}秒)\n" for s, missing in result["boundary_gaps"]) + "\n"
+        if invalid_ranges:
+            diag_text = rate_text + gap_text + "【異常検出】\n"
+            for r in invalid_ranges:
+                diag_text += f"・{r[0]}s ～ {r[1]}s (GPS未捕捉または跳び)\n"
+            diag_text += "\n上記区間をGoPro Playerでカットして書き出すか、"
+            diag_text += "「異常を修復してGPXを保存」で補間したGPXを使用することを推奨します。"
+            self.label_diag.setText(diag_text)
+            self.label_diag.setStyleSheet("color: red; font-weight: bold;")
+        else:
+            self.label_diag.setText(rate_text + gap_text + "【正常】\n全区間で安定したGPSデータが確認されました。")
+            self.label_diag.setStyleSheet("color: green; font-weight: bold;")
+
+        # 5. 地図更新 (座標は gopro:// からバイナリで取得させ、ここでは件数と範囲だけ渡す)
+        self.init_web_view()
+        with span(trace, "map.push") as s:
+            self.bridge.clear()
+            self.bridge.index = result["index"]
+            info = {
+                "indexed": len(result["index"]),
+                "bounds": result["valid_bounds"],
+                "invalid": self.bridge.publish("invalid", result["invalid_packed"]),
+                "levels": [[zoom, self.bridge.publish(f"valid/{zoom}", data)] for zoom, data in result["valid_levels"]],
+            }
+            script = f"updateMap({json.dumps(info)})"
+            self.web_view.page().runJavaScript(script)
+            s["script_bytes"] = len(script)
+        # fitBounds で表示される範囲のタイルを裏で取得しておく
+        if result["valid_bounds"]:
+            self.tiles.prefetch(result["valid_bounds"], self.web_view.width(), self.web_view.height())
+
+    def export_gpx(self):
+        from gpmf_reader import write_gpx
+        path_360, gps, _ = self.last_result
+        default = os.path.splitext(path_360)[0] + ".gpx"
+        file, _ = QFileDialog.getSaveFileName(self, "Save GPX", default, "GPX Files (*.gpx)")
+        if file:
+            try:
+                with open(file, "w", encoding="utf-8") as f:
+                    write_gpx(gps, f, os.path.basename(path_360))
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"GPX保存失敗: {str(e)}")
+
+    def export_segments(self):
+        # 異常区間をカットした後の各区間に対応するGPXを _01, _02, ... で保存する
+        from gopro_session import write_segment_gpx
+        path_360, gps, bad = self.last_result
+        default = os.path.splitext(path_360)[0] + ".gpx"
+        file, _ = QFileDialog.getSaveFileName(self, "Save GPX (区間ごと)", default, "GPX Files (*.gpx)")
+        if file:
+            try:
+                written = write_segment_gpx(gps, bad, file, os.path.basename(path_360))
+                QMessageBox.information(self, "完了", f"{len(written)} 個のGPXを保存しました。\n" +
+                                        "\n".join(os.path.basename(p) for p in written))
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"GPX保存失敗: {str(e)}")
+
+    def export_repaired(self):
+        # (0,0)・跳びを補間したGPXを保存する (動画の書き出し直しは不要)
+        from gopro_pipeline import write_track_gpx
+        path_360, gps, _ = self.last_result
+        default = os.path.splitext(path_360)[0] + ".gpx"
+        file, _ = QFileDialog.getSaveFileName(self, "Save GPX (修復)", default, "GPX Files (*.gpx)")
+        if file:
+            try:
+                stats = write_track_gpx(gps, file, os.path.basename(path_360), repair=True)
+                QMessageBox.information(self, "完了", f"修復したGPXを保存しました。\n\n"
+                                        f"補間: {stats['interpolated']} 点\n除外: {stats['dropped']} 点\n"
+                                        f"出力: {stats['output']} / {stats['input']} 点")
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"GPX保存失敗: {str(e)}")
+
+    def closeEvent(self, event):
+        # 実行中の exiftool とタイルの先読みを止めてから終了する
+        self.jobs.wait()
+        if self.tiles:
+            self.tiles.cancel_prefetch()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
+    register_scheme()
+    # QtWebEngineWidgets を QApplication の作成後に読み込むために必要
+    QCoreApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
     window = GoProGPSApp()
     window.show()
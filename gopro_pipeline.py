@@ -0,0 +1,227 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from gpmf_reader import read_gps, write_gpx, GPMFError, GPSData
+from gpx_stream import read_gpx
+from mp4_dates import fix_dates, MP4PatchError
+from exiftool_pool import format_duration, META_TAGS, resource_path, get_exiftool_cmd
+from mp4_index import read_metadata as read_mp4_metadata, MP4Error
+from gps_anomaly import detect_anomalies, mark_quality, video_timeline, sample_rate, find_gaps
+from gopro_session import find_chapters, merge_chapters, boundary_gaps
+from gps_repair import write_repaired_gpx, iter_chunks
+from pipeline_trace import span
+
+# 時刻修正・GPX作成・GPS診断の処理本体。
+# GUI (PySide6) に依存しないので、バッチ処理やレンダーノードからも使える。
+# trace (pipeline_trace.Trace) を渡すと、各段階の所要時間・点数・読み書き量を記録する。
+
+
+def output_paths(path_mp4, overwrite=True):
+    """ 時刻修正後のMP4とGPXの保存パスを返す """
+    mp4_dir = os.path.dirname(path_mp4)
+    name_only = os.path.splitext(os.path.basename(path_mp4))
+    if overwrite:
+        return path_mp4, os.path.join(mp4_dir, f"{name_only[0]}.gpx")
+    return (os.path.join(mp4_dir, f"{name_only[0]}_fixed.mp4"),
+            os.path.join(mp4_dir, f"{name_only[0]}_fixed.gpx"))
+
+
+def probe_metadata(exiftool, path_360):
+    """ 撮影日時・長さをアトム索引から読む。読めないタグがある場合だけ exiftool に問い合わせる """
+    try:
+        meta = read_mp4_metadata(path_360)
+    except (MP4Error, OSError):
+        meta = {}
+    if all(tag in meta for tag in META_TAGS):
+        return meta
+    return {**exiftool.get_metadata(path_360), **meta}
+
+
+def fix_mp4_date(exiftool, path_360, path_mp4, target_mp4, correct_date=None, trace=None):
+    """ .360の撮影日時でMP4のQuickTime日時タグを書き換える """
+    if correct_date is None:
+        correct_date = probe_metadata(exiftool, path_360)["CreateDate"]
+
+    # 固定長の日時フィールドをその場で書き換える (MP4全体を書き直さない)
+    try:
+        with span(trace, "mp4.patch", copy=target_mp4 != path_mp4) as s:
+            fix_dates(path_mp4, target_mp4, correct_date)
+            s["bytes"] = os.path.getsize(target_mp4)
+        return correct_date
+    except MP4PatchError as e:
+        print(f"MP4 Patch Error: {e} (exiftoolで書き換えます)")
+
+    meta_args = [
+        f"-CreateDate={correct_date}", f"-ModifyDate={correct_date}",
+        f"-TrackCreateDate={correct_date}", f"-TrackModifyDate={correct_date}",
+        f"-MediaCreateDate={correct_date}", f"-MediaModifyDate={correct_date}"
+    ]
+    if target_mp4 == path_mp4:
+        meta_args += ["-overwrite_original", path_mp4]
+    else:
+        # 別名保存で同名ファイルがある場合は削除（ExifToolの仕様回避）
+        if os.path.exists(target_mp4): os.remove(target_mp4)
+        meta_args += ["-o", target_mp4, path_mp4]
+
+    exiftool.execute(*meta_args)
+    return correct_date
+
+
+def report(progress, message, percent):
+    """ 進捗コールバックがあれば呼ぶ (キャンセル確認もここで行われる) """
+    if progress:
+        progress(message, percent)
+
+
+def write_track_gpx(gps, output_gpx, name, repair=False):
+    """ GPXを書き出す。repair=True なら (0,0)・跳びを補間・除外し、修復の集計を返す """
+    with open(output_gpx, "w", encoding="utf-8") as f:
+        if repair:
+            return write_repaired_gpx(iter_chunks(gps), f, name)
+        write_gpx(gps, f, name)
+    return None
+
+
+def process_files(exiftool, path_360, path_mp4, overwrite=True, progress=None, cache=None, session=False,
+                  repair=False, trace=None):
+    """ 時刻修正 ＆ GPX作成。(修正後MP4, GPX) のパスを返す
+        session=True ならチャプターを結合した1本のGPXを作る
+        repair=True なら異常な点を補間・除外したGPXを作る (動画の書き出し直しは不要) """
+    with span(trace, "process", session=session, repair=repair):
+        target_mp4, output_gpx = output_paths(path_mp4, overwrite)
+        report(progress, "撮影情報を取得中...", 10)
+        if session:
+            meta, gps, _ = load_session(exiftool, path_360, progress, cache, trace=trace)
+        else:
+            meta, gps = load_telemetry(exiftool, path_360, cache, trace)
+        report(progress, "MP4時刻修正中...", 40)
+        with span(trace, "mp4.fix_date"):
+            fix_mp4_date(exiftool, path_360, path_mp4, target_mp4, meta["CreateDate"], trace)
+        report(progress, "GPX作成中...", 70)
+        with span(trace, "gpx.write", points=len(gps), repair=repair) as s:
+            stats = write_track_gpx(gps, output_gpx, os.path.basename(path_360), repair)
+            s["bytes_written"] = os.path.getsize(output_gpx)
+        if stats:
+            report(progress, f"GPX修復: 補間 {stats['interpolated']} 点・除外 {stats['dropped']} 点", 95)
+        report(progress, "完了", 100)
+    return target_mp4, output_gpx
+
+
+def parse_gpx(gpx_path):
+    """ GPXを逐次読み込みし GPSData (緯度・経度・高度・時刻の配列) で返す """
+    try:
+        return read_gpx(gpx_path)
+    except Exception as e:
+        print(f"GPX Error: {e}")
+        return GPSData()
+
+
+def read_metadata(exiftool, path_360):
+    """ 撮影日時・時間を {'utc', 'jst', 'dur'} と秒数で返す """
+    return summarize_metadata(probe_metadata(exiftool, path_360))
+
+
+def summarize_metadata(meta):
+    """ exiftoolのメタデータを表示用の {'utc', 'jst', 'dur'} と秒数にする """
+    duration_sec = float(meta.get('Duration', 0))
+    meta_dict = {}
+    if 'CreateDate' in meta: meta_dict['utc'] = meta['CreateDate']
+    if 'CreationDate' in meta: meta_dict['jst'] = meta['CreationDate']
+    if 'Duration' in meta: meta_dict['dur'] = format_duration(duration_sec)
+    return meta_dict, duration_sec
+
+
+def extract_gps(exiftool, path_360, trace=None):
+    """ .360からGPSを取り出す。GPMFを直接読めない場合は exiftool の出力をそのまま逐次解析する """
+    with span(trace, "gps.extract", source="gpmf") as s:
+        try:
+            gps = read_gps(path_360, s)
+        except GPMFError:
+            # 一時ファイルを介さず、stdout をパイプのまま iterparse に渡す
+            s["source"] = "exiftool"
+            with exiftool.open_stream("-api", "TimePrecision=3", "-p", resource_path("gpx.fmt"),
+                                      "-ee", "-c", "%.8f", path_360) as f:
+                gps = read_gpx(f)
+        s["points"] = len(gps)
+    return gps
+
+
+def load_telemetry(exiftool, path_360, cache=None, trace=None):
+    """ exiftoolのメタデータと GPSData を返す。キャッシュにあれば .360 を読まない """
+    with span(trace, "load", file=os.path.basename(path_360)):
+        if cache is not None:
+            with span(trace, "cache.get") as s:
+                hit = cache.get(path_360)
+                s["hit"] = hit is not None
+            if hit is not None:
+                return hit
+        with span(trace, "metadata"):
+            meta = probe_metadata(exiftool, path_360)
+        gps = extract_gps(exiftool, path_360, trace)
+        if cache is not None:
+            with span(trace, "cache.put", points=len(gps)):
+                cache.put(path_360, meta, gps)
+    return meta, gps
+
+
+def load_session(exiftool, path_360, progress=None, cache=None, max_workers=2, trace=None):
+    """ 兄弟チャプターを並列に読み込んで結合する。(メタデータ, GPSData, チャプター情報) を返す """
+    paths = find_chapters(path_360)
+    ex = ThreadPoolExecutor(max_workers=min(max_workers, len(paths)))
+    try:
+        futures = [ex.submit(load_telemetry, exiftool, p, cache, trace) for p in paths]
+        chapters = []
+        for i, (path, fut) in enumerate(zip(paths, futures)):
+            meta, gps = fut.result()
+            chapters.append((path, meta, gps))
+            report(progress, f"チャプター読み込み中 ({i + 1}/{len(paths)})", 10 + 60 * (i + 1) // len(paths))
+    finally:
+        # キャンセル時はまだ始まっていない読み込みを取り消す
+        ex.shutdown(wait=True, cancel_futures=True)
+    with span(trace, "session.merge", chapters=len(chapters)):
+        return merge_chapters(chapters)
+
+
+def run_diagnosis(exiftool, path_360, progress=None, cache=None, session=False, trace=None):
+    """ メタデータ取得 → GPS抽出 → 異常検知 をまとめて行う
+        session=True ならチャプターを結合したセッション全体を1回で診断する """
+    with span(trace, "diagnosis", session=session):
+        report(progress, "撮影情報・GPSを取得中...", 10)
+        if session:
+            meta, gps, chapters = load_session(exiftool, path_360, progress, cache, trace=trace)
+        else:
+            meta, gps = load_telemetry(exiftool, path_360, cache, trace)
+            chapters = [(path_360, 0.0, float(meta.get("Duration", 0)), len(gps))]
+        meta_dict, duration_sec = summarize_metadata(meta)
+        lat, lon = np.frombuffer(gps.lat), np.frombuffer(gps.lon)
+        report(progress, "異常検知中...", 80)
+        with span(trace, "detect", points=len(gps)) as s:
+            # サンプルごとの時刻を動画の時間軸に合わせ、区間をフレーム単位で求める
+            timeline = video_timeline(gps.time, gps.sync_utc, gps.sync_video)
+            fps = float(meta.get("VideoFrameRate") or 0) or None
+            rate = sample_rate(timeline)
+            # 判定結果は GPSData の品質フラグとして残す (区間ごとの書き出し・地図の表示でも使う)
+            quality = mark_quality(gps)
+            bad = quality != 0
+            invalid_ranges, invalid_segments, valid_pts = detect_anomalies(lat, lon, duration_sec,
+                                                                           timeline=timeline, fps=fps, bad=bad)
+            gaps = find_gaps(timeline, rate)
+            s["ranges"] = len(invalid_ranges)
+        report(progress, "完了", 100)
+    return {
+        "meta": meta_dict,
+        "duration_sec": duration_sec,
+        "sample_rate": rate,
+        "gaps": gaps,
+        "chapters": chapters,
+        "boundary_gaps": boundary_gaps(chapters, gps, rate),
+        "gps": gps,
+        "lat": lat,
+        "lon": lon,
+        "quality": quality,
+        "bad": bad,
+        "invalid_ranges": invalid_ranges,
+        "invalid_segments": invalid_segments,
+        "valid_pts": valid_pts,
+        "timeline": timeline,
+    }
@@ -0,0 +1,107 @@
+import os
+import re
+import numpy as np
+from gpmf_reader import GPSData, write_gpx
+from gps_anomaly import find_runs, GAP_FACTOR
+
+# GoPro は長時間の撮影をチャプターファイルに分割する (GS010123.360, GS020123.360, ...)。
+# 各チャプターを別々に診断するとチャプター境界で時刻のつながりが切れるため、
+# 兄弟チャプターを探して1本のトラック (セッション) につなぎ、まとめて診断する。
+
+# 'GS' + チャプター番号(2桁) + ファイル番号(4桁)。HERO の GH / GX も同じ命名
+CHAPTER_RE = re.compile(r'^(G[A-Z])(\d{2})(\d{4})$', re.IGNORECASE)
+
+
+def chapter_key(path):
+    """ (接頭辞, ファイル番号, チャプター番号)。GoProの命名でなければ None """
+    stem, _ = os.path.splitext(os.path.basename(path))
+    m = CHAPTER_RE.match(stem)
+    if not m:
+        return None
+    return m.group(1).upper(), m.group(3), int(m.group(2))
+
+
+def find_chapters(path):
+    """ 同じ撮影の全チャプターをチャプター順に返す (分割されていなければ [path]) """
+    key = chapter_key(path)
+    if key is None:
+        return [path]
+    folder = os.path.dirname(path) or "."
+    ext = os.path.splitext(path)[1].lower()
+    chapters = []
+    for name in os.listdir(folder):
+        other = chapter_key(name)
+        if other and other[:2] == key[:2] and os.path.splitext(name)[1].lower() == ext:
+            chapters.append((other[2], os.path.join(folder, name)))
+    return [p for _, p in sorted(chapters)] or [path]
+
+
+def is_first_chapter(path):
+    """ バッチ処理でセッションの代表にするファイルか (2番目以降のチャプターは除く) """
+    chapters = find_chapters(path)
+    return os.path.normcase(os.path.abspath(chapters[0])) == os.path.normcase(os.path.abspath(path))
+
+
+def merge_chapters(chapters):
+    """ [(パス, メタデータ, GPSData), ...] を1本のトラックにつなぐ
+        (メタデータ, GPSData, [(パス, 開始秒, 長さ, 点数), ...]) を返す
+        同期点を各チャプターの開始秒だけずらすので、時刻はセッション全体の時間軸になる """
+    out = GPSData()
+    parts = []
+    offset = 0.0
+    for path, meta, gps in chapters:
+        duration = float(meta.get("Duration", 0))
+        out.lat.extend(gps.lat)
+        out.lon.extend(gps.lon)
+        out.alt.extend(gps.alt)
+        out.time.extend(gps.time)
+        out.quality.extend(gps.quality)
+        if len(gps.sync_utc):
+            out.sync_utc.extend(gps.sync_utc)
+            out.sync_video.extend(v + offset for v in gps.sync_video)
+        elif len(gps):
+            # exiftool 経由 (同期点なし) のチャプターは先頭サンプルをチャプターの0秒とする
+            times = np.frombuffer(gps.time)
+            valid = times[~np.isnan(times)]
+            if len(valid):
+                out.add_sync(float(valid[0]), offset)
+        parts.append((path, offset, duration, len(gps)))
+        offset += duration
+
+    meta = dict(chapters[0][1]) if chapters else {}
+    meta["Duration"] = offset
+    return meta, out, parts
+
+
+def boundary_gaps(parts, gps, rate, factor=GAP_FACTOR):
+    """ チャプター境界でGPSが途切れた箇所を [(セッション上の秒, 欠落秒数), ...] で返す """
+    if not rate:
+        return []
+    times = np.frombuffer(gps.time)
+    gaps = []
+    end = 0
+    for i, (_, offset, _, count) in enumerate(parts):
+        start, end = end, end + count
+        if i == 0 or not count or not start:
+            continue
+        missing = times[start] - times[start - 1]
+        if missing > factor / rate:
+            gaps.append((round(offset, 3), round(float(missing), 3)))
+    return gaps
+
+
+def write_segment_gpx(gps, bad, base_path, name):
+    """ 異常区間で区切った正常区間ごとに base_01.gpx, base_02.gpx, ... を書き出す """
+    stem = os.path.splitext(base_path)[0]
+    starts, ends = find_runs(~np.asarray(bad, dtype=bool))
+    written = []
+    for n, (s, e) in enumerate(zip(starts.tolist(), ends.tolist()), 1):
+        # 1点だけの区間はトラックにならないので書き出さない
+        if e - s < 2:
+            continue
+        seg = gps.slice(s, e)
+        path = f"{stem}_{n:02d}.gpx"
+        with open(path, "w", encoding="utf-8") as f:
+            write_gpx(seg, f, f"{name} ({n})")
+        written.append(path)
+    return written
@@ -1,32 +1,55 @@
 import sys
 import os
-import subprocess
 import json
-import xml.etree.ElementTree as ET
-import platform
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QPushButton, QFileDialog, QLabel, QMessageBox,
-                             QHBoxLayout, QRadioButton, QButtonGroup, QFrame)
-from PySide6.QtWebEngineWidgets import QWebEngineView
-from PySide6.QtWebEngineCore import QWebEngineSettings
-from PySide6.QtCore import Qt, QUrl
+                             QHBoxLayout, QRadioButton, QButtonGroup, QFrame,
+                             QProgressBar, QCheckBox)
+from PySide6.QtCore import Qt, QUrl, QTimer, QCoreApplication
+from exiftool_pool import start_pool_async, resource_path
+from qt_jobs import JobQueue, PipelineJob
+from map_bridge import register_scheme, TrackBridge, TRACK_LOADER_JS, TILE_URL
+from pipeline_trace import span
+from trace_panel import TraceDialog
 
-def resource_path(relative_path):
-    """ PyInstallerの一時フォルダ、または現在のディレクトリから絶対パスを取得 """
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, relative_path)
-    return os.path.join(os.path.abspath("."), relative_path)
+# 起動を速くするため、ウィンドウを出すまでは Qt の画面部品と軽いモジュールだけを読み込む。
+# 処理本体 (numpy を使う gopro_pipeline など) は起動後にバックグラウンドで読み込み、
+# 地図 (QWebEngineView) はウィンドウを表示した後に作る (gopro_gps_analizer と同じ)。
+
+PIPELINE_MODULES = ("gopro_pipeline", "track_simplify", "telemetry_cache", "tile_cache")
+MAP_INIT_DELAY_MS = 50 # ウィンドウが描画されてから地図を作る
+
+def process_and_load(exiftool, path_360, path_mp4, overwrite, progress=None, session=False, repair=False,
+                     trace=None):
+    """ 時刻修正 ＆ GPX作成 の後、地図用の座標読み込み・間引きまでをワーカースレッドで行う """
+    from gopro_pipeline import parse_gpx, process_files as run_process_files
+    from track_simplify import build_pyramid, pack_coords, bounds
+    from telemetry_cache import get_cache
+    target_mp4, output_gpx = run_process_files(exiftool, path_360, path_mp4, overwrite, progress,
+                                               cache=get_cache(), session=session, repair=repair, trace=trace)
+    with span(trace, "gpx.parse", bytes_read=os.path.getsize(output_gpx)) as s:
+        gps = parse_gpx(output_gpx)
+        s["points"] = len(gps)
+    # 地図にはズームごとに間引いた段階 (ピラミッド) をバイナリに詰めて渡す
+    with span(trace, "map.prepare") as s:
+        levels = [(zoom, pack_coords(c[:, 0], c[:, 1])) for zoom, c in build_pyramid(gps.lat, gps.lon)]
+        s["levels"] = len(levels)
+        s["bytes"] = sum(len(data) for _, data in levels)
+    return target_mp4, output_gpx, levels, bounds(gps.lat, gps.lon)
 
 class GoProGPSApp(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.exiftool_cmd = self.get_exiftool_cmd()
+        # exiftool のパス解決・起動と処理本体の読み込みは裏で行う (ジョブの投入時に完了を待つ)
+        self.exiftool_ready = start_pool_async(preload=PIPELINE_MODULES)
         self.setWindowTitle("GoPro Street View Helper (v1.0.1)")
         self.setMinimumSize(1100, 750)
         
         self.path_360 = ""
         self.path_mp4 = ""
         self.coords_data = []
+        self.jobs = JobQueue(self)
+        self.jobs.changed.connect(self.on_jobs_changed)
 
         # UI構成
         self.central_widget = QWidget()
@@ -60,6 +83,13 @@ class GoProGPSApp(QMainWindow):
 
         self.vbox_radio.addWidget(self.radio_overwrite)
         self.vbox_radio.addWidget(self.radio_copy)
+        # GoPro Player は分割されたチャプターを1本のMP4に書き出すので、GPXもつないで作る
+        self.check_session = QCheckBox("チャプターを結合してGPXを作成 (GS01/GS02...)")
+        self.check_session.setChecked(False)
+        self.vbox_radio.addWidget(self.check_session)
+        # 異常区間をカットして書き出し直す代わりに、GPXの側で (0,0)・跳びを補間する
+        self.check_repair = QCheckBox("GPSの異常を自動修復してGPXを作成")
+        self.vbox_radio.addWidget(self.check_repair)
         self.control_panel.addWidget(self.group_box)
 
         self.btn_process = QPushButton("実行（時刻修正 ＆ GPX作成）")
@@ -69,41 +99,55 @@ class GoProGPSApp(QMainWindow):
         self.btn_process.clicked.connect(self.process_files)
         self.control_panel.addWidget(self.btn_process)
 
+        # 進捗表示・キャンセル (処理はバックグラウンドで実行)
+        self.progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("待機中")
+        self.btn_cancel = QPushButton("キャンセル")
+        self.btn_cancel.setEnabled(False)
+        self.btn_cancel.clicked.connect(self.jobs.cancel_all)
+        self.progress_layout.addWidget(self.progress_bar)
+        self.progress_layout.addWidget(self.btn_cancel)
+        self.control_panel.addLayout(self.progress_layout)
+
         self.info_label = QLabel("※GPXはMP4と同じ場所に保存されます")
         self.info_label.setStyleSheet("color: gray; font-size: 10px;")
         self.control_panel.addWidget(self.info_label)
         self.control_panel.addStretch()
 
-        # --- 右側地図パネル ---
+        # どの段階に時間がかかったかを確認する (JSON Lines / Chrome トレース形式で保存できる)
+        self.btn_trace = QPushButton("処理時間の内訳")
+        self.btn_trace.clicked.connect(lambda: TraceDialog(self.jobs.traces, self).exec())
+        self.control_panel.addWidget(self.btn_trace)
+
+        # --- 右側地図パネル (QWebEngineView は Chromium の起動を伴うので、ウィンドウの表示後に作る) ---
+        self.tiles = None
+        self.bridge = None
+        self.web_view = None
+        self.map_placeholder = QLabel("地図を読み込み中...")
+        self.map_placeholder.setAlignment(Qt.AlignCenter)
+        self.main_layout.addWidget(self.map_placeholder, 3)
+        QTimer.singleShot(MAP_INIT_DELAY_MS, self.init_web_view)
+
+    def init_web_view(self):
+        if self.web_view is not None:
+            return
+        from PySide6.QtWebEngineWidgets import QWebEngineView
+        from PySide6.QtWebEngineCore import QWebEngineSettings
+        from tile_cache import get_tile_source
+        # 地図タイルはキャッシュ (tile_cache) を通して読むので、オフラインでも一度見た範囲は表示できる
+        self.tiles = get_tile_source()
+        self.bridge = TrackBridge(self, self.tiles)
         self.web_view = QWebEngineView()
         settings = self.web_view.settings()
         settings.setAttribute(QWebEngineSettings.WebAttribute.LocalContentCanAccessFileUrls, True)
         settings.setAttribute(QWebEngineSettings.WebAttribute.LocalContentCanAccessRemoteUrls, True)
-        
-        self.main_layout.addWidget(self.web_view, 3)
-        self.init_map()
 
-    def get_exiftool_cmd(self):
-        if platform.system() == "Windows":
-            return resource_path("exiftool.exe")
-        
-        # macOS環境
-        exiftool_bin = resource_path("exiftool")
-        exiftool_lib = resource_path("lib")
-        
-        # ExifToolが内部のlibフォルダを見つけられるように環境変数を設定
-        os.environ["PERL5LIB"] = exiftool_lib
-        
-        # システムインストール版があれば優先、なければ同梱版
-        if os.path.exists("/usr/local/bin/exiftool"):
-            return "/usr/local/bin/exiftool"
-        
-        # 同梱版を使う場合は実行権限を確認（ビルド後の属性剥がれ対策）
-        if os.path.exists(exiftool_bin):
-            os.chmod(exiftool_bin, 0o755)
-            return exiftool_bin
-            
-        return "exiftool" # 最終手段としてPATHに期待
+        self.main_layout.replaceWidget(self.map_placeholder, self.web_view)
+        self.map_placeholder.deleteLater()
+        self.init_map()
 
     def init_map(self):
         # macOSでは file:// の後にスラッシュを2つ入れる
@@ -126,19 +170,47 @@ class GoProGPSApp(QMainWindow):
             <script>
                 var map;
                 var polyline = null;
+                var levels = []; // [[最小ズーム, {{key, chunks}}], ...] 最小ズームの昇順
+                var levelCache = {{}};
+                var currentKey = null;
+                var generation = 0;
+{TRACK_LOADER_JS}
                 function initMap() {{
                     if (map) return;
                     map = L.map('map').setView([35.68, 139.76], 5);
-                    L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png').addTo(map);
+                    L.tileLayer('{TILE_URL}').addTo(map);
+                    map.on('zoomend', showLevel);
+                }}
+                // ズームに合った段階を取得して差し替える (未取得ならチャンクごとに描画)
+                async function showLevel() {{
+                    if (!polyline || levels.length == 0) return;
+                    var src = pickLevel(levels, map.getZoom());
+                    if (src.key === currentKey) return;
+                    currentKey = src.key;
+                    if (levelCache[src.key]) {{
+                        polyline.setLatLngs(levelCache[src.key]);
+                        return;
+                    }}
+                    var gen = generation;
+                    var coords = await fetchCoords(src, (all, draw) => {{
+                        if (gen !== generation || currentKey !== src.key) return false;
+                        if (draw) polyline.setLatLngs(all);
+                    }});
+                    if (coords && gen === generation) levelCache[src.key] = coords;
                 }}
-                function updateRoute(coordsJson) {{
+                function updateRoute(info) {{
                     try {{
                         initMap();
-                        var coords = JSON.parse(coordsJson);
+                        generation++;
+                        levels = info.levels;
+                        levelCache = {{}};
+                        currentKey = null;
                         if (polyline) map.removeLayer(polyline);
-                        if (coords.length > 0) {{
-                            polyline = L.polyline(coords, {{color: 'blue', weight: 5}}).addTo(map);
-                            map.fitBounds(polyline.getBounds());
+                        polyline = null;
+                        if (levels.length > 0) {{
+                            polyline = L.polyline([], {{color: 'blue', weight: 5}}).addTo(map);
+                            map.fitBounds(info.bounds);
+                            showLevel();
                             return "Success";
                         }}
                     }} catch (e) {{ return e.message; }}
@@ -169,72 +241,68 @@ class GoProGPSApp(QMainWindow):
             self.btn_process.setEnabled(True)
 
     def process_files(self):
-        mp4_dir = os.path.dirname(self.path_mp4)
-        name_only = os.path.splitext(os.path.basename(self.path_mp4))
-        
-        gpx_fmt = resource_path("gpx.fmt")
-
-        # 保存パスの決定
-        if self.radio_overwrite.isChecked():
-            target_mp4 = self.path_mp4
-            output_gpx = os.path.join(mp4_dir, f"{name_only[0]}.gpx")
-        else:
-            target_mp4 = os.path.join(mp4_dir, f"{name_only[0]}_fixed.mp4")
-            output_gpx = os.path.join(mp4_dir, f"{name_only[0]}_fixed.gpx")
-            # 別名保存で同名ファイルがある場合は削除（ExifToolの仕様回避）
-            if os.path.exists(target_mp4): os.remove(target_mp4)
-
-        try:
-            # 1. 撮影日時抽出
-            res = subprocess.run([self.exiftool_cmd, "-CreateDate", "-s3", "-S", self.path_360], 
-                                 capture_output=True, text=True, check=True)
-            correct_date = res.stdout.strip()
-
-            # 2. MP4時刻修正
-            meta_args = [
-                self.exiftool_cmd,
-                f"-CreateDate={correct_date}", f"-ModifyDate={correct_date}",
-                f"-TrackCreateDate={correct_date}", f"-TrackModifyDate={correct_date}",
-                f"-MediaCreateDate={correct_date}", f"-MediaModifyDate={correct_date}"
-            ]
-
-            if self.radio_overwrite.isChecked():
-                meta_args.append("-overwrite_original")
-                meta_args.append(self.path_mp4)
-            else:
-                meta_args.append("-o")
-                meta_args.append(target_mp4)
-                meta_args.append(self.path_mp4)
-
-            subprocess.run(meta_args, check=True)
-
-            # 3. GPX作成
-            cmd = [self.exiftool_cmd, "-api", "TimePrecision=3", "-p", gpx_fmt, "-ee", "-c", "%.8f", self.path_360]
-            with open(output_gpx, "w", encoding="utf-8") as f:
-                subprocess.run(cmd, stdout=f, check=True)
-
-            # 4. 地図更新
-            self.coords_data = self.parse_gpx(output_gpx)
-            if self.coords_data:
-                json_data = json.dumps(self.coords_data)
-                self.web_view.page().runJavaScript(f"updateRoute('{json_data}')")
-                #QMessageBox.information(self, "完了", f"処理が完了しました。")
-                QMessageBox.information(self, "完了", f"処理が完了しました。\n\n動画: {os.path.basename(target_mp4)}\nGPX: {os.path.basename(output_gpx)}")
-
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"エラーが発生しました: {str(e)}")
-
-    def parse_gpx(self, gpx_path):
-        coords = []
-        try:
-            tree = ET.parse(gpx_path)
-            for trkpt in tree.getroot().iter():
-                if trkpt.tag.endswith('trkpt'):
-                    coords.append([float(trkpt.get('lat')), float(trkpt.get('lon'))])
-        except Exception as e: print(f"GPX Error: {e}")
-        return coords
+        # 1. 撮影日時抽出 → 2. MP4時刻修正 → 3. GPX作成 をワーカースレッドで実行
+        # 実行中に別のファイルを選んで続けてキューに積むこともできる
+        from gopro_session import is_first_chapter
+        session = self.check_session.isChecked()
+        if session and not is_first_chapter(self.path_360):
+            # 2番目以降のチャプターから書き出した動画はそのチャプターの分だけなので、
+            # セッション全体のGPXや先頭チャプターの撮影日時を使うと動画と合わなくなる
+            QMessageBox.warning(self, "Warning", "先頭のチャプター (GS01...) ではないため、チャプターを結合せずに処理します。")
+            session = False
+        job = PipelineJob(self.exiftool_ready.result(), process_and_load, self.path_360, self.path_mp4,
+                          self.radio_overwrite.isChecked(), session=session,
+                          repair=self.check_repair.isChecked(), label=os.path.basename(self.path_360))
+        name = os.path.basename(self.path_mp4)
+        job.signals.progress.connect(lambda msg, pct: self.on_progress(name, msg, pct))
+        job.signals.finished.connect(lambda result: self.show_result(result, job.trace))
+        job.signals.failed.connect(lambda msg: QMessageBox.critical(self, "Error", f"エラーが発生しました: {msg}"))
+        self.jobs.submit(job)
+
+    def on_progress(self, name, message, percent):
+        self.progress_bar.setValue(percent)
+        self.progress_bar.setFormat(f"{name}: {message}")
+
+    def on_jobs_changed(self, count):
+        self.btn_cancel.setEnabled(count > 0)
+        suffix = f" (残り{count}件)" if count > 1 else ""
+        self.btn_process.setText("実行（時刻修正 ＆ GPX作成）" + suffix)
+        if count == 0:
+            self.progress_bar.setValue(0)
+            self.progress_bar.setFormat("待機中")
+
+    def show_result(self, result, trace=None):
+        target_mp4, output_gpx, self.coords_data, route_bounds = result
+
+        # 4. 地図更新 (座標は gopro:// からバイナリで取得させ、ここでは件数と範囲だけ渡す)
+        if self.coords_data:
+            self.init_web_view()
+            with span(trace, "map.push") as s:
+                self.bridge.clear()
+                info = {
+                    "bounds": route_bounds,
+                    "levels": [[zoom, self.bridge.publish(f"route/{zoom}", data)] for zoom, data in self.coords_data],
+                }
+                script = f"updateRoute({json.dumps(info)})"
+                self.web_view.page().runJavaScript(script)
+                s["script_bytes"] = len(script)
+            # fitBounds で表示される範囲のタイルを裏で取得しておく
+            if route_bounds:
+                self.tiles.prefetch(route_bounds, self.web_view.width(), self.web_view.height())
+            #QMessageBox.information(self, "完了", f"処理が完了しました。")
+            QMessageBox.information(self, "完了", f"処理が完了しました。\n\n動画: {os.path.basename(target_mp4)}\nGPX: {os.path.basename(output_gpx)}")
+
+    def closeEvent(self, event):
+        # 実行中の exiftool とタイルの先読みを止めてから終了する
+        self.jobs.wait()
+        if self.tiles:
+            self.tiles.cancel_prefetch()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
+    register_scheme()
+    # QtWebEngineWidgets を QApplication の作成後に読み込むために必要
+    QCoreApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
     window = GoProGPSApp()
     window.show()
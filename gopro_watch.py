@@ -0,0 +1,523 @@
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import select
+import struct
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, BrokenExecutor, wait, FIRST_COMPLETED
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from mp4_index import MP4Index, MP4Error
+from exiftool_pool import get_exiftool_cmd
+from telemetry_cache import default_cache_dir
+from gopro_session import find_chapters, is_first_chapter
+from gopro_batch import find_pairs, process_one, format_result
+
+# 取り込み用のPCで、SDカードをコピーする共有フォルダを監視して自動で処理する常駐版。
+# 新しい .360 (と GoPro Player で書き出した .mp4) を見つけたら、コピーが終わるのを待ってから
+# 時刻修正・GPX作成・GPS診断 (gopro_batch.process_one) をワーカープロセスで行う。
+# ジョブは SQLite に記録するので、再起動しても処理済みのものはやり直さない。
+#
+#   python gopro_watch.py run /srv/ingest --workers 2 --http 8787
+#   python gopro_watch.py status              # 待ち件数・処理速度・失敗したファイル
+#   python gopro_watch.py retry               # 失敗したジョブをやり直す
+#
+# Linux では inotify で変化を待ち、それ以外 (と --poll) では一定間隔でフォルダを走査する。
+# ネットワーク越しに書き込まれた共有フォルダでは inotify が届かないことがあるので、
+# inotify を使う場合も RESCAN_SEC ごとに走査し直す。
+
+SETTLE_SEC = 10.0 # サイズ・更新時刻がこの間変わらなければコピー完了とみなす
+POLL_SEC = 5.0 # inotify を使わない場合の走査間隔
+RESCAN_SEC = 60.0 # inotify を使う場合も、この間隔で走査し直す
+TICK_SEC = 1.0
+THROUGHPUT_WINDOWS = (600, 3600) # 処理速度を集計する期間 (秒)
+MAX_ATTEMPTS = 3 # 実行中に止まったジョブを再起動時にやり直す回数の上限
+
+
+def default_db_path():
+    return os.path.join(default_cache_dir("watch"), "jobs.sqlite")
+
+
+def file_complete(path):
+    """ MP4 のアトムがファイルの末尾まで揃っているか (コピー途中なら moov が無いか途中で切れる) """
+    try:
+        with MP4Index(path) as index:
+            return bool(index.atoms) and index.atoms[-1].end == index.size
+    except (OSError, MP4Error):
+        return False
+
+
+def fingerprint(*paths):
+    """ 入力ファイルのサイズ・更新時刻 (差し替えられたら処理し直す) """
+    parts = []
+    for path in paths:
+        if path:
+            st = os.stat(path)
+            parts.append(f"{st.st_size}:{st.st_mtime_ns}")
+    return "|".join(parts)
+
+
+# --- 変化の待ち受け ---
+
+class PollingWatcher:
+    """ 一定間隔で起きるだけ (毎回走査する) """
+    def __init__(self, root, interval=POLL_SEC):
+        self.interval = interval
+        self.last = 0.0
+
+    def wait(self, timeout):
+        """ timeout 秒まで待ち、走査が必要なら True """
+        time.sleep(timeout)
+        if time.monotonic() - self.last >= self.interval:
+            self.last = time.monotonic()
+            return True
+        return False
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """ inotify (ctypes) でフォルダ以下の書き込み完了・移動・作成を待つ """
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, root, rescan=RESCAN_SEC):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 に失敗しました")
+        self.get_errno = ctypes.get_errno
+        self.root = root
+        self.rescan = rescan
+        self.last = time.monotonic()
+        self.add_tree(root)
+
+    def add_tree(self, root):
+        for dirpath, _, _ in os.walk(root):
+            if self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.MASK) < 0:
+                # 監視数の上限 (fs.inotify.max_user_watches) など。定期的な走査で補う
+                print(f"Watch Error: {dirpath}: {os.strerror(self.get_errno())}", flush=True)
+
+    def wait(self, timeout):
+        changed = False
+        new_dirs = False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                data = b""
+            pos = 0
+            while pos + self.EVENT.size <= len(data):
+                _, mask, _, length = self.EVENT.unpack_from(data, pos)
+                name = data[pos + self.EVENT.size:pos + self.EVENT.size + length].rstrip(b"\0")
+                pos += self.EVENT.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    changed = True
+                elif mask & self.IN_ISDIR:
+                    new_dirs = changed = True
+                elif name.lower().endswith((b".360", b".mp4")):
+                    changed = True
+        if new_dirs:
+            # 作成・移動されたフォルダにも監視を足す (登録済みのフォルダは同じ監視が返るだけ)
+            self.add_tree(self.root)
+        if time.monotonic() - self.last >= self.rescan:
+            changed = True
+        if changed:
+            self.last = time.monotonic()
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(root, poll=False):
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            print(f"inotify を使えないため走査に切り替えます: {e}", flush=True)
+    return PollingWatcher(root)
+
+
+# --- ジョブの記録 ---
+
+class JobStore:
+    """ SQLite のジョブ表。(path_360, path_mp4) ごとに1行 (mp4 が無い場合は '') """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock() # 状態表示の HTTP スレッドからも読む
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, path_360 TEXT NOT NULL, "
+                            "path_mp4 TEXT NOT NULL, fingerprint TEXT NOT NULL, state TEXT NOT NULL, "
+                            "attempts INTEGER NOT NULL DEFAULT 0, queued_at REAL, started_at REAL, "
+                            "finished_at REAL, result TEXT, error TEXT, UNIQUE (path_360, path_mp4))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    def recover(self):
+        """ 前回の実行中に止まったジョブを待ちに戻す。(戻した件数, 失敗にした件数) を返す
+            ワーカーごと落とすファイルで毎回止まらないよう、MAX_ATTEMPTS 回目で失敗にする """
+        with self.lock, self.db:
+            failed = self.db.execute("UPDATE jobs SET state='failed', finished_at=?, error=? "
+                                     "WHERE state='running' AND attempts>=?",
+                                     (time.time(), f"{MAX_ATTEMPTS} 回続けて処理中に止まりました",
+                                      MAX_ATTEMPTS)).rowcount
+            queued = self.db.execute("UPDATE jobs SET state='queued', started_at=NULL "
+                                     "WHERE state='running'").rowcount
+        return queued, failed
+
+    def enqueue(self, path_360, path_mp4, fp):
+        """ 未登録か、入力が差し替えられた (fingerprint が違う) ジョブを待ちに入れる。入れたら True """
+        with self.lock, self.db:
+            row = self.db.execute("SELECT id, fingerprint, state FROM jobs WHERE path_360=? AND path_mp4=?",
+                                  (path_360, path_mp4 or "")).fetchone()
+            if row is None:
+                self.db.execute("INSERT INTO jobs (path_360, path_mp4, fingerprint, state, queued_at) "
+                                "VALUES (?, ?, ?, 'queued', ?)", (path_360, path_mp4 or "", fp, time.time()))
+                return True
+            job_id, old_fp, state = row
+            if old_fp == fp or state == "running":
+                return False
+            self.db.execute("UPDATE jobs SET fingerprint=?, state='queued', attempts=0, queued_at=?, "
+                            "result=NULL, error=NULL WHERE id=?", (fp, time.time(), job_id))
+            return state != "queued"
+
+    def take(self, limit):
+        """ 待ちのジョブを古い順に limit 件取り出して実行中にする """
+        with self.lock, self.db:
+            rows = self.db.execute("SELECT id, path_360, path_mp4 FROM jobs WHERE state='queued' "
+                                   "ORDER BY id LIMIT ?", (limit,)).fetchall()
+            self.db.executemany("UPDATE jobs SET state='running', started_at=?, attempts=attempts+1 "
+                                "WHERE id=?", [(time.time(), r[0]) for r in rows])
+        return [(job_id, p360, pmp4 or None) for job_id, p360, pmp4 in rows]
+
+    def release(self, job_ids):
+        """ 取り出したが実行できなかったジョブを待ちに戻す (試行回数も戻す) """
+        with self.lock, self.db:
+            self.db.executemany("UPDATE jobs SET state='queued', started_at=NULL, attempts=attempts-1 "
+                                "WHERE id=? AND state='running'", [(job_id,) for job_id in job_ids])
+
+    def finish(self, job_id, result, fp):
+        """ fp は処理後の入力の fingerprint (上書き修正した .mp4 を差し替えと見なさないため) """
+        state = "failed" if result.get("error") else "done"
+        result = {k: v for k, v in result.items() if k != "trace"}
+        with self.lock, self.db:
+            self.db.execute("UPDATE jobs SET state=?, finished_at=?, result=?, error=?, "
+                            "fingerprint=COALESCE(?, fingerprint) WHERE id=?",
+                            (state, time.time(), json.dumps(result), result.get("error"), fp, job_id))
+
+    def retry(self):
+        with self.lock, self.db:
+            return self.db.execute("UPDATE jobs SET state='queued', attempts=0, queued_at=?, error=NULL "
+                                   "WHERE state='failed'", (time.time(),)).rowcount
+
+    def status(self, now=None):
+        """ 件数・処理速度・実行中と最近失敗したジョブ (JSON にできる dict) """
+        now = now or time.time()
+        with self.lock:
+            counts = dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            throughput = {}
+            for window in THROUGHPUT_WINDOWS:
+                done, busy = self.db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(finished_at - started_at), 0) FROM jobs "
+                    "WHERE state IN ('done', 'failed') AND finished_at >= ?", (now - window,)).fetchone()
+                throughput[f"{window // 60}min"] = {
+                    "jobs": done, "per_hour": round(done * 3600 / window, 1),
+                    "avg_sec": round(busy / done, 1) if done else None}
+            running = [{"file": p, "sec": round(now - s, 1)} for p, s in self.db.execute(
+                "SELECT path_360, started_at FROM jobs WHERE state='running' ORDER BY started_at")]
+            failed = [{"file": p, "error": e} for p, e in self.db.execute(
+                "SELECT path_360, error FROM jobs WHERE state='failed' ORDER BY finished_at DESC LIMIT 10")]
+        return {"queued": counts.get("queued", 0), "running": counts.get("running", 0),
+                "done": counts.get("done", 0), "failed": counts.get("failed", 0),
+                "throughput": throughput, "running_jobs": running, "recent_failures": failed}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def format_status(status):
+    lines = [f"待ち: {status['queued']}  実行中: {status['running']}  "
+             f"完了: {status['done']}  失敗: {status['failed']}"]
+    for name, t in status["throughput"].items():
+        avg = f"{t['avg_sec']}s/件" if t["avg_sec"] is not None else "-"
+        lines.append(f"直近{name}: {t['jobs']} 件 ({t['per_hour']} 件/時, 平均 {avg})")
+    for job in status["running_jobs"]:
+        lines.append(f"  実行中 {os.path.basename(job['file'])} ({job['sec']}s)")
+    for job in status["recent_failures"]:
+        lines.append(f"  [NG] {os.path.basename(job['file'])}: {job['error']}")
+    return "\n".join(lines)
+
+
+def serve_status(store, port):
+    """ http://127.0.0.1:port/ で status() を JSON で返す (別スレッド) """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/status"):
+                self.send_error(404)
+                return
+            data = json.dumps(store.status(), ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- 監視と実行 ---
+
+def ignore_sigint():
+    # Ctrl+C は親プロセスだけが受け、実行中のジョブは最後まで終わらせる
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Watcher:
+    """ フォルダを走査してコピーの終わったペアをジョブ表に入れ、ワーカーに割り振る """
+    def __init__(self, root, store, workers, exiftool_cmd, overwrite=True, session=False, repair=False,
+                 use_cache=True, settle=SETTLE_SEC):
+        self.root = root
+        self.store = store
+        self.workers = workers
+        self.exiftool_cmd = exiftool_cmd
+        self.overwrite = overwrite
+        self.session = session
+        self.repair = repair
+        self.use_cache = use_cache
+        self.settle = settle
+        self.seen = {} # パス -> (サイズ, 更新時刻, 変化が止まった時刻, コピー完了か)
+        self.running = {} # Future -> (ジョブID, .360, .mp4, 開始前の .360 (チャプター) の fingerprint)
+        self.rescan = False
+        self.pool = None
+        self.stopping = False
+
+    def ready(self, path, now):
+        """ コピーが終わっているか (SETTLE_SEC の間変化がなく、アトムが末尾まで揃っている) """
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.seen.pop(path, None)
+            return False
+        size, mtime, since, complete = self.seen.get(path, (None, None, now, False))
+        if (st.st_size, st.st_mtime_ns) != (size, mtime):
+            self.seen[path] = (st.st_size, st.st_mtime_ns, now, False)
+            return False
+        if not complete and now - since >= self.settle:
+            complete = file_complete(path)
+            self.seen[path] = (size, mtime, since if complete else now, complete)
+        return complete
+
+    def scan(self):
+        """ 新しいペアを待ちに入れ、コピー途中のファイルが残っていれば True """
+        now = time.monotonic()
+        settling = False
+        for path_360, path_mp4 in find_pairs(self.root):
+            if self.session and not is_first_chapter(path_360):
+                continue
+            # セッションでは全チャプターのコピーが終わってから処理する
+            inputs = self.sources(path_360) + ([path_mp4] if path_mp4 else [])
+            if not all([self.ready(p, now) for p in inputs]):
+                settling = True
+                continue
+            try:
+                fp = fingerprint(*inputs)
+            except OSError:
+                continue
+            if self.store.enqueue(path_360, path_mp4, fp):
+                print(f"{time.strftime('%H:%M:%S')} 待ちに追加: {os.path.basename(path_360)}", flush=True)
+        return settling
+
+    def sources(self, path_360):
+        """ ジョブが読む .360 (セッションでは全チャプター) """
+        return find_chapters(path_360) if self.session else [path_360]
+
+    def make_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=ignore_sigint)
+
+    def restart_pool(self):
+        """ ワーカーが落ちて (メモリ不足で強制終了など) 使えなくなったプールを作り直す。
+            実行中だったジョブはどれが原因か分からないので、すべて失敗にする """
+        print(f"{time.strftime('%H:%M:%S')} ワーカーが異常終了したため、プールを作り直します。", flush=True)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        while self.running:
+            self.collect(None)
+        self.pool = self.make_pool()
+
+    def dispatch(self):
+        """ 空いているワーカーにジョブを割り振る。プールが壊れていたら True """
+        jobs = self.store.take(self.workers - len(self.running))
+        for n, (job_id, path_360, path_mp4) in enumerate(jobs):
+            try:
+                before = fingerprint(*self.sources(path_360))
+            except OSError:
+                before = None
+            try:
+                fut = self.pool.submit(process_one, path_360, path_mp4, self.overwrite, True,
+                                       self.exiftool_cmd, self.use_cache, self.session, self.repair)
+            except BrokenExecutor:
+                # まだ実行していないジョブは待ちに戻す
+                self.store.release([j[0] for j in jobs[n:]])
+                return True
+            self.running[fut] = (job_id, path_360, path_mp4, before)
+        return False
+
+    def collect(self, timeout):
+        """ 終わったジョブを記録する。プールが壊れていたら True """
+        if not self.running:
+            return False
+        broken = False
+        done, _ = wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            job_id, path_360, path_mp4, before = self.running.pop(fut)
+            try:
+                result = fut.result()
+            except BrokenExecutor as e:
+                broken = True
+                result = {"file": path_360, "error": f"ワーカーが異常終了しました: {e}"}
+            except Exception as e:
+                result = {"file": path_360, "error": f"ワーカーが異常終了しました: {e}"}
+            # 上書き修正で .mp4 の更新時刻が変わるので、.mp4 は処理後の状態を記録する。
+            # .360 は処理前の状態を記録し、処理中に差し替えられていれば次の走査で待ちに戻す
+            try:
+                fp = fingerprint(*self.sources(path_360))
+                if before is not None and fp != before:
+                    print(f"{time.strftime('%H:%M:%S')} 処理中に差し替えられたため、もう一度処理します: "
+                          f"{os.path.basename(path_360)}", flush=True)
+                    fp = before
+                    self.rescan = True
+                if path_mp4:
+                    fp += "|" + fingerprint(path_mp4)
+            except OSError:
+                fp = None
+            self.store.finish(job_id, result, fp)
+            if "mp4" in result:
+                print(f"{time.strftime('%H:%M:%S')} {format_result(result)}", flush=True)
+            else:
+                print(f"{time.strftime('%H:%M:%S')} [NG] {os.path.basename(path_360)}: {result['error']}", flush=True)
+        return broken
+
+    def run(self, watcher):
+        recovered, failed = self.store.recover()
+        if recovered:
+            print(f"前回の実行中に止まった {recovered} 件を待ちに戻しました。", flush=True)
+        if failed:
+            print(f"{MAX_ATTEMPTS} 回続けて止まった {failed} 件を失敗にしました (retry でやり直せます)。", flush=True)
+        self.pool = self.make_pool()
+        try:
+            settling = self.scan()
+            while not self.stopping:
+                if self.dispatch() or self.collect(TICK_SEC):
+                    self.restart_pool()
+                changed = watcher.wait(0 if self.running else TICK_SEC)
+                # コピー途中のファイルがある間は、イベントが無くても落ち着いたかを確かめる
+                if changed or settling or self.rescan:
+                    self.rescan = False
+                    settling = self.scan()
+            print("終了します (実行中のジョブの完了を待っています)...", flush=True)
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            while self.running:
+                self.collect(None)
+
+
+def cmd_run(args):
+    if not os.path.isdir(args.directory):
+        print(f"フォルダがありません: {args.directory}")
+        return 1
+    store = JobStore(args.db)
+    watcher = Watcher(os.path.abspath(args.directory), store, args.workers,
+                      args.exiftool or get_exiftool_cmd(), not args.copy, args.session, args.repair,
+                      not args.no_cache, args.settle)
+
+    def stop(*_):
+        watcher.stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    server = serve_status(store, args.http) if args.http else None
+    fs_watcher = make_watcher(watcher.root, args.poll)
+    print(f"監視中: {watcher.root} (ワーカー {args.workers}, {type(fs_watcher).__name__}, DB {args.db})", flush=True)
+    if server:
+        print(f"状態: http://127.0.0.1:{server.server_address[1]}/status", flush=True)
+    try:
+        watcher.run(fs_watcher)
+    finally:
+        fs_watcher.close()
+        if server:
+            server.shutdown()
+        store.close()
+    return 0
+
+
+def cmd_status(args):
+    if not os.path.exists(args.db):
+        print(f"ジョブの記録がありません: {args.db}")
+        return 1
+    store = JobStore(args.db)
+    status = store.status()
+    store.close()
+    print(json.dumps(status, ensure_ascii=False, indent=2) if args.json else format_status(status))
+    return 0
+
+
+def cmd_retry(args):
+    store = JobStore(args.db)
+    print(f"{store.retry()} 件を待ちに戻しました。")
+    store.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="フォルダを監視して .360/.mp4 を自動処理（時刻修正・GPX作成・診断）")
+    parser.add_argument("--db", default=default_db_path(), help="ジョブを記録する SQLite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="監視して処理する")
+    run.add_argument("directory", help="監視するフォルダ (サブフォルダも含む)")
+    run.add_argument("-w", "--workers", type=int, default=2, help="並列プロセス数")
+    run.add_argument("--copy", action="store_true", help="MP4を上書きせず _fixed を作成")
+    run.add_argument("--session", action="store_true", help="分割されたチャプターを結合して処理")
+    run.add_argument("--repair", action="store_true", help="GPSの (0,0)・跳びを補間したGPXを作成")
+    run.add_argument("--exiftool", default=None, help="exiftoolのパス")
+    run.add_argument("--no-cache", action="store_true", help="抽出済みGPSのキャッシュを使わない")
+    run.add_argument("--poll", action="store_true", help="inotify を使わず一定間隔で走査する")
+    run.add_argument("--settle", type=float, default=SETTLE_SEC, help="コピー完了とみなすまでの秒数")
+    run.add_argument("--http", type=int, metavar="PORT", help="状態を http://127.0.0.1:PORT/status で返す")
+    run.set_defaults(func=cmd_run)
+
+    status = sub.add_parser("status", help="待ち件数・処理速度を表示する")
+    status.add_argument("--json", action="store_true", help="JSON で表示")
+    status.set_defaults(func=cmd_status)
+
+    retry = sub.add_parser("retry", help="失敗したジョブを待ちに戻す")
+    retry.set_defaults(func=cmd_retry)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
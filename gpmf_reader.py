@@ -0,0 +1,267 @@
+import sys
+import json
+import struct
+from array import array
+from datetime import datetime, timedelta, timezone
+from html import escape
+from mp4_index import MP4Index, MP4Error
+
+# GoPro .360 / .mp4 の GPMF メタデータトラックから GPS を直接読み出す。
+# exiftool -ee -p gpx.fmt はファイル全体を走査してテキストで出力するため、
+# 長時間の撮影では最も遅い処理になる。ここでは MP4 のアトム索引 (mp4_index) の
+# サンプルテーブルから GPMF サンプルの位置だけを求め、そこを直接読む。
+
+GPS_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# GPMF の型文字 -> struct の書式
+GPMF_TYPES = {
+    'b': 'b', 'B': 'B', 's': 'h', 'S': 'H', 'l': 'i', 'L': 'I',
+    'f': 'f', 'd': 'd', 'j': 'q', 'J': 'Q', 'c': 'c', 'F': '4s', 'G': '16s', 'U': '16s',
+}
+
+
+# 品質フラグ (GPSData.quality のビット)。異常検知 (gps_anomaly.mark_quality) で埋める
+QUALITY_NO_FIX = 1 # 未捕捉 (0,0)
+QUALITY_JUMP = 2 # 直前の点からの跳び
+
+# GPSData のバイナリ形式 (write_track / read_track)
+TRACK_MAGIC = b'GPTRACK1'
+TRACK_HEADER = struct.Struct('<8sQQI') # magic, 点数, 同期点の数, メタデータ(JSON)のバイト数
+POINT_COLUMNS = ('lat', 'lon', 'alt', 'time', 'quality')
+SYNC_COLUMNS = ('sync_utc', 'sync_video')
+
+
+class GPMFError(Exception):
+    pass
+
+
+class GPSData:
+    """ GPSサンプルの列 (緯度・経度・高度・UNIX時刻・品質フラグ)
+        列ごとに連続した配列なので、1点あたり 33 バイトで済む """
+    def __init__(self):
+        self.lat = array('d')
+        self.lon = array('d')
+        self.alt = array('d')
+        self.time = array('d')
+        self.quality = array('B') # QUALITY_* のビット和 (0 は正常または未判定)
+        # 同期点: ペイロード先頭サンプルのUTC時刻と、そのペイロードの動画上の開始秒
+        self.sync_utc = array('d')
+        self.sync_video = array('d')
+
+    def __len__(self):
+        return len(self.lat)
+
+    def append(self, lat, lon, alt, t, quality=0):
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.alt.append(alt)
+        self.time.append(t)
+        self.quality.append(quality)
+
+    def add_sync(self, utc, video):
+        self.sync_utc.append(utc)
+        self.sync_video.append(video)
+
+    def slice(self, start, end):
+        """ start〜end の点を、配列をコピーせずに参照する GPSData (区間ごとの書き出し用)
+            列は memoryview になり、参照している間は元の GPSData に append できない """
+        out = GPSData.__new__(GPSData)
+        for name in POINT_COLUMNS:
+            setattr(out, name, memoryview(getattr(self, name))[start:end])
+        out.sync_utc, out.sync_video = self.sync_utc, self.sync_video
+        return out
+
+    @classmethod
+    def from_arrays(cls, lat, lon, alt, time, sync_utc=(), sync_video=(), quality=None):
+        """ numpy などの float64 配列 (quality は uint8) から作る """
+        out = cls()
+        for col, values in ((out.lat, lat), (out.lon, lon), (out.alt, alt), (out.time, time),
+                            (out.sync_utc, sync_utc), (out.sync_video, sync_video)):
+            if len(values):
+                col.frombytes(memoryview(values).cast('B'))
+        if quality is not None and len(quality):
+            out.quality.frombytes(memoryview(quality).cast('B'))
+        else:
+            out.quality.frombytes(bytes(len(out.lat)))
+        return out
+
+
+def write_track(gps, fp, meta=None):
+    """ GPSData (と JSON にできるメタデータ) をバイナリで書き出す
+        ヘッダーの後に各列をそのまま (リトルエンディアンで) 並べる """
+    meta_bytes = json.dumps(meta or {}).encode('utf-8')
+    fp.write(TRACK_HEADER.pack(TRACK_MAGIC, len(gps), len(gps.sync_utc), len(meta_bytes)))
+    fp.write(meta_bytes)
+    for name in POINT_COLUMNS + SYNC_COLUMNS:
+        col = getattr(gps, name)
+        if sys.byteorder != 'little' and col.itemsize > 1:
+            col = array(col.typecode, col)
+            col.byteswap()
+        fp.write(memoryview(col).cast('B'))
+
+
+def read_track(fp):
+    """ write_track の出力から (GPSData, メタデータ) を読む。形式が違えば ValueError """
+    header = fp.read(TRACK_HEADER.size)
+    if len(header) != TRACK_HEADER.size:
+        raise ValueError("トラックファイルが短すぎます")
+    magic, n, n_sync, meta_len = TRACK_HEADER.unpack(header)
+    if magic != TRACK_MAGIC:
+        raise ValueError("トラックファイルではありません")
+    meta = json.loads(fp.read(meta_len).decode('utf-8'))
+    out = GPSData()
+    for name in POINT_COLUMNS + SYNC_COLUMNS:
+        col = getattr(out, name)
+        size = (n if name in POINT_COLUMNS else n_sync) * col.itemsize
+        data = fp.read(size)
+        if len(data) != size:
+            raise ValueError("トラックファイルが途中で切れています")
+        col.frombytes(data)
+        if sys.byteorder != 'little' and col.itemsize > 1:
+            col.byteswap()
+    return out, meta
+
+
+def iter_klv(buf, start=0, end=None):
+    """ GPMFのKLVを (key, type, size, repeat, data) で返す """
+    end = len(buf) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        key = buf[pos:pos + 4]
+        type_char = chr(buf[pos + 4])
+        size = buf[pos + 5]
+        repeat = struct.unpack('>H', buf[pos + 6:pos + 8])[0]
+        length = size * repeat
+        data_start = pos + 8
+        yield key, type_char, size, repeat, data_start, data_start + length
+        pos = data_start + ((length + 3) & ~3)
+
+
+def _unpack_values(buf, type_char, size, repeat, start, complex_type=None):
+    """ 1レコードずつタプルのリストに展開する """
+    if type_char == '?':
+        fmt = '>' + ''.join(GPMF_TYPES[c] for c in complex_type)
+    else:
+        width = struct.calcsize('>' + GPMF_TYPES[type_char])
+        fmt = '>' + GPMF_TYPES[type_char] * (size // width)
+    return [struct.unpack_from(fmt, buf, start + i * size) for i in range(repeat)]
+
+
+def _parse_gpsu(raw):
+    # 'yymmddhhmmss.sss'
+    text = raw.decode('ascii', 'ignore').strip('\x00')
+    dt = datetime.strptime(text, '%y%m%d%H%M%S.%f').replace(tzinfo=timezone.utc)
+    return (dt - UNIX_EPOCH).total_seconds()
+
+
+def _parse_strm(buf, start, end, duration, video_start, out, gps_key=b'GPS5'):
+    scal = (1,)
+    gpsu = None
+    complex_type = None
+    for key, type_char, size, repeat, ds, de in iter_klv(buf, start, end):
+        if key == b'SCAL':
+            scal = [v for rec in _unpack_values(buf, type_char, size, repeat, ds) for v in rec]
+        elif key == b'TYPE':
+            complex_type = buf[ds:de].decode('ascii').rstrip('\x00')
+        elif key == b'GPSU':
+            gpsu = _parse_gpsu(buf[ds:ds + 16])
+        elif key == b'GPS5' and gps_key == b'GPS5' and repeat:
+            if gpsu is None:
+                continue
+            # GPSUは先頭サンプルの時刻。残りはペイロード長で等間隔に補間する
+            step = duration / repeat
+            out.add_sync(gpsu, video_start)
+            for i, rec in enumerate(_unpack_values(buf, type_char, size, repeat, ds)):
+                s = scal if len(scal) > 1 else scal * len(rec)
+                out.append(rec[0] / s[0], rec[1] / s[1], rec[2] / s[2], gpsu + i * step)
+        elif key == b'GPS9' and gps_key == b'GPS9' and repeat:
+            # lat, lon, alt, 2D速度, 3D速度, 2000年からの日数, 秒, DOP, Fix
+            for i, rec in enumerate(_unpack_values(buf, type_char, size, repeat, ds, complex_type or 'lllllllSS')):
+                s = scal if len(scal) > 1 else scal * len(rec)
+                days = rec[5] / s[5]
+                secs = rec[6] / s[6]
+                t = (GPS_EPOCH + timedelta(days=days, seconds=secs) - UNIX_EPOCH).total_seconds()
+                if i == 0:
+                    out.add_sync(t, video_start)
+                out.append(rec[0] / s[0], rec[1] / s[1], rec[2] / s[2], t)
+
+
+def parse_gpmf_payload(buf, duration, out, video_start=0.0):
+    """ 1サンプル分のGPMFペイロードからGPSを取り出して out に追加する
+        video_start はこのペイロードの動画上の開始秒 """
+    for key, type_char, size, repeat, ds, de in iter_klv(buf):
+        if key != b'DEVC' or type_char != '\x00':
+            continue
+        streams = [(sds, sde) for skey, stype, _, _, sds, sde in iter_klv(buf, ds, de)
+                   if skey == b'STRM' and stype == '\x00']
+        # HERO11 以降は同じ測位を GPS5 と GPS9 の両方で記録する。両方読むと全点が2回ずつ入るので、
+        # GPS9 があればそれだけを使い、無い場合だけ GPS5 を使う
+        has_gps9 = any(k == b'GPS9' for s, e in streams for k, *_ in iter_klv(buf, s, e))
+        for sds, sde in streams:
+            _parse_strm(buf, sds, sde, duration, video_start, out, b'GPS9' if has_gps9 else b'GPS5')
+
+
+def read_gps(path, stats=None):
+    """ .360/.mp4 から GPSData を読み出す。stats (dict) を渡すと読んだペイロード数・バイト数を入れる """
+    out = GPSData()
+    try:
+        with MP4Index(path) as index:
+            track = index.track(fmt=b'gpmd')
+            if track is None:
+                raise GPMFError("GPMFトラックが見つかりません")
+            offsets, sizes, durations = track.samples()
+            if stats is not None:
+                stats["payloads"] = len(sizes)
+                stats["bytes_read"] = int(sizes.sum())
+            video_start = 0.0
+            for offset, size, duration in zip(offsets.tolist(), sizes.tolist(), durations.tolist()):
+                parse_gpmf_payload(index.map[offset:offset + size], duration, out, video_start)
+                video_start += duration
+    except MP4Error as e:
+        raise GPMFError(str(e))
+    except (struct.error, KeyError, ValueError, IndexError) as e:
+        raise GPMFError(f"GPMFの解析に失敗しました: {e}")
+    if not len(out):
+        raise GPMFError("GPSデータが含まれていません")
+    return out
+
+
+def _num(v):
+    # exiftool (Perl) の数値出力と同じ15桁表記
+    return '%.15g' % v
+
+
+def format_gpx_time(t):
+    # ミリ秒に丸めてから整形 (浮動小数点誤差で .999 にならないように)
+    ms = round(t * 1000)
+    dt = UNIX_EPOCH + timedelta(milliseconds=ms)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f"{ms % 1000:03d}Z"
+
+
+def write_gpx_header(fp, name):
+    fp.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    fp.write('<gpx version="1.1" creator="ExifTool" xmlns:xsi="www.w3.org" xmlns="www.topografix.com" xsi:schemaLocation="www.topografix.com www.topografix.com/gpx.xsd">\n')
+    # ファイル名に & や < が入っていても壊れたGPXにしない
+    # (xml.sax.saxutils は urllib.request まで読み込むので、同じ置き換えをする html.escape を使う)
+    fp.write(f'<trk><name>{escape(name, quote=False)}</name><trkseg>\n')
+
+
+def write_trkpts(fp, lat, lon, alt, time):
+    """ trkpt を書き出す (チャンクごとに呼んでもよい)
+        exiftool 経由のGPXで高度・時刻が無かった点 (nan) は、その要素を省く """
+    for i in range(len(lat)):
+        ele = f'<ele>{_num(alt[i])}</ele>' if alt[i] == alt[i] else ''
+        t = f'<time>{format_gpx_time(time[i])}</time>' if time[i] == time[i] else ''
+        fp.write(f'<trkpt lat="{_num(lat[i])}" lon="{_num(lon[i])}">{ele}{t}</trkpt>\n')
+
+
+def write_gpx_footer(fp):
+    fp.write('</trkseg></trk></gpx>\n')
+
+
+def write_gpx(gps, fp, name):
+    """ gpx.fmt と同じ形式でGPXを書き出す """
+    write_gpx_header(fp, name)
+    write_trkpts(fp, gps.lat, gps.lon, gps.alt, gps.time)
+    write_gpx_footer(fp)
@@ -0,0 +1,145 @@
+import numpy as np
+from gpmf_reader import QUALITY_NO_FIX, QUALITY_JUMP
+
+# GPS異常検知 (揺れ・跳び・未捕捉) を配列演算で行う。
+# 1地点ずつ Python でループすると、18Hz × 1時間で数十万回の反復になるため、
+# 距離計算・判定・区間の切り出しをすべて NumPy でまとめて処理する。
+
+# 判定用閾値
+# StreetView Studioは急激な座標移動を「跳び」とみなす
+# 1地点あたりの許容移動距離を算出 (秒速45m × サンプリング間隔)
+# GoPro MAXのGPSは約18Hz(0.055秒毎)だが、ここでは1地点ごとの距離で判定
+MAX_DIST_PER_POINT = 15.0 # 15m以上のジャンプは異常（時速160km超相当）
+
+EARTH_RADIUS = 6371000 # 地球半径(m)
+GAP_FACTOR = 3.0 # サンプル間隔が通常の3倍を超えたら欠落とみなす
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ 2点間の距離(m)。配列同士でまとめて計算する """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlat, dlon = lat2 - lat1, lon2 - lon1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+
+def quality_flags(lat, lon, max_dist=MAX_DIST_PER_POINT):
+    """ 各地点の品質フラグ (QUALITY_NO_FIX / QUALITY_JUMP のビット和) の uint8 配列 """
+    # A. 未捕捉判定 (0,0)
+    flags = ((lat == 0) & (lon == 0)).view(np.uint8) * np.uint8(QUALITY_NO_FIX)
+    # B. 跳び判定 (1つ前からの距離が異常)
+    if len(lat) > 1:
+        jump = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]) > max_dist
+        flags[1:] |= jump.view(np.uint8) * np.uint8(QUALITY_JUMP)
+    return flags
+
+
+def find_bad_points(lat, lon, max_dist=MAX_DIST_PER_POINT):
+    """ 各地点が異常かどうかの bool 配列 """
+    return quality_flags(lat, lon, max_dist) != 0
+
+
+def mark_quality(gps, max_dist=MAX_DIST_PER_POINT):
+    """ GPSData の quality 列に品質フラグを書き込み、同じ値の uint8 配列を返す
+        (列のビューを返すと、ビューが残っている間 GPSData に点を足せなくなるので別の配列にする) """
+    if not len(gps):
+        return np.zeros(0, dtype=np.uint8)
+    flags = quality_flags(np.frombuffer(gps.lat), np.frombuffer(gps.lon), max_dist)
+    with memoryview(gps.quality) as column:
+        column[:] = flags.tobytes()
+    return flags
+
+
+def find_runs(mask):
+    """ True が連続する区間を (開始, 終了(含まない)) の配列で返す """
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def video_timeline(times, sync_utc=(), sync_video=()):
+    """ 各サンプルのUTC時刻を動画先頭からの秒数に変換する。時刻が無ければ None
+        同期点 (ペイロードごとのUTC時刻と動画上の秒) があれば二分探索で直前の同期点を基準にする """
+    t = np.array(times, dtype=np.float64)
+    ok = ~np.isnan(t)
+    if not ok.any():
+        return None
+    if not ok.all():
+        # 時刻の欠けたサンプルは前後から補間する
+        idx = np.arange(len(t))
+        t[~ok] = np.interp(idx[~ok], idx[ok], t[ok])
+    # GPS時刻の逆行は直前の時刻に揃える
+    t = np.maximum.accumulate(t)
+
+    sync_utc = np.asarray(sync_utc, dtype=np.float64)
+    sync_video = np.asarray(sync_video, dtype=np.float64)
+    if not len(sync_utc):
+        # 同期点が無い (exiftool経由のGPX) 場合は先頭サンプルを動画の0秒とする
+        return t - t[0]
+    order = np.argsort(sync_utc, kind="stable")
+    sync_utc, sync_video = sync_utc[order], sync_video[order]
+    k = np.clip(np.searchsorted(sync_utc, t, side="right") - 1, 0, len(sync_utc) - 1)
+    return sync_video[k] + (t - sync_utc[k])
+
+
+def sample_rate(timeline):
+    """ 実測のサンプリング周波数(Hz)。中央値の間隔から求める """
+    if timeline is None or len(timeline) < 2:
+        return None
+    dt = np.diff(timeline)
+    dt = dt[dt > 0]
+    if not len(dt):
+        return None
+    return float(1.0 / np.median(dt))
+
+
+def find_gaps(timeline, rate, factor=GAP_FACTOR):
+    """ サンプルが欠落している区間を [(開始秒, 終了秒), ...] で返す """
+    if timeline is None or not rate:
+        return []
+    # 間隔が長いところが続く場合は1つの区間にまとめる
+    starts, ends = find_runs(np.diff(timeline) > factor / rate)
+    return [(round(float(timeline[s]), 3), round(float(timeline[e]), 3))
+            for s, e in zip(starts.tolist(), ends.tolist())]
+
+
+def snap_range(start, end, fps, duration_sec):
+    """ 区間をフレーム境界に広げる (開始は切り捨て・終了は切り上げ) """
+    if fps:
+        start = np.floor(start * fps + 1e-6) / fps
+        end = np.ceil(end * fps - 1e-6) / fps
+    if duration_sec:
+        end = min(end, duration_sec)
+    return round(max(float(start), 0.0), 3), round(float(end), 3)
+
+
+def detect_anomalies(lat, lon, duration_sec, max_dist=MAX_DIST_PER_POINT, timeline=None, fps=None, bad=None):
+    """ 異常検知。(invalid_ranges, invalid_segments, valid_pts) を返す
+        timeline (動画先頭からの秒数) があればサンプル時刻で、無ければインデックス比率で秒数に換算する
+        bad (mark_quality の結果などから作った bool 配列) を渡せば判定をやり直さない
+        invalid_segments は (点数, 2) の配列 (coords のビュー) のリスト、valid_pts は (点数, 2) の配列 """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    n = len(lat)
+    coords = np.column_stack((lat, lon))
+
+    if bad is None:
+        bad = find_bad_points(lat, lon, max_dist)
+    starts, ends = find_runs(bad)
+
+    invalid_ranges = [] # 警告テキスト用 [(start_sec, end_sec), ...]
+    invalid_segments = [] # 赤色表示用
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        if timeline is not None:
+            # 最初の異常サンプルから、次の正常サンプルまで。最後まで異常ならば終端は総秒数
+            end = timeline[e] if e < n else max(duration_sec, timeline[-1])
+            invalid_ranges.append(snap_range(timeline[s], end, fps, duration_sec))
+        else:
+            # 秒数換算 (インデックス比率 × 総秒数)。最後まで異常ならば終端は総秒数
+            start_sec = round((s / n) * duration_sec, 2)
+            end_sec = round((e / n) * duration_sec, 2) if e < n else round(duration_sec, 2)
+            invalid_ranges.append((start_sec, end_sec))
+        # 視覚的な繋がりのため、直前の正常な地点を起点に含める
+        invalid_segments.append(coords[max(s - 1, 0):e])
+
+    valid_pts = coords[~bad] # 青色表示用
+    return invalid_ranges, invalid_segments, valid_pts
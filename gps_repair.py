@@ -0,0 +1,170 @@
+import os
+import sys
+import numpy as np
+from gpmf_reader import write_gpx_header, write_trkpts, write_gpx_footer
+from gpx_stream import iter_trkpts
+from gps_anomaly import haversine, find_runs, MAX_DIST_PER_POINT
+
+# GPSの異常 (未捕捉の (0,0)・跳び) を自動で修復してGPXを書き出す。
+# 診断結果を見て GoPro Player でカット・再書き出しする代わりに、
+#   ・(0,0) の点と跳んだ点を取り除き
+#   ・前後の正常な点から時刻で直線補間する (MAX_INTERP_SEC を超える欠落は補間せず捨てる)
+# 時刻はそのまま残すので、動画を書き出し直さなくても Street View Studio で同期が取れる。
+# トラックは CHUNK_POINTS ずつ処理し、未確定の異常区間だけを次のチャンクへ持ち越す。
+# 時刻修正と一緒に作るGPXは読み込み済みの GPSData を iter_chunks で分けて渡す。
+# 既存のGPXファイルは repair_gpx_file で先頭から逐次読みながら修復するので、
+# 数時間分のトラックでも使用メモリはチャンクの大きさで決まる。
+#
+#   python gps_repair.py track.gpx                # track_repaired.gpx を作る
+#   python gps_repair.py track.gpx fixed.gpx
+
+MAX_INTERP_SEC = 10.0 # これより長い欠落は補間せず、その区間の点を捨てる
+CHUNK_POINTS = 65536
+
+
+class TrackRepairer:
+    """ feed() にチャンクを順に渡し、戻り値 (lat, lon, alt, time) をそのまま書き出す。最後に finish() """
+    def __init__(self, max_dist=MAX_DIST_PER_POINT, max_interp_sec=MAX_INTERP_SEC):
+        self.max_dist = max_dist
+        self.max_interp_sec = max_interp_sec
+        self.prev = None # 直前の (0,0) でない点 (跳びの判定用)
+        self.anchor = None # 直前に確定した正常点 (lat, lon, alt, time)
+        self.pending = None # 次の正常点を待っている異常区間 (列と判定結果)
+        self.stats = {"input": 0, "output": 0, "zero": 0, "interpolated": 0, "dropped": 0}
+
+    def _flags(self, lat, lon):
+        """ (0,0) と、直前の (0,0) でない点から max_dist を超えて跳んだ点
+            判定は前の点だけで決まるので、チャンクの区切り方によらず同じ結果になる """
+        zero = (lat == 0) & (lon == 0)
+        bad = zero.copy()
+        idx = np.flatnonzero(~zero)
+        if len(idx):
+            plat, plon = lat[idx], lon[idx]
+            if self.prev is not None:
+                plat = np.concatenate(([self.prev[0]], plat))
+                plon = np.concatenate(([self.prev[1]], plon))
+            jump = haversine(plat[:-1], plon[:-1], plat[1:], plon[1:]) > self.max_dist
+            bad[idx[len(idx) - len(jump):][jump]] = True
+            self.prev = (lat[idx[-1]], lon[idx[-1]])
+        return bad, zero
+
+    def feed(self, lat, lon, alt, time):
+        # 補間で書き換えるので、元の配列 (キャッシュや GPSData) とは別のコピーにする
+        cols = [np.array(c, dtype=np.float64) for c in (lat, lon, alt, time)]
+        self.stats["input"] += len(cols[0])
+        bad, zero = self._flags(cols[0], cols[1])
+        cols += [bad, zero]
+        if self.pending is not None:
+            cols = [np.concatenate((p, c)) for p, c in zip(self.pending, cols)]
+            self.pending = None
+        has_anchor = self.anchor is not None
+        if has_anchor:
+            cols = [np.concatenate(([a], c)) for a, c in zip(self.anchor + (False, False), cols)]
+        lat, lon, alt, time, bad, zero = cols
+        if not len(lat):
+            return [np.zeros(0)] * 4
+
+        # 時刻が無い点があればインデックスで補間する
+        t = time if not np.isnan(time).any() else np.arange(len(time), dtype=np.float64)
+
+        good = np.flatnonzero(~bad)
+        last = good[-1] if len(good) else -1
+        # 末尾の異常区間は、次のチャンクで正常点が来るまで確定できない
+        if last + 1 < len(lat):
+            tail = slice(last + 1, None)
+            anchor_t = t[last] if last >= 0 else None
+            if anchor_t is not None and t[-1] - anchor_t <= self.max_interp_sec:
+                self.pending = [c[tail] for c in cols]
+            else:
+                # どのみち補間できない長さなので、持ち越さずに捨てる
+                self.stats["dropped"] += len(lat) - last - 1
+                self.stats["zero"] += int(zero[tail].sum())
+            lat, lon, alt, time, t, bad, zero = (c[:last + 1] for c in (lat, lon, alt, time, t, bad, zero))
+        if not len(lat):
+            return [np.zeros(0)] * 4
+
+        keep = ~bad
+        starts, ends = find_runs(bad)
+        for s, e in zip(starts.tolist(), ends.tolist()):
+            # 前に正常点が無い (トラック先頭) か、欠落が長すぎる区間は捨てる
+            if s == 0 or t[e] - t[s - 1] > self.max_interp_sec:
+                self.stats["dropped"] += e - s
+                continue
+            keep[s:e] = True
+            self.stats["interpolated"] += e - s
+        self.stats["zero"] += int(zero.sum())
+
+        # 補間する点は前後の正常点から時刻で直線補間する (全区間まとめて)
+        fill = keep & bad
+        if fill.any():
+            ok = ~bad
+            for col in (lat, lon, alt):
+                col[fill] = np.interp(t[fill], t[ok], col[ok])
+
+        self.anchor = (lat[-1], lon[-1], alt[-1], time[-1])
+        out = [c[keep] for c in (lat, lon, alt, time)]
+        if has_anchor:
+            out = [c[1:] for c in out]
+        self.stats["output"] += len(out[0])
+        return out
+
+    def finish(self):
+        """ 最後まで正常点が来なかった異常区間は捨てる """
+        if self.pending is not None:
+            self.stats["dropped"] += len(self.pending[0])
+            self.stats["zero"] += int(self.pending[5].sum())
+            self.pending = None
+        return self.stats
+
+
+def iter_chunks(gps, size=CHUNK_POINTS):
+    """ GPSData を (lat, lon, alt, time) のチャンクに分ける (コピーしない) """
+    cols = [np.frombuffer(c) if len(c) else np.zeros(0) for c in (gps.lat, gps.lon, gps.alt, gps.time)]
+    for i in range(0, len(cols[0]), size):
+        yield [c[i:i + size] for c in cols]
+
+
+def iter_point_chunks(points, size=CHUNK_POINTS):
+    """ (lat, lon, ele, time) のイテレータ (gpx_stream.iter_trkpts など) をチャンクにまとめる """
+    buf = []
+    for p in points:
+        buf.append(p)
+        if len(buf) == size:
+            yield list(np.array(buf, dtype=np.float64).T)
+            buf = []
+    if buf:
+        yield list(np.array(buf, dtype=np.float64).T)
+
+
+def write_repaired_gpx(chunks, fp, name, max_dist=MAX_DIST_PER_POINT):
+    """ チャンクを修復しながらGPXに書き出す。修復の集計 (stats) を返す """
+    repairer = TrackRepairer(max_dist)
+    write_gpx_header(fp, name)
+    for lat, lon, alt, time in chunks:
+        write_trkpts(fp, *repairer.feed(lat, lon, alt, time))
+    write_gpx_footer(fp)
+    return repairer.finish()
+
+
+def repair_gpx_file(src, dst, name=None, size=CHUNK_POINTS):
+    """ GPXファイルを逐次読みながら修復して dst に書き出す (トラック全体を読み込まない)。集計を返す """
+    if name is None:
+        name = os.path.splitext(os.path.basename(src))[0]
+    with open(dst, "w", encoding="utf-8") as f:
+        return write_repaired_gpx(iter_point_chunks(iter_trkpts(src), size), f, name)
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    if not 1 <= len(args) <= 2:
+        print("使い方: python gps_repair.py 入力.gpx [出力.gpx]")
+        return 1
+    src = args[0]
+    dst = args[1] if len(args) == 2 else os.path.splitext(src)[0] + "_repaired.gpx"
+    stats = repair_gpx_file(src, dst)
+    print(f"{dst}: {stats['output']} 点 (補間 {stats['interpolated']} 点・除外 {stats['dropped']} 点)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
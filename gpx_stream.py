@@ -0,0 +1,60 @@
+import math
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from gpmf_reader import GPSData
+
+# GPXを iterparse で先頭から順に読み、trkpt を処理したそばから要素を捨てる。
+# ET.parse で全体のDOMを作ると、18Hz × 数時間のGPXでは数百MBになるため、
+# 使用メモリをトラックの長さに関係なく一定に抑える。
+
+
+def _local(tag):
+    # '{www.topografix.com}trkpt' -> 'trkpt'
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_gpx_time(text):
+    """ '2024-05-01T02:20:00.123Z' -> UNIX時刻。無い・読めない場合は nan """
+    if not text:
+        return math.nan
+    try:
+        return datetime.fromisoformat(text.strip().replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return math.nan
+
+
+def iter_trkpts(source):
+    """ GPX (パスまたはファイルオブジェクト) から (lat, lon, ele, time) を順に返す """
+    seg = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        tag = _local(elem.tag)
+        if event == 'start':
+            if tag == 'trkseg':
+                seg = elem
+            continue
+        if tag != 'trkpt':
+            continue
+
+        ele = math.nan
+        t = math.nan
+        for child in elem:
+            name = _local(child.tag)
+            if name == 'ele' and child.text:
+                ele = float(child.text)
+            elif name == 'time':
+                t = parse_gpx_time(child.text)
+        yield float(elem.get('lat')), float(elem.get('lon')), ele, t
+
+        # 処理済みの trkpt を親ごと捨てて、DOMが伸びないようにする
+        if seg is not None:
+            seg.clear()
+        else:
+            elem.clear()
+
+
+def read_gpx(source):
+    """ GPXを GPSData (array('d') の列) に読み込む """
+    out = GPSData()
+    for lat, lon, ele, t in iter_trkpts(source):
+        out.append(lat, lon, ele, t)
+    return out
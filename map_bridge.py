@@ -0,0 +1,199 @@
+import re
+import json
+from urllib.parse import parse_qs
+from PySide6.QtCore import QBuffer, QIODevice, QByteArray, Signal
+from PySide6.QtWebEngineCore import (QWebEngineUrlScheme, QWebEngineUrlSchemeHandler,
+                                     QWebEngineUrlRequestJob, QWebEngineProfile)
+
+# Python -> 地図 (QWebEngineView) の座標受け渡し。
+# JSON文字列を runJavaScript に埋め込むとトラック全体が何度もコピーされ、
+# 値に引用符が入ると壊れる。ここでは座標を Float64 (lat, lon, lat, lon, ...) の
+# バイナリにしてチャンクに分け、gopro:// スキームで配信する。ページ側は
+# fetch() で ArrayBuffer として受け取り、届いたチャンクから順に描画する。
+# 地図タイルも gopro://tile/{z}/{x}/{y}.png で配信し、tile_cache のキャッシュから返す。
+# 逆方向 (地図 -> Python) の問い合わせも同じスキームで受ける。クリック・マウス位置の
+# 最寄りのサンプルは gopro://track/nearest?lat=..&lon=..&radius=.. で track_index から JSON で返す。
+# バッファの作成 (numpy) は track_simplify にあり、ここは起動時に読み込んでも軽い。
+
+SCHEME = b"gopro"
+CHUNK_POINTS = 20000 # 1チャンクあたりの点数 (320KB)
+TILE_URL = "gopro://tile/{z}/{x}/{y}.png" # L.tileLayer に渡すURL
+TILE_PATH = re.compile(r"^(\d+)/(\d+)/(\d+)\.png$")
+
+
+def register_scheme():
+    """ QApplication を作る前に呼ぶ """
+    scheme = QWebEngineUrlScheme(SCHEME)
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Host)
+    scheme.setFlags(QWebEngineUrlScheme.Flag.SecureScheme |
+                    QWebEngineUrlScheme.Flag.LocalAccessAllowed |
+                    QWebEngineUrlScheme.Flag.CorsEnabled)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+
+class TrackBridge(QWebEngineUrlSchemeHandler):
+    """ gopro://data/<key>/<chunk> でバッファを、gopro://tile/<z>/<x>/<y>.png で地図タイルを配信し、
+        gopro://track/nearest で最寄りのサンプルの問い合わせに答える """
+    tile_ready = Signal(int, object) # (要求の番号, 画像データ or None) ワーカースレッド -> GUIスレッド
+
+    def __init__(self, parent=None, tiles=None):
+        super().__init__(parent)
+        self.chunks = {}
+        self.tiles = tiles # tile_cache.TileSource
+        self.index = None # 表示中のトラックの track_index.TrackIndex
+        self.pending = {} # 取得待ちのタイル要求
+        self.next_id = 0
+        self.tile_ready.connect(self._reply_tile)
+        QWebEngineProfile.defaultProfile().installUrlSchemeHandler(SCHEME, self)
+
+    def clear(self):
+        self.chunks = {}
+        self.index = None
+
+    def publish(self, key, data):
+        """ バッファをチャンクに分けて登録し、ページに渡す {key, chunks} を返す """
+        size = CHUNK_POINTS * 16
+        chunks = [data[i:i + size] for i in range(0, len(data), size)] or [b""]
+        self.chunks[key] = chunks
+        return {"key": key, "chunks": len(chunks)}
+
+    def requestStarted(self, job):
+        if job.requestUrl().host() == "tile":
+            self._request_tile(job)
+            return
+        if job.requestUrl().host() == "track":
+            self._query_track(job)
+            return
+        # gopro://data/<key>/<chunk>  (key に '/' を含めてもよい)
+        path = job.requestUrl().path().strip("/")
+        key, _, index = path.rpartition("/")
+        chunks = self.chunks.get(key)
+        if chunks is None or not index.isdigit() or int(index) >= len(chunks):
+            job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+            return
+        self._reply(job, b"application/octet-stream", chunks[int(index)])
+
+    def _reply(self, job, mime, data):
+        buf = QBuffer(job)
+        buf.setData(QByteArray(data))
+        buf.open(QIODevice.ReadOnly)
+        job.reply(QByteArray(mime), buf)
+
+    def _query_track(self, job):
+        # 索引の検索は 1ms 未満なので、GUIスレッドでそのまま答える
+        url = job.requestUrl()
+        query = {k: v[0] for k, v in parse_qs(url.query()).items()}
+        if url.path().strip("/") != "nearest":
+            job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+            return
+        try:
+            lat, lon = float(query["lat"]), float(query["lon"])
+            radius = float(query["radius"]) if "radius" in query else None
+        except (KeyError, ValueError):
+            job.fail(QWebEngineUrlRequestJob.Error.RequestFailed)
+            return
+        info = self.index.lookup(lat, lon, radius) if self.index is not None else None
+        self._reply(job, b"application/json", json.dumps(info or {}).encode())
+
+    def _request_tile(self, job):
+        m = TILE_PATH.match(job.requestUrl().path().strip("/"))
+        if self.tiles is None or m is None:
+            job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+            return
+        # キャッシュの読み出し・取得はワーカースレッドで行い、結果はシグナルでGUIスレッドに戻す
+        request_id = self.next_id
+        self.next_id += 1
+        self.pending[request_id] = job
+        # ページ側で要求が取り消されると job は破棄されるので、その後は応答しない
+        job.destroyed.connect(lambda *_: self.pending.pop(request_id, None))
+        z, x, y = (int(v) for v in m.groups())
+        self.tiles.get_async(z, x, y, lambda data: self.tile_ready.emit(request_id, data))
+
+    def _reply_tile(self, request_id, data):
+        job = self.pending.pop(request_id, None)
+        if job is None:
+            return
+        if data is None:
+            job.fail(QWebEngineUrlRequestJob.Error.RequestFailed)
+        else:
+            self._reply(job, b"image/png", data)
+
+
+# ページ側の共通処理 (init_map の HTML に埋め込む)
+TRACK_LOADER_JS = """
+// gopro:// から lat, lon 交互の Float64Array をチャンク単位で取得し、1つの配列に追加していく。
+// チャンクが届くたびに onChunk(ここまでの全座標, 描き直すか) を呼ぶ。NaN は線分の区切り (null)
+// 最初のチャンクはすぐに描き、以降の描き直しは REDRAW_MS に1回まで (最後のチャンクでは必ず)。毎回全体を描き直すと長いトラックで重くなる
+// onChunk が false を返したら中断して null を返す
+var REDRAW_MS = 200;
+async function fetchCoords(src, onChunk) {
+    var all = [];
+    var lastDraw = -Infinity; // 最初のチャンクは待たずに描く
+    for (var i = 0; i < src.chunks; i++) {
+        var res = await fetch('gopro://data/' + src.key + '/' + i);
+        var arr = new Float64Array(await res.arrayBuffer());
+        for (var j = 0; j < arr.length; j += 2) {
+            all.push(isNaN(arr[j]) ? null : [arr[j], arr[j + 1]]);
+        }
+        if (!onChunk) continue;
+        var now = performance.now();
+        var draw = i === src.chunks - 1 || now - lastDraw >= REDRAW_MS;
+        if (draw) lastDraw = now;
+        if (onChunk(all, draw) === false) return null;
+    }
+    return all;
+}
+
+// null 区切りの座標列を線分のリストに分ける
+function splitSegments(coords) {
+    var segs = [], cur = [];
+    coords.forEach(c => {
+        if (c === null) { if (cur.length) segs.push(cur); cur = []; }
+        else cur.push(c);
+    });
+    if (cur.length) segs.push(cur);
+    return segs;
+}
+
+// 現在のズームに合った間引き段階を選ぶ ([[最小ズーム, src], ...] 最小ズームの昇順)
+function pickLevel(levels, zoom) {
+    var src = levels[0][1];
+    levels.forEach(l => { if (l[0] <= zoom) src = l[1]; });
+    return src;
+}
+"""
+
+# 最寄りのサンプルの問い合わせ (クリック・マウス位置の表示用)
+TRACK_QUERY_JS = """
+// latlng から radiusPx ピクセル以内にある最寄りのサンプル。無ければ null
+async function queryNearest(latlng, radiusPx) {
+    // 現在のズームでの 1 ピクセルあたりのメートル
+    var mpp = 40075016.686 * Math.cos(latlng.lat * Math.PI / 180) / Math.pow(2, map.getZoom() + 8);
+    try {
+        var res = await fetch('gopro://track/nearest?lat=' + latlng.lat + '&lon=' + latlng.lng +
+                              '&radius=' + (radiusPx * mpp));
+        var info = await res.json();
+        return info.index === undefined ? null : info;
+    } catch (e) {
+        return null;
+    }
+}
+
+// 動画上の秒 -> 'm:ss.sss'
+function formatVideoTime(sec) {
+    var m = Math.floor(sec / 60);
+    var s = (sec - m * 60).toFixed(3);
+    return m + ':' + (s < 10 ? '0' : '') + s;
+}
+
+function describeSample(info) {
+    var lines = [];
+    if (info.video !== undefined) lines.push('動画: ' + formatVideoTime(info.video) + ' (' + info.video.toFixed(3) + 's)');
+    if (info.utc !== undefined) lines.push('UTC: ' + info.utc);
+    if (info.speed_kmh !== undefined) lines.push('速度: ' + info.speed_kmh.toFixed(1) + ' km/h');
+    if (info.no_fix) lines.push('<b style="color:red">異常 (未捕捉)</b>');
+    else if (info.jump) lines.push('<b style="color:red">異常 (跳び)</b>');
+    else lines.push('正常');
+    return lines.join('<br>');
+}
+"""
@@ -0,0 +1,117 @@
+import os
+import sys
+import shutil
+import struct
+from datetime import datetime, timezone
+from mp4_index import MP4Index, MP4Error, QT_EPOCH
+
+# MP4 の QuickTime 日時 (mvhd / tkhd / mdhd の作成・更新日時) をその場で書き換える。
+# exiftool は上書きでも一時ファイルへ全体を書き直し、-o では数GBのMP4を丸ごと複製する。
+# これらは固定長のフィールドなので、アトムの位置を求めて数バイトを上書きすれば済む。
+
+COPY_BLOCK = 16 * 1024 * 1024
+FICLONE = 0x40049409 # Linux の reflink ioctl
+
+
+class MP4PatchError(Exception):
+    pass
+
+
+def parse_exif_date(text):
+    """ exiftool の '2024:05:01 02:20:00' (UTC) -> 1904年からの秒数 """
+    try:
+        dt = datetime.strptime(str(text).strip()[:19], '%Y:%m:%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise MP4PatchError(f"日時を解釈できません: {text}")
+    return int((dt - QT_EPOCH).total_seconds())
+
+
+def find_date_fields(path):
+    """ 作成・更新日時フィールドの (ファイル上の位置, バイト数) """
+    try:
+        with MP4Index(path) as index:
+            return index.date_fields()
+    except MP4Error as e:
+        raise MP4PatchError(str(e))
+
+
+def patch_dates(path, qt_seconds):
+    """ MP4 の日時をその場で書き換える。書き換えたフィールド数を返す """
+    fields = find_date_fields(path)
+    with open(path, 'r+b') as f:
+        for pos, width in fields:
+            if width == 4 and not 0 <= qt_seconds < 2 ** 32:
+                raise MP4PatchError("32bitの日時フィールドに収まりません")
+        for pos, width in fields:
+            data = struct.pack('>I' if width == 4 else '>Q', qt_seconds)
+            if hasattr(os, 'pwrite'):
+                os.pwrite(f.fileno(), data, pos)
+            else:
+                f.seek(pos)
+                f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(fields)
+
+
+def _reflink(src, dst):
+    # Btrfs / XFS などでは中身を複製せずブロックを共有する
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        import fcntl
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_range(src, dst, size):
+    # カーネル内でコピーする (ユーザー空間にデータを持ち込まない)
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    pos = 0
+    try:
+        while pos < size:
+            n = os.copy_file_range(src.fileno(), dst.fileno(), size - pos)
+            if n == 0:
+                break
+            pos += n
+    except OSError:
+        pass
+    if pos == size:
+        return True
+    src.seek(0)
+    dst.seek(0)
+    dst.truncate()
+    return False
+
+
+def clone_file(src_path, dst_path):
+    """ src を dst に複製する。reflink → copy_file_range → 通常のコピー の順に試す """
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        if _reflink(src, dst):
+            return "reflink"
+        if _copy_range(src, dst, os.fstat(src.fileno()).st_size):
+            return "copy_file_range"
+        shutil.copyfileobj(src, dst, COPY_BLOCK)
+        return "copy"
+
+
+def fix_dates(path_mp4, target_mp4, date_text):
+    """ 日時を書き換えた MP4 を target_mp4 に作る (同じパスなら上書き)
+        その場で書き換えられない場合は MP4PatchError (作りかけの target は削除する) """
+    qt_seconds = parse_exif_date(date_text)
+    try:
+        if target_mp4 != path_mp4:
+            # 書き換えられないファイルを複製しないよう、先に日時のアトムを確認する
+            find_date_fields(path_mp4)
+            clone_file(path_mp4, target_mp4)
+        try:
+            patch_dates(target_mp4, qt_seconds)
+        except Exception:
+            if target_mp4 != path_mp4:
+                os.remove(target_mp4)
+            raise
+    except (struct.error, IndexError) as e:
+        raise MP4PatchError(f"MP4の解析に失敗しました: {e}")
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# 処理段階ごとの所要時間を記録する (どの段階が遅いのかを後から調べるため)。
+# 1ファイル分の処理に Trace を1つ作り、各段階を span() で囲む。span には
+# 点数・読み書きしたバイト数・exiftool (子プロセス) の CPU時間・メモリなどを追記できる。
+# 記録は JSON Lines か Chrome のトレース形式 (chrome://tracing, Perfetto) で書き出せる。
+#
+#   trace = Trace("GS010123.360")
+#   with span(trace, "gps.extract") as s:
+#       gps = read_gps(path)
+#       s["points"] = len(gps)
+
+
+class Trace:
+    """ 1ファイル分の処理の記録 (複数スレッドから記録してよい) """
+    def __init__(self, label=""):
+        self.label = label
+        self.pid = os.getpid()
+        self.epoch = time.time() # span の開始時刻はこの時点からの秒数
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **fields):
+        t0 = time.perf_counter()
+        c0 = time.thread_time()
+        try:
+            yield fields
+        except BaseException as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            record = {"name": name, "start": t0 - self.t0, "dur": time.perf_counter() - t0,
+                      "cpu": time.thread_time() - c0, "tid": threading.get_ident(), **fields}
+            with self.lock:
+                self.spans.append(record)
+
+    def records(self):
+        """ 書き出し用の dict のリスト (プロセス間で受け渡せる) """
+        with self.lock:
+            spans = list(self.spans)
+        return [{"file": self.label, "pid": self.pid, "ts": round(self.epoch + s["start"], 6),
+                 **{k: round(v, 6) if k in ("dur", "cpu") else v for k, v in s.items() if k != "start"}}
+                for s in spans]
+
+
+@contextmanager
+def span(trace, name, **fields):
+    """ trace が None なら計測しない。yield した dict に件数などを追記できる """
+    if trace is None:
+        yield fields
+        return
+    with trace.span(name, **fields) as s:
+        yield s
+
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_psutil = None
+UNAVAILABLE = "unavailable" # 子プロセスの CPU時間・メモリを取れない環境で span に入れる値
+
+
+def _load_psutil():
+    """ psutil があれば使う (任意。起動時に読み込まないよう、最初に使うときに import する) """
+    global _psutil
+    if _psutil is None:
+        try:
+            import psutil
+            _psutil = psutil
+        except ImportError:
+            _psutil = False
+    return _psutil
+
+
+def _psutil_usage(psutil, pid):
+    try:
+        proc = psutil.Process(pid)
+        with proc.oneshot():
+            times = proc.cpu_times()
+            mem = proc.memory_info()
+    except psutil.Error:
+        return None
+    usage = {"cpu": times.user + times.system, "rss": mem.rss}
+    # 最大常駐メモリは Windows (peak_wset) だけ
+    if getattr(mem, "peak_wset", None) is not None:
+        usage["peak_rss"] = mem.peak_wset
+    return usage
+
+
+def _proc_usage(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # comm に空白や括弧が入ってもよいように、最後の ')' より後ろを分割する
+            fields = f.read().rsplit(")", 1)[1].split()
+        usage = {"cpu": (int(fields[11]) + int(fields[12])) / _CLK_TCK}
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    usage["rss" if key == "VmRSS" else "peak_rss"] = int(value.split()[0]) * 1024
+        return usage
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def usage_available():
+    """ 子プロセスの CPU時間・メモリを取れるか (psutil か /proc がある) """
+    return bool(_load_psutil()) or os.path.isdir("/proc/self")
+
+
+def process_usage(pid):
+    """ 子プロセスの {'cpu': 累積CPU秒, 'rss': 常駐メモリ, 'peak_rss': 最大常駐メモリ (bytes)}
+        psutil があればそれを、無ければ /proc を使う。どちらも無い・プロセスが終了済みなら None """
+    psutil = _load_psutil()
+    if not psutil:
+        return _proc_usage(pid)
+    usage = _psutil_usage(psutil, pid)
+    if usage is not None and "peak_rss" not in usage:
+        # psutil では最大常駐メモリが取れない。Linux なら /proc の VmHWM で補う
+        usage["peak_rss"] = (_proc_usage(pid) or {}).get("peak_rss")
+        if usage["peak_rss"] is None:
+            del usage["peak_rss"]
+    return usage
+
+
+def add_child_usage(fields, before, after):
+    """ 実行前後の process_usage から子プロセスの CPU時間・メモリを span に追記する
+        取れない環境では child_usage=unavailable を入れる (空欄と区別するため) """
+    if before is None or after is None:
+        if not usage_available():
+            fields["child_usage"] = UNAVAILABLE
+        return
+    fields["child_cpu"] = round(after["cpu"] - before["cpu"], 3)
+    if "rss" in after:
+        fields["child_rss"] = after["rss"]
+    if "peak_rss" in after:
+        fields["child_peak_rss"] = after["peak_rss"]
+
+
+def summarize(records):
+    """ 段階ごとの [(名前, 回数, 合計秒, 最大秒)] を合計の大きい順に返す """
+    stats = {}
+    for r in records:
+        count, total, worst = stats.get(r["name"], (0, 0.0, 0.0))
+        stats[r["name"]] = (count + 1, total + r["dur"], max(worst, r["dur"]))
+    return sorted(((name, *v) for name, v in stats.items()), key=lambda s: -s[2])
+
+
+def write_jsonl(records, fp):
+    """ 1 span 1行の JSON Lines で書き出す """
+    for r in records:
+        fp.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+def chrome_trace(records):
+    """ Chrome のトレース形式 (Trace Event Format) の dict を作る
+        プロセス (バッチのワーカー)・スレッドごとに行が分かれ、ファイル名は args に入る """
+    events = []
+    for r in records:
+        args = {k: v for k, v in r.items() if k not in ("name", "ts", "dur", "pid", "tid")}
+        events.append({"name": r["name"], "cat": "pipeline", "ph": "X",
+                       "ts": int(r["ts"] * 1e6), "dur": max(int(r["dur"] * 1e6), 1),
+                       "pid": r["pid"], "tid": r["tid"], "args": args})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(records, fp):
+    json.dump(chrome_trace(records), fp, ensure_ascii=False)
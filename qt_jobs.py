@@ -0,0 +1,92 @@
+from collections import deque
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+from exiftool_pool import CancellableExifTool, CancelledError
+from pipeline_trace import Trace
+
+# 診断・書き出しをGUIスレッドの外 (QThreadPool) で実行する。
+# 処理中もウィンドウが固まらず、続けて別のファイルをキューに積める。
+# 結果はシグナル経由でGUIスレッドに戻すので、updateMap / updateRoute は
+# 必ずGUIスレッドから呼ばれる。
+# ジョブごとに Trace を作って処理関数に trace= で渡し、処理時間の内訳を記録する。
+
+MAX_TRACES = 50 # 処理時間の内訳を残しておくジョブ数
+
+
+class JobSignals(QObject):
+    progress = Signal(str, int)   # (メッセージ, 0-100)
+    finished = Signal(object)     # 処理関数の戻り値
+    failed = Signal(str)
+    cancelled = Signal()
+
+
+class PipelineJob(QRunnable):
+    """ fn(exiftool, *args, progress=..., trace=..., **kwargs) をワーカースレッドで実行する """
+    def __init__(self, pool, fn, *args, label="", **kwargs):
+        super().__init__()
+        self.signals = JobSignals()
+        self.trace = Trace(label)
+        self.exiftool = CancellableExifTool(pool, self.trace)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.label = label
+
+    def progress(self, message, percent):
+        # 進捗報告のたびにキャンセルを確認する
+        self.exiftool.check()
+        self.signals.progress.emit(message, percent)
+
+    def run(self):
+        try:
+            result = self.fn(self.exiftool, *self.args, progress=self.progress, trace=self.trace, **self.kwargs)
+        except CancelledError:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            if self.exiftool.cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+    def cancel(self):
+        self.exiftool.cancel()
+
+
+class JobQueue(QObject):
+    """ 実行待ち・実行中のジョブを管理する """
+    changed = Signal(int)  # 実行待ち + 実行中の件数
+
+    def __init__(self, parent=None, max_threads=2):
+        super().__init__(parent)
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max_threads)
+        self.jobs = []
+        self.traces = deque(maxlen=MAX_TRACES) # 終わったジョブの Trace (古い順)
+
+    def submit(self, job):
+        # QRunnable の寿命は Python 側で保持する (シグナルが途中で消えないように)
+        job.setAutoDelete(False)
+        self.jobs.append(job)
+        for sig in (job.signals.finished, job.signals.failed, job.signals.cancelled):
+            sig.connect(lambda *_, j=job: self._done(j))
+        self.thread_pool.start(job)
+        self.changed.emit(len(self.jobs))
+
+    def _done(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+            self.traces.append(job.trace)
+        self.changed.emit(len(self.jobs))
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            if self.thread_pool.tryTake(job):
+                # まだ開始していないジョブはそのまま取り除く
+                job.signals.cancelled.emit()
+            else:
+                job.cancel()
+
+    def wait(self):
+        self.cancel_all()
+        self.thread_pool.waitForDone()
@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import hashlib
+import tempfile
+from gpmf_reader import write_track, read_track
+
+# 抽出済みのメタデータ (CreateDate / CreationDate / Duration) とGPS配列のキャッシュ。
+# 同じ .360 を診断 → GoPro Playerでカット → 再診断 → Helper と何度も開くので、
+# 2回目以降は exiftool もGPMFの読み出しも行わずに済ませる。
+# キーはファイルサイズ・更新時刻・先頭/中央/末尾の部分ハッシュ。
+# 中身は gpmf_reader.write_track のバイナリ (メタデータの JSON + 各列をそのまま並べたもの)。
+
+CACHE_VERSION = 3
+CACHE_EXT = ".track"
+OLD_EXTS = (".npz",) # 以前の形式 (キーが変わったので読まれない。容量の計算と削除の対象にする)
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+HASH_BLOCK = 1024 * 1024
+TMP_EXT = ".tmp"
+STALE_TMP_SEC = 3600 # これより古い書きかけの一時ファイルは、落ちたプロセスの残骸とみなして消す
+
+
+def default_cache_dir(name="telemetry"):
+    """ OSごとのキャッシュ置き場 (地図タイルのキャッシュも同じ場所に置く) """
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "GoProStreetViewHelper", name)
+
+
+def file_key(path):
+    """ サイズ・更新時刻・部分ハッシュから作るキー (数GBのファイルでも3MBしか読まない) """
+    st = os.stat(path)
+    h = hashlib.sha1(f"{CACHE_VERSION}:{st.st_size}:{st.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        for pos in (0, st.st_size // 2, max(st.st_size - HASH_BLOCK, 0)):
+            f.seek(pos)
+            h.update(f.read(HASH_BLOCK))
+    return h.hexdigest()
+
+
+class TelemetryCache:
+    def __init__(self, cache_dir=None, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{CACHE_EXT}")
+
+    def get(self, path):
+        """ (メタデータ, GPSData) を返す。無ければ None """
+        try:
+            entry = self._path(file_key(path))
+            with open(entry, "rb") as f:
+                gps, meta = read_track(f)
+            # 最近使ったものとして更新時刻を進める (LRU)
+            os.utime(entry)
+            return meta, gps
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def put(self, path, meta, gps):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entry = self._path(file_key(path))
+            # 書きかけのファイルを読まれないよう、一時ファイルに書いてから置き換える
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=TMP_EXT)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    write_track(gps, f, meta)
+                os.replace(tmp, entry)
+            except BaseException:
+                # 書けなかった一時ファイルを残さない
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+            self.evict()
+        except OSError as e:
+            print(f"Cache Error: {e}")
+
+    def sweep_tmp(self, max_age=STALE_TMP_SEC):
+        """ 強制終了などで残った一時ファイルを消す (書き込み中のものは新しいので残す) """
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(TMP_EXT):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    if now - os.stat(path).st_mtime >= max_age:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """ 合計サイズが上限を超えたら、使われていない順に削除する """
+        self.sweep_tmp()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((CACHE_EXT,) + OLD_EXTS):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            self.sweep_tmp()
+            for name in os.listdir(self.cache_dir):
+                if name.endswith((CACHE_EXT,) + OLD_EXTS):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+_cache = None
+
+
+def get_cache():
+    """ 両ツール・バッチ処理で共有するキャッシュ """
+    global _cache
+    if _cache is None:
+        _cache = TelemetryCache()
+    return _cache
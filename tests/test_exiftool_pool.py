@@ -0,0 +1,71 @@
+import sys
+import threading
+from exiftool_pool import ExifToolProcess, ExifToolPool
+
+# stdout より先に stderr へ 1MB の警告を出す exiftool の代役
+NOISY_EXIFTOOL = r'''
+import sys
+args = []
+for line in sys.stdin:
+    line = line.rstrip("\r\n")
+    if line.startswith("-execute"):
+        marker = args[args.index("-echo4") + 1]
+        sys.stderr.write("Warning: [minor] Bad atom\n" * 40000)
+        sys.stderr.flush()
+        sys.stdout.write("x" * 200000 + "\n{ready%s}\n" % line[8:])
+        sys.stdout.flush()
+        sys.stderr.write(marker + "\n")
+        sys.stderr.flush()
+        args = []
+    elif line == "-stay_open":
+        break
+    else:
+        args.append(line)
+'''
+
+
+def make_exiftool(tmp_path):
+    script = tmp_path / "noisy_exiftool.py"
+    script.write_text(NOISY_EXIFTOOL)
+    cmd = tmp_path / "noisy_exiftool"
+    cmd.write_text(f"#!/bin/sh\nexec {sys.executable} {script} \"$@\"\n")
+    cmd.chmod(0o755)
+    return str(cmd)
+
+
+def run_with_timeout(fn, timeout=20):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "exiftool と互いに待ち合っている"
+    return result[0]
+
+
+def test_large_stderr_does_not_block(tmp_path):
+    proc = ExifToolProcess(make_exiftool(tmp_path))
+    try:
+        for _ in range(2):
+            out = run_with_timeout(lambda: proc.execute("-ver"))
+            assert out.strip() == b"x" * 200000
+            chunks = run_with_timeout(lambda: list(proc.execute_iter("-ver")))
+            assert b"".join(chunks).strip() == b"x" * 200000
+        assert proc.alive()
+    finally:
+        proc.proc.kill()
+
+
+def test_waiter_wakes_when_process_dies(tmp_path):
+    pool = ExifToolPool(make_exiftool(tmp_path), size=1)
+    got = []
+    try:
+        with pool.worker() as proc:
+            waiter = threading.Thread(target=lambda: got.append(pool.execute("-ver")), daemon=True)
+            waiter.start()
+            # 使用中のプロセスが落ちると、空いた枠で待っていたスレッドが起動し直す
+            proc.proc.kill()
+            proc.proc.wait()
+        waiter.join(20)
+        assert got and got[0].strip() == b"x" * 200000
+    finally:
+        pool.close()
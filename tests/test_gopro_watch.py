@@ -0,0 +1,80 @@
+import os
+import gopro_watch
+from gopro_watch import JobStore, Watcher, MAX_ATTEMPTS
+
+
+def crash_or_ok(path_360, path_mp4, *args):
+    """ process_one の代わり: 名前に crash を含むファイルではワーカーごと落ちる """
+    if "crash" in path_360:
+        os._exit(1)
+    return {"file": path_360, "error": None}
+
+
+def make_store(tmp_path, names):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(b"x")
+        store.enqueue(str(path), None, gopro_watch.fingerprint(str(path)))
+    return store
+
+
+def states(store):
+    return dict(store.db.execute("SELECT path_360, state FROM jobs").fetchall())
+
+
+def test_broken_pool_is_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(gopro_watch, "process_one", crash_or_ok)
+    store = make_store(tmp_path, ["crash.360"])
+    watcher = Watcher(str(tmp_path), store, 1, None)
+    watcher.pool = watcher.make_pool()
+    try:
+        assert not watcher.dispatch()
+        assert watcher.collect(30)
+        watcher.restart_pool()
+        # 作り直したプールで次のジョブを処理できる
+        ok = tmp_path / "ok.360"
+        ok.write_bytes(b"x")
+        store.enqueue(str(ok), None, gopro_watch.fingerprint(str(ok)))
+        assert not watcher.dispatch()
+        while watcher.running:
+            assert not watcher.collect(30)
+    finally:
+        watcher.pool.shutdown()
+    assert states(store) == {str(tmp_path / "crash.360"): "failed", str(ok): "done"}
+
+
+def test_recover_gives_up_after_max_attempts(tmp_path):
+    store = make_store(tmp_path, ["a.360"])
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        assert len(store.take(1)) == 1
+        # 実行中のまま止まった (プロセスごと落ちた) ことにする
+        if attempt < MAX_ATTEMPTS:
+            assert store.recover() == (1, 0)
+    assert store.recover() == (0, 1)
+    assert states(store) == {str(tmp_path / "a.360"): "failed"}
+    assert store.retry() == 1
+    assert store.take(1)
+
+
+def replace_input(path_360, path_mp4, *args):
+    """ process_one の代わり: 処理中に .360 が上書きコピーされた状態を作る """
+    with open(path_360, "ab") as f:
+        f.write(b"new copy")
+    return {"file": path_360, "error": None}
+
+
+def test_input_replaced_during_run_is_queued_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(gopro_watch, "process_one", replace_input)
+    store = make_store(tmp_path, ["a.360"])
+    watcher = Watcher(str(tmp_path), store, 1, None)
+    watcher.pool = watcher.make_pool()
+    try:
+        watcher.dispatch()
+        while watcher.running:
+            watcher.collect(30)
+    finally:
+        watcher.pool.shutdown()
+    assert watcher.rescan
+    path = str(tmp_path / "a.360")
+    assert store.enqueue(path, None, gopro_watch.fingerprint(path))
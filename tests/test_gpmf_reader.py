@@ -0,0 +1,55 @@
+import struct
+import numpy as np
+from datetime import datetime, timezone
+from gpmf_reader import GPSData, parse_gpmf_payload
+from benchmarks.fixtures import _klv
+
+T0 = datetime(2024, 5, 1, 2, 20, tzinfo=timezone.utc)
+
+
+def gps5_strm(points):
+    gpsu = T0.strftime('%y%m%d%H%M%S.%f')[:16].encode()
+    data = np.array([[round(lat * 1e7), round(lon * 1e7), 40000, 0, 0] for lat, lon in points], dtype='>i4')
+    strm = (_klv(b'STNM', b'c', 1, b'GPS', 3) + _klv(b'GPSU', b'U', 16, gpsu, 1) +
+            _klv(b'SCAL', b'l', 4, struct.pack('>5i', 10000000, 10000000, 1000, 1000, 100), 5) +
+            _klv(b'GPS5', b'l', 20, data.tobytes(), len(points)))
+    return _klv(b'STRM', b'\0', 1, strm, len(strm))
+
+
+def gps9_strm(points, step=0.1):
+    days = (T0 - datetime(2000, 1, 1, tzinfo=timezone.utc)).days
+    secs = (T0 - T0.replace(hour=0, minute=0)).total_seconds()
+    recs = b''.join(struct.pack('>lllllllHH', round(lat * 1e7), round(lon * 1e7), 40000, 0, 0, days,
+                                round((secs + i * step) * 1000), 100, 3)
+                    for i, (lat, lon) in enumerate(points))
+    scal = struct.pack('>9i', 10000000, 10000000, 1000, 1000, 100, 1, 1000, 100, 1)
+    strm = (_klv(b'STNM', b'c', 1, b'GPS9', 4) + _klv(b'SCAL', b'l', 4, scal, 9) +
+            _klv(b'TYPE', b'c', 1, b'lllllllSS', 9) + _klv(b'GPS9', b'?', 32, recs, len(points)))
+    return _klv(b'STRM', b'\0', 1, strm, len(strm))
+
+
+def devc(*streams):
+    body = _klv(b'DVID', b'L', 4, struct.pack('>I', 1), 1) + b''.join(streams)
+    return _klv(b'DEVC', b'\0', 1, body, len(body))
+
+
+POINTS = [(35.68 + i * 1e-5, 139.76 + i * 1e-5) for i in range(10)]
+
+
+def test_gps9_is_preferred_over_gps5():
+    out = GPSData()
+    parse_gpmf_payload(devc(gps5_strm(POINTS), gps9_strm(POINTS)), 1.0, out)
+    # 同じ測位が2回入らず、時刻が戻らない
+    assert len(out) == len(POINTS)
+    times = np.frombuffer(out.time)
+    assert np.all(np.diff(times) > 0)
+    assert times[0] == T0.timestamp()
+    assert np.allclose(np.frombuffer(out.lat), [p[0] for p in POINTS])
+    assert len(out.sync_utc) == 1
+
+
+def test_gps5_is_used_without_gps9():
+    out = GPSData()
+    parse_gpmf_payload(devc(gps5_strm(POINTS)), 1.0, out)
+    assert len(out) == len(POINTS)
+    assert np.allclose(np.frombuffer(out.lon), [p[1] for p in POINTS])
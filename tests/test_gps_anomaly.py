@@ -0,0 +1,16 @@
+import numpy as np
+from gpmf_reader import GPSData, QUALITY_NO_FIX, QUALITY_JUMP
+from gps_anomaly import mark_quality
+
+
+def test_mark_quality_leaves_gps_appendable():
+    gps = GPSData()
+    for lat, lon in [(35.0, 135.0), (0.0, 0.0), (35.00001, 135.0), (36.0, 135.0), (35.00002, 135.0)]:
+        gps.append(lat, lon, 0.0, 0.0)
+    flags = mark_quality(gps)
+    assert bytes(gps.quality) == flags.tobytes()
+    assert flags[1] & QUALITY_NO_FIX and flags[3] & QUALITY_JUMP and flags[0] == 0
+    # 返した配列があっても、GPSData に点を足せる (BufferError にならない)
+    gps.append(35.00003, 135.0, 0.0, 0.0)
+    assert len(gps) == 6 and len(flags) == 5
+    assert np.array_equal(np.frombuffer(gps.quality, dtype=np.uint8)[:5], flags)
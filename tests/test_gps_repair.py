@@ -0,0 +1,33 @@
+import io
+from benchmarks.fixtures import write_gpx_fixture
+from gpx_stream import read_gpx, iter_trkpts
+from gps_repair import repair_gpx_file, write_repaired_gpx, iter_chunks, iter_point_chunks
+
+
+def test_streamed_repair_matches_in_memory(tmp_path):
+    src = str(tmp_path / "track.gpx")
+    write_gpx_fixture(src, 30000)
+    expected = io.StringIO()
+    expected_stats = write_repaired_gpx(iter_chunks(read_gpx(src)), expected, "track")
+    assert expected_stats["interpolated"] and expected_stats["zero"]
+    # チャンクの区切りで異常区間が持ち越されても、全体を読み込んだ場合と同じ結果になる
+    dst = str(tmp_path / "track_repaired.gpx")
+    stats = repair_gpx_file(src, dst, size=1000)
+    assert stats == expected_stats
+    assert open(dst, encoding="utf-8").read() == expected.getvalue()
+
+
+def test_point_chunks_are_read_lazily(tmp_path):
+    src = str(tmp_path / "track.gpx")
+    write_gpx_fixture(src, 5000)
+    read = []
+
+    def points():
+        for p in iter_trkpts(src):
+            read.append(p)
+            yield p
+    chunks = iter_point_chunks(points(), size=1000)
+    # 最初のチャンクを返した時点では、その分しか読んでいない (GPX全体を読み込まない)
+    lat, lon, ele, time = next(chunks)
+    assert len(lat) == len(read) == 1000
+    assert sum(len(c[0]) for c in chunks) == 4000
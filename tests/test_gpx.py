@@ -0,0 +1,27 @@
+import io
+import math
+from gpmf_reader import GPSData, write_gpx
+from gpx_stream import read_gpx
+
+
+def test_missing_ele_and_time_are_omitted():
+    gps = GPSData()
+    gps.append(35.0, 135.0, 10.5, 1700000000.25)
+    gps.append(35.1, 135.1, math.nan, math.nan)
+    out = io.StringIO()
+    write_gpx(gps, out, "track")
+    text = out.getvalue()
+    assert "nan" not in text
+    assert '<trkpt lat="35.1" lon="135.1"></trkpt>' in text
+    assert "<time>2023-11-14T22:13:20.250Z</time>" in text
+    back = read_gpx(io.BytesIO(text.encode("utf-8")))
+    assert len(back) == 2 and math.isnan(back.time[1]) and back.alt[0] == 10.5
+
+
+def test_name_is_escaped():
+    gps = GPSData()
+    gps.append(35.0, 135.0, 10.0, 1700000000.0)
+    out = io.StringIO()
+    write_gpx(gps, out, "Tom & Jerry <1>")
+    assert "<name>Tom &amp; Jerry &lt;1&gt;</name>" in out.getvalue()
+    assert len(read_gpx(io.BytesIO(out.getvalue().encode("utf-8")))) == 1
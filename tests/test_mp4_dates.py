@@ -0,0 +1,124 @@
+import os
+import errno
+import struct
+import pytest
+import mp4_dates
+from mp4_dates import fix_dates, patch_dates, clone_file, parse_exif_date, MP4PatchError
+from mp4_index import MP4Index
+from benchmarks.fixtures import write_gpmf_fixture, _atom, _full
+
+DATE = "2023:03:04 05:06:07"
+
+
+def read_dates(path):
+    """ 全ての作成・更新日時フィールドの値 """
+    with MP4Index(path) as index:
+        fields = index.date_fields()
+    data = open(path, "rb").read()
+    return [struct.unpack_from('>I' if width == 4 else '>Q', data, pos)[0] for pos, width in fields]
+
+
+def diff_positions(a, b):
+    return {i for i, (x, y) in enumerate(zip(a, b)) if x != y}
+
+
+@pytest.fixture
+def gpmf_mp4(tmp_path):
+    path = str(tmp_path / "GS010001.mp4")
+    write_gpmf_fixture(path, 500)
+    return path
+
+
+def write_v1_mp4(path, created):
+    """ mvhd / tkhd が version 1 (64bit)、mdhd が version 0 (32bit) のMP4 """
+    mvhd = _full(b'mvhd', struct.pack('>QQIQ', created, created, 1000, 5000) + bytes(80), version=1)
+    tkhd = _full(b'tkhd', struct.pack('>QQIIQ', created, created, 1, 0, 5000) + bytes(60), version=1)
+    mdhd = _full(b'mdhd', struct.pack('>IIII', created, created, 1000, 5000) + bytes(4))
+    hdlr = _full(b'hdlr', struct.pack('>I4s', 0, b'vide') + bytes(13))
+    trak = _atom(b'trak', tkhd + _atom(b'mdia', mdhd + hdlr))
+    with open(path, "wb") as f:
+        f.write(_atom(b'ftyp', b'mp41' + bytes(4)) + _atom(b'mdat', bytes(1000)) + _atom(b'moov', mvhd + trak))
+
+
+def test_fix_dates_copy_round_trip(gpmf_mp4, tmp_path):
+    target = str(tmp_path / "fixed.mp4")
+    before = open(gpmf_mp4, "rb").read()
+    fix_dates(gpmf_mp4, target, DATE)
+    # mvhd と2トラック分の tkhd / mdhd、それぞれ作成・更新日時
+    assert read_dates(target) == [parse_exif_date(DATE)] * 10
+    with MP4Index(target) as index:
+        assert index.metadata()["CreateDate"] == DATE
+    # 元のファイルはそのまま、複製は日時のフィールド以外同じ
+    after = open(target, "rb").read()
+    assert open(gpmf_mp4, "rb").read() == before
+    assert len(after) == len(before)
+    with MP4Index(target) as index:
+        allowed = {pos + k for pos, width in index.date_fields() for k in range(width)}
+    assert diff_positions(before, after) <= allowed
+
+
+def test_fix_dates_in_place(gpmf_mp4):
+    fix_dates(gpmf_mp4, gpmf_mp4, DATE)
+    assert set(read_dates(gpmf_mp4)) == {parse_exif_date(DATE)}
+
+
+def test_v1_and_v0_boxes(tmp_path):
+    path = str(tmp_path / "v1.mp4")
+    write_v1_mp4(path, 100)
+    with MP4Index(path) as index:
+        assert [width for _, width in index.date_fields()] == [8, 8, 8, 8, 4, 4]
+    assert patch_dates(path, parse_exif_date(DATE)) == 6
+    assert read_dates(path) == [parse_exif_date(DATE)] * 6
+    with MP4Index(path) as index:
+        # 日時の後ろ (timescale / duration) は壊していない
+        assert index.header_times(index.moov.child(b'mvhd'))[2:] == (1000, 5000)
+        assert index.header_times(index.tracks[0].mdhd)[2:] == (1000, 5000)
+
+
+def test_date_beyond_32bit_is_refused(tmp_path):
+    # mdhd が 32bit なので、2040年以降の日時は書けない。作りかけの複製も残さない
+    path = str(tmp_path / "v1.mp4")
+    write_v1_mp4(path, 100)
+    target = str(tmp_path / "fixed.mp4")
+    with pytest.raises(MP4PatchError):
+        fix_dates(path, target, "2041:01:01 00:00:00")
+    assert not os.path.exists(target)
+    assert set(read_dates(path)) == {100}
+
+
+def test_not_mp4_is_refused_before_copy(tmp_path):
+    path = tmp_path / "broken.mp4"
+    path.write_bytes(b"not an mp4" * 100)
+    target = str(tmp_path / "fixed.mp4")
+    with pytest.raises(MP4PatchError):
+        fix_dates(str(path), target, DATE)
+    assert not os.path.exists(target)
+
+
+@pytest.mark.skipif(not hasattr(os, "copy_file_range"), reason="copy_file_range がない")
+def test_clone_falls_back_to_copy_file_range(gpmf_mp4, tmp_path, monkeypatch):
+    monkeypatch.setattr(mp4_dates, "_reflink", lambda src, dst: False)
+    target = str(tmp_path / "clone.mp4")
+    assert clone_file(gpmf_mp4, target) == "copy_file_range"
+    assert open(target, "rb").read() == open(gpmf_mp4, "rb").read()
+
+
+def unsupported(src, dst, count):
+    # 対応していないファイルシステム
+    raise OSError(errno.EOPNOTSUPP, "not supported")
+
+
+def stops_early(src, dst, count):
+    # 途中までしかコピーしない (書き込んだ分は捨てて最初からコピーし直す)
+    if os.lseek(dst, 0, os.SEEK_CUR):
+        return 0
+    return os.write(dst, os.read(src, 1000))
+
+
+@pytest.mark.parametrize("copy_file_range", [unsupported, stops_early])
+def test_clone_falls_back_to_plain_copy(gpmf_mp4, tmp_path, monkeypatch, copy_file_range):
+    monkeypatch.setattr(mp4_dates, "_reflink", lambda src, dst: False)
+    monkeypatch.setattr(os, "copy_file_range", copy_file_range, raising=False)
+    target = str(tmp_path / "clone.mp4")
+    assert clone_file(gpmf_mp4, target) == "copy"
+    assert open(target, "rb").read() == open(gpmf_mp4, "rb").read()
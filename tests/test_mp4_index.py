@@ -0,0 +1,39 @@
+import struct
+from mp4_index import MP4Index
+from benchmarks.fixtures import _atom, _full
+
+
+def mvhd():
+    return _full(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 5000) + bytes(80))
+
+
+def keys_meta(value):
+    key = b'com.apple.quicktime.creationdate'
+    keys = _full(b'keys', struct.pack('>I', 1) + struct.pack('>I4s', 8 + len(key), b'mdta') + key)
+    item = _atom(struct.pack('>I', 1), _atom(b'data', struct.pack('>II', 1, 0) + value.encode()))
+    hdlr = _full(b'hdlr', bytes(4) + b'mdta' + bytes(13))
+    return _atom(b'meta', hdlr + keys + _atom(b'ilst', item))
+
+
+def udta_day(value):
+    return _atom(b'udta', _atom(b'\xa9day', struct.pack('>HH', len(value), 0) + value.encode()))
+
+
+def write_mp4(path, *moov):
+    path.write_bytes(_atom(b'ftyp', b'isom' + bytes(4)) + _atom(b'moov', mvhd() + b''.join(moov)))
+    return str(path)
+
+
+def test_creation_date_from_keys(tmp_path):
+    path = write_mp4(tmp_path / "a.mp4", keys_meta("2024-05-01T11:20:00+0900"), udta_day("2023-01-01T00:00:00Z"))
+    with MP4Index(path) as index:
+        meta = index.metadata()
+    assert meta["CreationDate"] == "2024:05:01 11:20:00+09:00"
+    assert meta["Duration"] == 5
+
+
+def test_udta_day_is_not_creation_date(tmp_path):
+    # ©day は exiftool では ContentCreateDate。CreationDate として時差の計算に使わない
+    path = write_mp4(tmp_path / "a.mp4", udta_day("2024-05-01T11:20:00+0900"))
+    with MP4Index(path) as index:
+        assert "CreationDate" not in index.metadata()
@@ -0,0 +1,70 @@
+import os
+import types
+from contextlib import nullcontext
+import pytest
+import pipeline_trace
+from pipeline_trace import process_usage, add_child_usage, UNAVAILABLE
+
+
+class FakeMem:
+    def __init__(self, rss, peak_wset=None):
+        self.rss = rss
+        if peak_wset is not None:
+            self.peak_wset = peak_wset
+
+
+def fake_psutil(mem):
+    """ Windows / macOS の psutil の代わり (cpu_times と memory_info だけ) """
+    class Error(Exception):
+        pass
+
+    class Process:
+        def __init__(self, pid):
+            if pid < 0:
+                raise Error(pid)
+
+        def oneshot(self):
+            return nullcontext()
+
+        def cpu_times(self):
+            return types.SimpleNamespace(user=1.5, system=0.5)
+
+        def memory_info(self):
+            return mem
+    return types.SimpleNamespace(Process=Process, Error=Error)
+
+
+@pytest.fixture
+def no_proc(monkeypatch):
+    """ /proc の無い環境にする """
+    monkeypatch.setattr(pipeline_trace, "_proc_usage", lambda pid: None)
+    real_isdir = os.path.isdir
+    monkeypatch.setattr(os.path, "isdir", lambda p: False if p.startswith("/proc") else real_isdir(p))
+
+
+def test_psutil_is_used_when_available(monkeypatch, no_proc):
+    monkeypatch.setattr(pipeline_trace, "_psutil", fake_psutil(FakeMem(5000, peak_wset=8000)))
+    assert process_usage(1) == {"cpu": 2.0, "rss": 5000, "peak_rss": 8000}
+    assert process_usage(-1) is None
+    fields = {}
+    add_child_usage(fields, {"cpu": 1.0}, process_usage(1))
+    assert fields == {"child_cpu": 1.0, "child_rss": 5000, "child_peak_rss": 8000}
+
+
+def test_unavailable_without_psutil_or_proc(monkeypatch, no_proc):
+    monkeypatch.setattr(pipeline_trace, "_psutil", False)
+    assert process_usage(os.getpid()) is None
+    fields = {}
+    add_child_usage(fields, None, None)
+    assert fields == {"child_usage": UNAVAILABLE}
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="/proc がない")
+def test_proc_fallback(monkeypatch):
+    monkeypatch.setattr(pipeline_trace, "_psutil", False)
+    usage = process_usage(os.getpid())
+    assert usage["rss"] > 0 and usage["peak_rss"] >= usage["rss"]
+    # 終了済みのプロセスは None (取得できない環境とは区別する)
+    fields = {}
+    add_child_usage(fields, usage, None)
+    assert fields == {}
@@ -0,0 +1,51 @@
+import os
+import time
+import pytest
+import telemetry_cache
+from gpmf_reader import GPSData
+from telemetry_cache import TelemetryCache, STALE_TMP_SEC
+
+
+def make_gps():
+    gps = GPSData()
+    gps.append(35.0, 135.0, 10.0, 1700000000.0)
+    return gps
+
+
+def tmp_files(cache_dir):
+    return [n for n in os.listdir(cache_dir) if n.endswith(".tmp")]
+
+
+def test_failed_write_leaves_no_tmp(tmp_path, monkeypatch):
+    src = tmp_path / "a.360"
+    src.write_bytes(b"x" * 100)
+    cache = TelemetryCache(str(tmp_path / "cache"))
+
+    def broken_write(gps, f, meta):
+        f.write(b"partial")
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(telemetry_cache, "write_track", broken_write)
+    cache.put(str(src), {"Duration": 1.0}, make_gps())
+    assert tmp_files(cache.cache_dir) == []
+    assert cache.get(str(src)) is None
+
+    # OSError 以外 (書き出し側の不具合) でも一時ファイルは消してから伝える
+    monkeypatch.setattr(telemetry_cache, "write_track", lambda gps, f, meta: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        cache.put(str(src), {"Duration": 1.0}, make_gps())
+    assert tmp_files(cache.cache_dir) == []
+
+
+def test_stale_tmp_files_are_swept(tmp_path):
+    cache = TelemetryCache(str(tmp_path))
+    old, new = tmp_path / "old.tmp", tmp_path / "new.tmp"
+    old.write_bytes(b"x")
+    new.write_bytes(b"x")
+    past = time.time() - STALE_TMP_SEC - 10
+    os.utime(old, (past, past))
+    cache.evict()
+    # 他のプロセスが書いている途中かもしれない新しいものは残す
+    assert tmp_files(tmp_path) == ["new.tmp"]
+    os.utime(new, (past, past))
+    cache.clear()
+    assert tmp_files(tmp_path) == []
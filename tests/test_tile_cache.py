@@ -0,0 +1,107 @@
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from tile_cache import TileCache, TileSource, OFFLINE_RETRY_SEC
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ /{status}/{z}/{y}.png に status で応答する (200 なら b"png") """
+    agents = []
+
+    def do_GET(self):
+        Handler.agents.append(self.headers["User-Agent"])
+        status = int(self.path.strip("/").split("/")[0])
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "120")
+        self.send_header("Content-Length", "3")
+        self.end_headers()
+        self.wfile.write(b"png")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}/{{x}}/{{z}}/{{y}}.png"
+    httpd.shutdown()
+
+
+def make_source(tmp_path, url):
+    return TileSource(TileCache(str(tmp_path / "tiles.mbtiles")), url=url)
+
+
+def test_not_found_does_not_back_off(tmp_path, server):
+    source = make_source(tmp_path, server)
+    try:
+        assert source.fetch(0, 404, 0) is None
+        assert source.offline_until == 0
+        assert source.fetch(0, 200, 0) == b"png"
+        assert "github.com" in Handler.agents[-1]
+    finally:
+        source.close()
+
+
+@pytest.mark.parametrize("status, wait", [(429, 120), (503, OFFLINE_RETRY_SEC)])
+def test_overload_backs_off(tmp_path, server, status, wait):
+    source = make_source(tmp_path, server)
+    try:
+        assert source.fetch(0, status, 0) is None
+        assert source.offline_until - time.monotonic() == pytest.approx(wait, abs=5)
+        # 待っている間はサーバーに取りに行かない
+        count = len(Handler.agents)
+        assert source.fetch(0, 200, 0) is None
+        assert len(Handler.agents) == count
+    finally:
+        source.close()
+
+
+def test_eviction_counts_tiles_from_other_processes(tmp_path):
+    # 2つのツールが同じキャッシュを使う場合 (接続ごとに別のプロセスに相当)
+    path = str(tmp_path / "tiles.mbtiles")
+    a, b = TileCache(path, max_bytes=10000), TileCache(path, max_bytes=10000)
+    try:
+        for i in range(6):
+            a.put(10, i, 0, b"a" * 1000)
+            b.put(10, i, 1, b"b" * 1000)
+        total = a.db.execute("SELECT SUM(size) FROM tiles").fetchone()[0]
+        assert total <= 10000
+        # 後から書いたタイルが残る
+        assert a.has(10, 5, 0) and b.has(10, 5, 1)
+    finally:
+        a.close()
+        b.close()
+
+
+def test_running_total_matches_tiles(tmp_path):
+    path = str(tmp_path / "tiles.mbtiles")
+    cache = TileCache(path, max_bytes=10000)
+    try:
+        cache.put(10, 0, 0, b"a" * 1000)
+        cache.put(10, 0, 0, b"a" * 300) # 置き換え
+        for i in range(1, 15):
+            cache.put(10, i, 0, b"b" * 1000)
+        real = cache.db.execute("SELECT SUM(size) FROM tiles").fetchone()[0]
+        assert cache._total() == real <= 10000
+        cache.clear()
+        assert cache._total() == 0
+    finally:
+        cache.close()
+    # 合計を持っていない (前の版の) キャッシュは、開いたときに一度だけ数える
+    cache = TileCache(path)
+    try:
+        cache.put(10, 0, 0, b"c" * 500)
+        cache.put(10, 1, 0, b"c" * 700)
+        with cache.db:
+            cache.db.execute("DELETE FROM metadata WHERE name='cache_bytes'")
+    finally:
+        cache.close()
+    cache = TileCache(path)
+    try:
+        assert cache._total() == 1200
+    finally:
+        cache.close()
@@ -0,0 +1,68 @@
+import time
+import numpy as np
+from track_index import TrackIndex
+
+
+def loop_track(n, radius_m=1600.0, lat0=35.0, lon0=135.0):
+    """ 半径 radius_m の周回コース (中心から一番近い点まで radius_m 離れている) """
+    a = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    lat = lat0 + np.degrees(radius_m * np.sin(a) / 6371000)
+    lon = lon0 + np.degrees(radius_m * np.cos(a) / (6371000 * np.cos(np.radians(lat0))))
+    return lat, lon
+
+
+def brute_force(index, lat, lon):
+    ok = ~((index.lat == 0) & (index.lon == 0))
+    x, y = index._project(index.lat[ok], index.lon[ok])
+    qx, qy = index._project(np.float64(lat), np.float64(lon))
+    d = np.hypot(x - qx, y - qy)
+    k = int(np.argmin(d))
+    return int(np.flatnonzero(ok)[k]), float(d[k])
+
+
+def test_nearest_matches_brute_force():
+    rng = np.random.default_rng(0)
+    lat = 35 + np.cumsum(rng.normal(0, 2e-6, 20000))
+    lon = 135 + np.cumsum(rng.normal(0, 2e-6, 20000))
+    lat[100:120] = lon[100:120] = 0
+    index = TrackIndex(lat, lon)
+    for i in rng.integers(0, len(lat), 200):
+        q = (lat[i] + rng.normal(0, 1e-4), lon[i] + rng.normal(0, 1e-4))
+        if lat[i] == 0:
+            continue
+        assert index.nearest(*q)[1] == brute_force(index, *q)[1]
+
+
+def test_far_from_track_centre_of_loop():
+    # 周回コースの中心をズーム5程度の半径 (30px ≒ 150km) でクリックする
+    lat, lon = loop_track(224000)
+    index = TrackIndex(lat, lon)
+    t0 = time.perf_counter()
+    hit = index.nearest(35.0, 135.0, max_dist=150000)
+    elapsed = time.perf_counter() - t0
+    assert hit is not None
+    assert abs(hit[1] - brute_force(index, 35.0, 135.0)[1]) < 1e-6
+    assert abs(hit[1] - 1600) < 1
+    assert elapsed < 0.5
+
+
+def test_far_from_track_outside_grid():
+    lat, lon = loop_track(50000)
+    index = TrackIndex(lat, lon)
+    # 格子の外 (約 100km 離れた位置)
+    for q in ((36.0, 135.0), (35.0, 136.2), (34.0, 134.0)):
+        assert index.nearest(*q)[1] == brute_force(index, *q)[1]
+        assert index.nearest(*q, max_dist=1000) is None
+
+
+def test_radius_limits_result():
+    lat, lon = loop_track(10000)
+    index = TrackIndex(lat, lon)
+    assert index.nearest(35.0, 135.0, max_dist=1000) is None
+    assert index.nearest(35.0, 135.0, max_dist=1700) is not None
+
+
+def test_empty_and_single_point():
+    assert TrackIndex(np.zeros(3), np.zeros(3)).lookup(35, 135) is None
+    info = TrackIndex([35.0], [135.0]).lookup(35.00001, 135.0)
+    assert info["index"] == 0 and info["dist"] == 1.1
@@ -0,0 +1,43 @@
+import numpy as np
+from track_simplify import build_pyramid, dp_importance, project, zoom_tolerance, MAX_ZOOM, LEVEL_RATIO
+
+
+def wiggly_track(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = 35.68 + np.cumsum(rng.normal(0, 2e-6, n))
+    lon = 139.76 + np.cumsum(rng.normal(5e-6, 2e-6, n))
+    return lat, lon
+
+
+def test_levels_shrink_geometrically():
+    lat, lon = wiggly_track(200000)
+    levels = build_pyramid(lat, lon)
+    assert levels[0][0] == 0
+    zooms = [zoom for zoom, _ in levels]
+    assert zooms == sorted(zooms) and len(set(zooms)) == len(zooms)
+    counts = [len(c) for _, c in levels]
+    for coarse, fine in zip(counts, counts[1:]):
+        assert coarse <= fine * LEVEL_RATIO
+    # 全段階の合計でも、最も細かい段階の2倍を超えない
+    assert sum(counts) <= 2 * counts[-1]
+    assert len(levels) < MAX_ZOOM + 1
+
+
+def test_every_zoom_keeps_its_douglas_peucker_points():
+    lat, lon = wiggly_track(50000, seed=1)
+    levels = build_pyramid(lat, lon)
+    x, y = project(lat, lon)
+    lat0 = float(np.mean(lat))
+    imp = dp_importance(x, y, zoom_tolerance(MAX_ZOOM, lat0))
+    for zoom in range(MAX_ZOOM + 1):
+        # 地図側 (pickLevel) と同じく、最小ズームがズーム以下の最後の段階を使う
+        coords = [c for z, c in levels if z <= zoom][-1]
+        need = np.flatnonzero(imp > zoom_tolerance(zoom, lat0))
+        shown = {tuple(p) for p in coords.tolist()}
+        assert all((lat[i], lon[i]) in shown for i in need)
+
+
+def test_empty_and_tiny():
+    assert build_pyramid([], []) == []
+    levels = build_pyramid([35.0, 35.1], [135.0, 135.1])
+    assert len(levels) == 1 and levels[0][0] == 0 and len(levels[0][1]) == 2
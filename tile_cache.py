@@ -0,0 +1,264 @@
+import os
+import math
+import time
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from telemetry_cache import default_cache_dir
+
+# 地図タイルのオフラインキャッシュ。
+# 撮影現場ではオフラインやテザリングの細い回線で使うことが多く、地図を動かすたびに
+# タイルを取りに行くと長いルートの再描画が止まる。ここでは取得したタイルを
+# MBTiles 形式の SQLite に保存し、容量を超えたら最近使っていないものから消す (LRU)。
+# 地図側は gopro://tile/{z}/{x}/{y}.png を読み (map_bridge)、キャッシュに無い分だけ取得する。
+# ルートを表示するときは fitBounds で使われるズームの範囲を裏で先に取得しておく。
+#
+# タイルの取得先は GOPRO_TILE_URL で差し替えられる (例: benchmarks/fake_tile_server.py)。
+
+TILE_URL = os.environ.get("GOPRO_TILE_URL", "https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png")
+# OSM のタイル利用規約では、アプリを特定して連絡先が分かる User-Agent が必要
+USER_AGENT = os.environ.get("GOPRO_TILE_USER_AGENT", "GoProStreetViewHelper/1.0 "
+                            "(+https://github.com/petarou-archive/gopro-streetview-helper)")
+MAX_TILE_BYTES = 256 * 1024 * 1024
+MAX_ZOOM = 18 # Leaflet の tileLayer の既定の最大ズーム
+TILE_SIZE = 256
+MAX_PREFETCH_TILES = 1500 # 1回の先読みの上限 (OSM の利用規約上、大量の一括取得はしない)
+OFFLINE_RETRY_SEC = 30 # 取得に失敗したら、この間はキャッシュだけで応答する
+MAX_RETRY_AFTER_SEC = 600 # サーバーが Retry-After で指定した待ち時間の上限
+
+
+def lonlat_to_tile(lat, lon, zoom):
+    """ 緯度経度 -> タイル番号 (x, y) (小数のまま) """
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    n = 2 ** zoom
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def fit_zoom(bounds, width, height, max_zoom=MAX_ZOOM):
+    """ Leaflet の fitBounds (padding なし, zoomSnap=1) が選ぶズーム """
+    (south, west), (north, east) = bounds
+    x1, y1 = lonlat_to_tile(north, west, 0)
+    x2, y2 = lonlat_to_tile(south, east, 0)
+    w, h = (x2 - x1) * TILE_SIZE, (y2 - y1) * TILE_SIZE
+    if w <= 0 and h <= 0:
+        return max_zoom
+    scale = min(width / w if w > 0 else math.inf, height / h if h > 0 else math.inf)
+    return max(0, min(max_zoom, math.floor(math.log2(scale))))
+
+
+def tiles_for_bounds(bounds, zoom):
+    """ 範囲にかかるタイル (z, x, y) を中心に近い順に返す """
+    (south, west), (north, east) = bounds
+    n = 2 ** zoom
+    x1, y1 = lonlat_to_tile(north, west, zoom)
+    x2, y2 = lonlat_to_tile(south, east, zoom)
+    xs = range(max(int(x1), 0), min(int(x2), n - 1) + 1)
+    ys = range(max(int(y1), 0), min(int(y2), n - 1) + 1)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    tiles = [(zoom, x, y) for x in xs for y in ys]
+    tiles.sort(key=lambda t: (t[1] + 0.5 - cx) ** 2 + (t[2] + 0.5 - cy) ** 2)
+    return tiles
+
+
+def prefetch_tiles(bounds, width, height, limit=MAX_PREFETCH_TILES):
+    """ fitBounds のズームと前後1段階 (ウィンドウの大きさ変更・1段階のズーム) のタイル
+        上限を超える場合は拡大側の段階を諦める """
+    zoom = fit_zoom(bounds, width, height)
+    tiles = []
+    for z in (zoom, zoom - 1, zoom + 1):
+        if not 0 <= z <= MAX_ZOOM:
+            continue
+        level = tiles_for_bounds(bounds, z)
+        if len(tiles) + len(level) > limit:
+            break
+        tiles += level
+    return tiles
+
+
+def retry_after(headers):
+    """ Retry-After (秒) があればそれを、無ければ OFFLINE_RETRY_SEC を返す """
+    try:
+        sec = float(headers.get("Retry-After", ""))
+    except (TypeError, ValueError, AttributeError):
+        # 日時での指定や、ヘッダが無い場合
+        return OFFLINE_RETRY_SEC
+    return min(max(sec, OFFLINE_RETRY_SEC), MAX_RETRY_AFTER_SEC)
+
+
+class TileCache:
+    """ MBTiles (SQLite) のタイル置き場。tiles に LRU 用の列 (last_used, size) を足している """
+    def __init__(self, path=None, max_bytes=MAX_TILE_BYTES):
+        if path is None:
+            os.makedirs(default_cache_dir("tiles"), exist_ok=True)
+            path = os.path.join(default_cache_dir("tiles"), "osm.mbtiles")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # 地図の要求 (GUIスレッド) と先読みのスレッドから使う
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, "
+                            "tile_row INTEGER, tile_data BLOB, last_used REAL, size INTEGER)")
+            self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles "
+                            "(zoom_level, tile_column, tile_row)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS tile_lru ON tiles (last_used)")
+            if not self.db.execute("SELECT 1 FROM metadata").fetchone():
+                self.db.executemany("INSERT INTO metadata VALUES (?, ?)",
+                                    [("name", "OpenStreetMap cache"), ("format", "png"), ("type", "baselayer")])
+            # タイルの合計バイト数。両ツールが同じファイルに書き込むので、プロセスごとではなく
+            # ファイルの中に持ち、タイルの追加・削除と同じトランザクションで足し引きする
+            if not self.db.execute("SELECT 1 FROM metadata WHERE name='cache_bytes'").fetchone():
+                self.db.execute("INSERT INTO metadata VALUES ('cache_bytes', "
+                                "(SELECT COALESCE(SUM(size), 0) FROM tiles))")
+
+    @staticmethod
+    def _key(z, x, y):
+        # MBTiles の行番号は TMS (南が 0) なので、XYZ (北が 0) から反転する
+        return z, x, (2 ** z - 1) - y
+
+    def _total(self):
+        return int(self.db.execute("SELECT value FROM metadata WHERE name='cache_bytes'").fetchone()[0])
+
+    def _add_total(self, delta):
+        self.db.execute("UPDATE metadata SET value = CAST(value AS INTEGER) + ? WHERE name='cache_bytes'", (delta,))
+
+    def get(self, z, x, y):
+        """ タイルの画像データ。無ければ None """
+        key = self._key(z, x, y)
+        with self.lock, self.db:
+            row = self.db.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? "
+                                  "AND tile_row=?", key).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE tiles SET last_used=? WHERE zoom_level=? AND tile_column=? "
+                            "AND tile_row=?", (time.time(), *key))
+        return row[0]
+
+    def has(self, z, x, y):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                                   self._key(z, x, y)).fetchone() is not None
+
+    def put(self, z, x, y, data):
+        key = self._key(z, x, y)
+        with self.lock, self.db:
+            # 先に合計を更新して書き込みのトランザクションを始める (置き換えるタイルの分は引く)
+            self.db.execute("UPDATE metadata SET value = CAST(value AS INTEGER) + ? - COALESCE((SELECT size "
+                            "FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?), 0) "
+                            "WHERE name='cache_bytes'", (len(data), *key))
+            self.db.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)",
+                            (*key, sqlite3.Binary(data), time.time(), len(data)))
+            total = self._total()
+        if total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """ 合計が上限の 9 割になるまで、最近使っていないタイルから消す """
+        with self.lock, self.db:
+            target = self.max_bytes * 0.9
+            # 書き込みのトランザクションを先に始め、数えている間に他のプロセスが足さないようにする
+            self._add_total(0)
+            total = start = self._total()
+            doomed = []
+            # 古い順に必要な分だけ読む (全行は読まない)
+            for rowid, size in self.db.execute("SELECT rowid, size FROM tiles ORDER BY last_used"):
+                if total <= target:
+                    break
+                doomed.append((rowid,))
+                total -= size
+            self.db.executemany("DELETE FROM tiles WHERE rowid=?", doomed)
+            self._add_total(total - start)
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM tiles")
+            self.db.execute("UPDATE metadata SET value='0' WHERE name='cache_bytes'")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class TileSource:
+    """ キャッシュを優先してタイルを返し、無いものは取得してキャッシュする """
+    def __init__(self, cache=None, url=TILE_URL, timeout=10, workers=4):
+        self.cache = cache or TileCache()
+        self.url = url
+        self.timeout = timeout
+        # 先読みが地図の表示中のタイルを待たせないよう、スレッドを分ける
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.prefetch_pool = ThreadPoolExecutor(max_workers=2)
+        self.offline_until = 0.0
+        self.generation = 0 # 先読みの世代 (新しいルートを表示したら古い先読みはやめる)
+
+    def fetch(self, z, x, y):
+        """ ネットワークからタイルを取得する。オフラインなら None """
+        if time.monotonic() < self.offline_until:
+            return None
+        url = self.url.format(s="abc"[(x + y) % 3], z=z, x=x, y=y)
+        try:
+            req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+            with urllib.request.urlopen(req, timeout=self.timeout) as res:
+                data = res.read()
+        except urllib.error.HTTPError as e:
+            # 429 (取得しすぎ) や 5xx (サーバーの障害) では、続けて取りに行かずにしばらく待つ
+            if e.code == 429 or e.code >= 500:
+                self.offline_until = time.monotonic() + retry_after(e.headers)
+            # それ以外 (範囲外のタイルなど) はこのタイルだけ諦める
+            return None
+        except OSError:
+            # 繋がらない間に1枚ずつタイムアウトを待たないよう、しばらくキャッシュだけで応答する
+            self.offline_until = time.monotonic() + OFFLINE_RETRY_SEC
+            return None
+        self.cache.put(z, x, y, data)
+        return data
+
+    def get(self, z, x, y):
+        """ タイルの画像データ (キャッシュに無ければ取得する)。取得できなければ None """
+        data = self.cache.get(z, x, y)
+        if data is None:
+            data = self.fetch(z, x, y)
+        return data
+
+    def get_async(self, z, x, y, callback):
+        """ ワーカースレッドで get() し、callback(data) を呼ぶ (地図の表示を止めない) """
+        self.pool.submit(lambda: callback(self.get(z, x, y)))
+
+    def prefetch(self, bounds, width, height):
+        """ ルートの範囲のタイルを裏で取得する (キャッシュ済みのものは飛ばす)。対象の枚数を返す """
+        self.generation += 1
+        gen = self.generation
+        tiles = prefetch_tiles(bounds, width, height)
+
+        def fetch_one(tile):
+            if gen == self.generation and not self.cache.has(*tile):
+                self.fetch(*tile)
+        for tile in tiles:
+            self.prefetch_pool.submit(fetch_one, tile)
+        return len(tiles)
+
+    def cancel_prefetch(self):
+        self.generation += 1
+
+    def close(self):
+        self.cancel_prefetch()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.prefetch_pool.shutdown(wait=False, cancel_futures=True)
+        self.cache.close()
+
+
+_source = None
+
+
+def get_tile_source():
+    """ 両ツールで共有するタイルの取得元 """
+    global _source
+    if _source is None:
+        _source = TileSource()
+    return _source
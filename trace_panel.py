@@ -0,0 +1,120 @@
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QComboBox, QTableWidget,
+                               QTableWidgetItem, QPushButton, QFileDialog, QMessageBox, QLabel,
+                               QHeaderView)
+from PySide6.QtCore import Qt
+from pipeline_trace import summarize, write_jsonl, write_chrome_trace, UNAVAILABLE
+
+# 処理時間の内訳 (pipeline_trace の記録) を表示・書き出すダイアログ。
+# ジョブを選ぶとその span を開始順に、「すべて」を選ぶと段階ごとの合計を表示する。
+
+# 表に出さない (列として表示済みの) 項目
+HIDDEN_FIELDS = ("name", "file", "pid", "tid", "ts", "dur", "cpu")
+
+
+def format_fields(record):
+    """ span の追加項目を 'points=1234 bytes_read=5.2MB' のように並べる """
+    parts = []
+    for key, value in record.items():
+        if key in HIDDEN_FIELDS:
+            continue
+        if key == "child_usage" and value == UNAVAILABLE:
+            parts.append("子プロセスのCPU・メモリ: このプラットフォームでは取得できません")
+            continue
+        if isinstance(value, int) and not isinstance(value, bool) and ("bytes" in key or "rss" in key):
+            value = f"{value / 1e6:.1f}MB"
+        parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+
+class TraceDialog(QDialog):
+    """ traces: pipeline_trace.Trace のリスト (JobQueue.traces) """
+    def __init__(self, traces, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("処理時間の内訳")
+        self.resize(900, 500)
+        self.traces = list(traces)
+
+        layout = QVBoxLayout(self)
+        self.combo = QComboBox()
+        self.combo.addItem("すべて (段階ごとの合計)")
+        for t in self.traces:
+            self.combo.addItem(t.label or "(名前なし)")
+        self.combo.currentIndexChanged.connect(self.refresh)
+        layout.addWidget(self.combo)
+
+        self.table = QTableWidget()
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        layout.addWidget(self.table)
+        self.label_total = QLabel()
+        layout.addWidget(self.label_total)
+
+        buttons = QHBoxLayout()
+        self.btn_jsonl = QPushButton("JSON Lines で保存")
+        self.btn_jsonl.clicked.connect(self.export_jsonl)
+        self.btn_chrome = QPushButton("Chrome トレース形式で保存")
+        self.btn_chrome.clicked.connect(self.export_chrome)
+        btn_close = QPushButton("閉じる")
+        btn_close.clicked.connect(self.accept)
+        buttons.addWidget(self.btn_jsonl)
+        buttons.addWidget(self.btn_chrome)
+        buttons.addStretch()
+        buttons.addWidget(btn_close)
+        layout.addLayout(buttons)
+
+        # 最後のジョブを選んだ状態で開く
+        self.combo.setCurrentIndex(len(self.traces))
+        self.refresh()
+
+    def selected_records(self):
+        index = self.combo.currentIndex()
+        if index <= 0:
+            return [r for t in self.traces for r in t.records()]
+        return self.traces[index - 1].records()
+
+    def set_rows(self, headers, rows):
+        self.table.clear()
+        self.table.setColumnCount(len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, value in enumerate(row):
+                item = QTableWidgetItem(str(value))
+                if j < len(row) - 1:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(i, j, item)
+        self.table.horizontalHeader().setSectionResizeMode(len(headers) - 1, QHeaderView.Stretch)
+
+    def refresh(self):
+        records = self.selected_records()
+        if self.combo.currentIndex() <= 0:
+            rows = [(name, count, f"{total * 1000:.1f}", f"{worst * 1000:.1f}", "")
+                    for name, count, total, worst in summarize(records)]
+            self.set_rows(["段階", "回数", "合計 (ms)", "最大 (ms)", ""], rows)
+            self.label_total.setText(f"{len(self.traces)} 件のジョブ")
+            return
+        records.sort(key=lambda r: r["ts"])
+        t0 = records[0]["ts"] if records else 0
+        rows = [(r["name"], f"{(r['ts'] - t0) * 1000:.1f}", f"{r['dur'] * 1000:.1f}",
+                 f"{r['cpu'] * 1000:.1f}", format_fields(r)) for r in records]
+        self.set_rows(["段階", "開始 (ms)", "時間 (ms)", "CPU (ms)", "詳細"], rows)
+        total = max((r["ts"] + r["dur"] for r in records), default=t0) - t0
+        self.label_total.setText(f"合計 {total * 1000:.1f} ms")
+
+    def export(self, title, pattern, writer):
+        records = self.selected_records()
+        file, _ = QFileDialog.getSaveFileName(self, title, "", pattern)
+        if not file:
+            return
+        try:
+            with open(file, "w", encoding="utf-8") as f:
+                writer(records, f)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"保存失敗: {str(e)}")
+
+    def export_jsonl(self):
+        self.export("Save JSON Lines", "JSON Lines (*.jsonl)", write_jsonl)
+
+    def export_chrome(self):
+        # chrome://tracing や https://ui.perfetto.dev で開ける
+        self.export("Save Chrome Trace", "Chrome Trace (*.json)", write_chrome_trace)
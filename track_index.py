@@ -0,0 +1,163 @@
+import math
+from datetime import datetime, timezone
+import numpy as np
+from gpmf_reader import QUALITY_NO_FIX, QUALITY_JUMP
+from gps_anomaly import haversine
+
+# 地図上の位置から最寄りのGPSサンプル (動画の時刻・速度・異常かどうか) を引く空間索引。
+# 地図をクリック・マウスを動かすたびに全点を走査すると、100万点のトラックでは間に合わない。
+# 点を平面 (メートル) に投影して格子 (グリッド) に振り分け、セル番号順に並べておく。
+# 検索はクリック位置の周りの数セルを、範囲を倍にしながら見る。そこに無ければ (トラックから
+# 離れた位置)、点のあるセルだけをセルまでの距離で絞り込んで調べる (格子全体は作らない)。
+# 未捕捉の (0,0) は地図に描かないので索引にも入れない。
+
+POINTS_PER_CELL = 16 # 1セルに入る点数の目安 (トラックに沿って並んでいる場合)
+MIN_CELL_M = 1.0
+WINDOW_CELLS = 4 # 周りのセルを直接見る範囲。これより遠ければ点のあるセルだけを調べる
+EARTH_RADIUS = 6371000
+
+
+class TrackIndex:
+    """ lat/lon (とサンプルごとの動画上の秒・UTC・品質フラグ) から作る最近傍の索引 """
+    def __init__(self, lat, lon, timeline=None, utc=None, quality=None):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.lat, self.lon = lat, lon
+        self.timeline = None if timeline is None else np.asarray(timeline, dtype=np.float64)
+        self.utc = None if utc is None or not len(utc) else np.asarray(utc, dtype=np.float64)
+        self.quality = np.zeros(len(lat), dtype=np.uint8) if quality is None else np.asarray(quality, dtype=np.uint8)
+        self.speed = self._speeds()
+
+        ids = np.flatnonzero(~((lat == 0) & (lon == 0)) & np.isfinite(lat) & np.isfinite(lon))
+        self.size = len(ids)
+        if not len(ids):
+            return
+        self.lat0 = math.cos(math.radians(float(np.mean(lat[ids]))))
+        x, y = self._project(lat[ids], lon[ids])
+        self.x0, self.y0 = float(x.min()), float(y.min())
+        # セルの大きさはサンプル間隔の中央値から決める (トラックは線状なので面積では決めない)
+        step = np.hypot(np.diff(x), np.diff(y))
+        self.cell = max(float(np.median(step)) * POINTS_PER_CELL if len(step) else 0.0, MIN_CELL_M)
+        cx = ((x - self.x0) // self.cell).astype(np.int64)
+        cy = ((y - self.y0) // self.cell).astype(np.int64)
+        self.ncols, self.nrows = int(cx.max()) + 1, int(cy.max()) + 1
+        keys = cx * self.nrows + cy
+        order = np.argsort(keys, kind="stable")
+        self.px, self.py, self.ids = x[order], y[order], ids[order]
+        self.cell_keys, self.cell_start = np.unique(keys[order], return_index=True)
+        self.cell_end = np.append(self.cell_start[1:], len(order))
+
+    def __len__(self):
+        return self.size
+
+    def _project(self, lat, lon):
+        return (np.radians(lon) * EARTH_RADIUS * self.lat0, np.radians(lat) * EARTH_RADIUS)
+
+    def _speeds(self):
+        """ サンプルごとの速度 (m/s)。次のサンプルまでの距離と時間から求める """
+        n = len(self.lat)
+        t = self.timeline if self.timeline is not None else self.utc
+        if n < 2 or t is None:
+            return np.full(n, np.nan)
+        dist = haversine(self.lat[:-1], self.lon[:-1], self.lat[1:], self.lon[1:])
+        dt = np.diff(t)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            seg = np.where(dt > 0, dist / dt, np.nan)
+        return np.append(seg, seg[-1])
+
+    def _points(self, pos):
+        """ セル (cell_keys の位置) に入っている点の位置 (並べ替え後) をつなげて返す """
+        starts, ends = self.cell_start[pos], self.cell_end[pos]
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.zeros(0, dtype=np.int64)
+        # 各セルの [start, end) をつないだ連番を一度に作る
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return np.arange(lengths.sum(), dtype=np.int64) + offsets
+
+    def _window(self, cx, cy, r):
+        """ (cx, cy) を中心とする (2r+1) 四方のセルに入っている点の位置 (並べ替え後) """
+        cols = np.arange(max(cx - r, 0), min(cx + r, self.ncols - 1) + 1, dtype=np.int64)
+        rows = np.arange(max(cy - r, 0), min(cy + r, self.nrows - 1) + 1, dtype=np.int64)
+        if not len(cols) or not len(rows):
+            return np.zeros(0, dtype=np.int64)
+        keys = (cols[:, None] * self.nrows + rows[None, :]).ravel()
+        pos = np.searchsorted(self.cell_keys, keys)
+        hit = pos < len(self.cell_keys)
+        hit[hit] = self.cell_keys[pos[hit]] == keys[hit]
+        return self._points(pos[hit])
+
+    def _nearest_far(self, x, y, max_dist):
+        """ 周りのセルに無い場合: 点のあるセルだけを、セルまでの距離 (下限) で絞り込んで調べる """
+        x_lo = self.x0 + (self.cell_keys // self.nrows) * self.cell
+        y_lo = self.y0 + (self.cell_keys % self.nrows) * self.cell
+        dx = np.maximum(np.maximum(x_lo - x, x - (x_lo + self.cell)), 0)
+        dy = np.maximum(np.maximum(y_lo - y, y - (y_lo + self.cell)), 0)
+        bound = np.hypot(dx, dy)
+        first = int(np.argmin(bound))
+        if max_dist is not None and bound[first] > max_dist:
+            return None
+        # 一番近いセルの最寄りの点より遠いセルは調べなくてよい
+        s, e = self.cell_start[first], self.cell_end[first]
+        best = float(np.hypot(self.px[s:e] - x, self.py[s:e] - y).min())
+        cand = self._points(np.flatnonzero(bound <= best))
+        d = np.hypot(self.px[cand] - x, self.py[cand] - y)
+        k = int(np.argmin(d))
+        return self._result(cand[k], d[k], max_dist)
+
+    def _result(self, pos, dist, max_dist):
+        if max_dist is not None and dist > max_dist:
+            return None
+        return int(self.ids[pos]), float(dist)
+
+    def nearest(self, lat, lon, max_dist=None):
+        """ 最寄りのサンプルの (番号, 距離(m))。max_dist (m) 以内に無ければ None """
+        if not self.size:
+            return None
+        x, y = self._project(np.float64(lat), np.float64(lon))
+        cx = int((x - self.x0) // self.cell)
+        cy = int((y - self.y0) // self.cell)
+        # 周りの WINDOW_CELLS セルまでは格子を直接見る (範囲を倍にしていく)
+        reach = WINDOW_CELLS
+        if max_dist is not None:
+            reach = min(reach, int(max_dist // self.cell) + 1)
+        gap = max(-cx, cx - self.ncols + 1, -cy, cy - self.nrows + 1, 0)
+        if gap <= reach:
+            r = 1
+            while True:
+                cand = self._window(cx, cy, r)
+                if len(cand):
+                    d = np.hypot(self.px[cand] - x, self.py[cand] - y)
+                    k = int(np.argmin(d))
+                    # 範囲の外の点は r セル分以上離れているので、それより近ければ確定
+                    if d[k] <= r * self.cell:
+                        return self._result(cand[k], d[k], max_dist)
+                if r >= reach:
+                    break
+                r = min(r * 2, reach)
+            if max_dist is not None and max_dist <= reach * self.cell:
+                # 範囲の外の点は max_dist より遠い
+                return self._result(cand[k], d[k], max_dist) if len(cand) else None
+        return self._nearest_far(x, y, max_dist)
+
+    def describe(self, i, dist=None):
+        """ 地図に表示する情報 (JSON にできる dict) """
+        q = int(self.quality[i])
+        info = {"index": i, "lat": float(self.lat[i]), "lon": float(self.lon[i]), "bad": q != 0,
+                "no_fix": bool(q & QUALITY_NO_FIX), "jump": bool(q & QUALITY_JUMP)}
+        if dist is not None:
+            info["dist"] = round(dist, 1)
+        if self.timeline is not None and np.isfinite(self.timeline[i]):
+            info["video"] = round(float(self.timeline[i]), 3)
+        if self.utc is not None and np.isfinite(self.utc[i]):
+            info["utc"] = datetime.fromtimestamp(float(self.utc[i]), timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        if np.isfinite(self.speed[i]):
+            info["speed_kmh"] = round(float(self.speed[i]) * 3.6, 1)
+        return info
+
+    def lookup(self, lat, lon, max_dist=None):
+        """ nearest() + describe()。見つからなければ None """
+        hit = self.nearest(lat, lon, max_dist)
+        if hit is None:
+            return None
+        return self.describe(*hit)
@@ -0,0 +1,112 @@
+import math
+import numpy as np
+
+# 地図に送るトラックを Douglas-Peucker で間引き、ズームレベルごとの段階 (ピラミッド) を作る。
+# 生の18Hzサンプルを全部 Leaflet に渡すと、長時間の走行では数MBの文字列になり再描画も遅い。
+# 各点が「どの許容誤差まで残るか」を1回の分割で求めておき、ズームごとに閾値で切り出す。
+
+EARTH_CIRCUMFERENCE_MPP = 156543.03392 # ズーム0での1ピクセルあたりのメートル (赤道)
+TOLERANCE_PX = 1.0 # 画面上で1ピクセル未満のずれは間引く
+MAX_ZOOM = 18 # OpenStreetMap タイルの最大ズーム
+LEVEL_RATIO = 0.5 # 1つ細かい段階の半分以下に減らないズームは、細かい段階をそのまま使う
+
+
+def project(lat, lon):
+    """ 緯度経度を平均緯度での正距円筒図法 (メートル) に変換する """
+    lat0 = math.radians(float(np.mean(lat))) if len(lat) else 0.0
+    x = np.radians(lon) * 6371000 * math.cos(lat0)
+    y = np.radians(lat) * 6371000
+    return x, y
+
+
+def dp_importance(x, y, min_tolerance=0.0):
+    """ 各点が Douglas-Peucker で残る最大の許容誤差(m)。両端は inf
+        min_tolerance 以下の区間はそれ以上分割しない (どの段階でも残らないため) """
+    n = len(x)
+    imp = np.zeros(n)
+    if n == 0:
+        return imp
+    imp[0] = imp[-1] = np.inf
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        a, b, cap = stack.pop()
+        if b - a < 2:
+            continue
+        px, py = x[a + 1:b], y[a + 1:b]
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            dist = np.hypot(px - x[a], py - y[a])
+        else:
+            dist = np.abs(dy * (px - x[a]) - dx * (py - y[a])) / length
+        k = int(np.argmax(dist))
+        # 親より大きな誤差で残ることはない (閾値で切ったときに DP の結果と一致させる)
+        d = min(float(dist[k]), cap)
+        idx = a + 1 + k
+        imp[idx] = d
+        if d <= min_tolerance:
+            continue
+        stack.append((a, idx, d))
+        stack.append((idx, b, d))
+    return imp
+
+
+def zoom_tolerance(zoom, lat0):
+    """ ズームレベルでの許容誤差(m) """
+    return TOLERANCE_PX * EARTH_CIRCUMFERENCE_MPP * math.cos(math.radians(lat0)) / (2 ** zoom)
+
+
+def build_pyramid(lat, lon, max_zoom=MAX_ZOOM):
+    """ [[最小ズーム, (k, 2) の lat/lon 配列], ...] を返す (最小ズームの昇順) """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if len(lat) == 0:
+        return []
+    x, y = project(lat, lon)
+    lat0 = float(np.mean(lat))
+    imp = dp_importance(x, y, zoom_tolerance(max_zoom, lat0))
+
+    tolerances = [zoom_tolerance(zoom, lat0) for zoom in range(max_zoom + 1)]
+    counts = [np.count_nonzero(imp > t) for t in tolerances]
+    # 細かい段階から見ていき、点数が十分に減るズームだけ段階を作る。
+    # 拡大側では数%しか減らないズームが続くので、全ズーム分の (ほぼ全点の) 複製を作って送らない
+    spans = [] # [最小ズーム, 切り出すズーム] (最小ズームの降順)
+    for zoom in range(max_zoom, -1, -1):
+        if spans and counts[zoom] > counts[spans[-1][1]] * LEVEL_RATIO:
+            spans[-1][0] = zoom
+        else:
+            spans.append([zoom, zoom])
+    levels = []
+    for min_zoom, zoom in reversed(spans):
+        keep = np.flatnonzero(imp > tolerances[zoom])
+        levels.append([min_zoom, np.column_stack((lat[keep], lon[keep]))])
+    return levels
+
+
+# --- 地図 (map_bridge の gopro:// スキーム) に渡すバッファ ---
+
+def pack_coords(lat, lon):
+    """ 緯度・経度の配列を lat, lon 交互の Float64 (リトルエンディアン) に詰める """
+    return np.column_stack((np.asarray(lat, dtype='<f8'), np.asarray(lon, dtype='<f8'))).tobytes()
+
+
+def pack_segments(segments):
+    """ 複数の線分を NaN, NaN の区切りでつないで1つのバッファにする """
+    sep = np.array([[np.nan, np.nan]])
+    parts = []
+    for seg in segments:
+        if parts:
+            parts.append(sep)
+        parts.append(np.asarray(seg, dtype=np.float64).reshape(-1, 2))
+    if not parts:
+        return b""
+    return np.concatenate(parts).astype('<f8').tobytes()
+
+
+def bounds(lat, lon):
+    """ fitBounds 用の [[南, 西], [北, 東]] """
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    if not len(lat):
+        return None
+    return [[float(lat.min()), float(lon.min())], [float(lat.max()), float(lon.max())]]